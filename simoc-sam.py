@@ -459,6 +459,19 @@ def teardown_csvwriter():
     teardown_systemd_unit('csvwriter')
 
 
+@cmd
+@needs_root
+def setup_sqlitewriter():
+    """Setup a systemd service that runs the sqlitewriter."""
+    setup_systemd_unit('sqlitewriter')
+
+@cmd
+@needs_root
+def teardown_sqlitewriter():
+    """Revert the changes made by the setup-sqlitewriter command."""
+    teardown_systemd_unit('sqlitewriter')
+
+
 @cmd
 @needs_root
 def setup_nginx():
@@ -0,0 +1,163 @@
+"""Columnar (Parquet/Arrow IPC) output for the data recorders.
+
+The readings are buffered in memory and written as row groups (or record
+batches) to one file per sensor per hour, with typed columns derived from
+the `type` of the fields in sensors.toml (`float` if not specified).
+
+This requires pyarrow, which is an optional dependency and is only
+imported when a ColumnarWriter is created (since importing it is slow).
+"""
+
+from datetime import datetime
+from pathlib import Path
+
+pa = pq = None  # set by import_pyarrow()
+
+
+# data_format: file suffix
+FORMATS = {'parquet': '.parquet', 'feather': '.arrow'}
+
+# field type: (function used to convert the values, name of the arrow type)
+FIELD_TYPES = {
+    'float': (float, 'float64'),
+    'int': (int, 'int64'),
+    'bool': (bool, 'bool_'),
+    'str': (str, 'string'),
+    'timestamp': (datetime.fromisoformat, 'timestamp'),
+}
+
+
+def import_pyarrow():
+    """Import pyarrow (if it's not imported yet) and return True if available."""
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            return False
+        pa, pq = pyarrow, pyarrow.parquet
+    return True
+
+def check_data_format(data_format):
+    """Raise an error if data_format is not usable by the recorders."""
+    if data_format == 'csv':
+        return
+    if data_format not in FORMATS:
+        raise ValueError(f'Unknown data_format: {data_format!r} '
+                         f'(valid formats: {["csv", *sorted(FORMATS)]})')
+    if not import_pyarrow():
+        raise ImportError(f'pyarrow is required to write {data_format} '
+                          f'files (run "pip install pyarrow")')
+
+def get_field_types(reading_info):
+    """Return a {field: type} dict, including the n/timestamp fields."""
+    types = {'n': 'int', 'timestamp': 'timestamp'}
+    for field, info in reading_info.items():
+        field_type = info.get('type', 'float')
+        if field_type not in FIELD_TYPES:
+            raise ValueError(f'Unknown type for field {field!r}: {field_type!r}'
+                             f' (valid types: {sorted(FIELD_TYPES)})')
+        types[field] = field_type
+    return types
+
+def get_arrow_type(field_type):
+    type_name = FIELD_TYPES[field_type][1]
+    if type_name == 'timestamp':
+        return pa.timestamp('us')
+    return getattr(pa, type_name)()
+
+def convert(value, func):
+    """Convert value using func, returning None if it's missing/invalid."""
+    if value is None or value == '':
+        return None
+    try:
+        return func(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ColumnarWriter:
+    """Buffer the readings of a sensor and write them to columnar files.
+
+    The files are named <name>_<YYYY-MM-DD_HH>.parquet (or .arrow) and
+    stored in dir_path.  The rows are flushed every flush_rows readings,
+    when the hour changes, and on close().  Fields not listed in
+    reading_info are ignored.
+
+    Note that the files are only complete (and readable) once they are
+    closed, i.e. when the hour changes or when close() is called.
+    """
+
+    def __init__(self, dir_path, name, reading_info, *, format='parquet',
+                 flush_rows=1000):
+        if not import_pyarrow():
+            raise ImportError(f'pyarrow is required to write {format} files '
+                              f'(run "pip install pyarrow")')
+        if format not in FORMATS:
+            raise ValueError(f'Unknown format: {format!r} '
+                             f'(valid formats: {sorted(FORMATS)})')
+        self.dir_path = Path(dir_path)
+        self.name = name
+        self.format = format
+        self.flush_rows = flush_rows
+        self.types = get_field_types(reading_info)
+        self.converters = {field: FIELD_TYPES[field_type][0]
+                           for field, field_type in self.types.items()}
+        self.schema = pa.schema([(field, get_arrow_type(field_type))
+                                 for field, field_type in self.types.items()])
+        self.columns = {field: [] for field in self.types}
+        self.num_rows = 0
+        self.hour = None
+        self.path = None
+        self.writer = None
+
+    def get_path(self, hour):
+        """Return the path of the file for the given hour."""
+        suffix = FORMATS[self.format]
+        stem = f'{self.name}_{hour:%Y-%m-%d_%H}'
+        path = self.dir_path / f'{stem}{suffix}'
+        n = 1
+        while path.exists():
+            # files can't be appended, so start a new one (e.g. on restart)
+            n += 1
+            path = self.dir_path / f'{stem}_{n}{suffix}'
+        return path
+
+    def add(self, reading):
+        """Add a reading to the buffer, flushing it if necessary."""
+        timestamp = convert(reading.get('timestamp'), datetime.fromisoformat)
+        hour = (timestamp or datetime.now()).replace(minute=0, second=0,
+                                                     microsecond=0)
+        if hour != self.hour:
+            self.close()
+            self.hour = hour
+        for field, values in self.columns.items():
+            values.append(convert(reading.get(field), self.converters[field]))
+        self.num_rows += 1
+        if self.num_rows >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows to the current file."""
+        if not self.num_rows:
+            return
+        table = pa.table(self.columns, schema=self.schema)
+        if self.writer is None:
+            self.dir_path.mkdir(parents=True, exist_ok=True)
+            self.path = self.get_path(self.hour)
+            if self.format == 'parquet':
+                self.writer = pq.ParquetWriter(self.path, self.schema)
+            else:
+                self.writer = pa.ipc.new_file(self.path, self.schema)
+        self.writer.write_table(table)
+        for values in self.columns.values():
+            values.clear()
+        self.num_rows = 0
+
+    def close(self):
+        """Flush the buffered rows and close the current file."""
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
@@ -69,11 +69,12 @@ if mqtt_secure and not mqtt_certs_dir.exists():
           f"<{mqtt_certs_dir}> does not exist.")
 
 #warn if data_source is invalid or inconsistent with logging settings
-valid_data_sources = {'mqtt', 'logs'}
+valid_data_sources = {'mqtt', 'logs', 'replay'}
 if data_source not in valid_data_sources:
     print(f"Warning: invalid data_source: {data_source!r} (valid options: "
           f"{valid_data_sources}). Falling back to 'logs'.")
     data_source = 'logs'
 
-if not enable_jsonl_logging and data_source == 'logs':
-    print("Warning: JSONL logging is disabled but data_source is 'logs'.")
+if not enable_jsonl_logging and data_source in {'logs', 'replay'}:
+    print(f"Warning: JSONL logging is disabled but data_source is "
+          f"{data_source!r}.")
@@ -1,10 +1,104 @@
 import csv
+import sys
 import json
+import time
+
+from collections import OrderedDict
 
 import paho.mqtt.client as mqtt
 
 from simoc_sam import config
+from simoc_sam.columnar import ColumnarWriter, check_data_format
+from simoc_sam.msgwriter import BaseMessageWriter
 from simoc_sam.sensors.utils import SENSOR_DATA
+from simoc_sam.sensors.aggregation import get_aggregated_info, is_aggregated
+
+
+class CSVFileCache:
+    """Keep the most recently used CSV files open for appending.
+
+    At most max_open files are kept open (the least recently used file
+    is closed when a new one is opened), and the files are flushed at
+    most every flush_interval seconds.
+    """
+
+    def __init__(self, max_open=32, flush_interval=5.0):
+        self.max_open = max_open
+        self.flush_interval = flush_interval
+        self.files = OrderedDict()  # path: (file, csv writer)
+        self.last_flush = time.monotonic()
+
+    def get_writer(self, path, field_names):
+        """Return the CSV writer for path, adding the header if needed."""
+        try:
+            csv_file, csv_writer = self.files[path]
+        except KeyError:
+            while self.files and len(self.files) >= self.max_open:
+                _, (old_file, _) = self.files.popitem(last=False)
+                old_file.close()
+            csv_file = open(path, 'a', newline='')
+            csv_writer = csv.writer(csv_file)
+            # if the file is empty, add headers
+            if csv_file.tell() == 0:
+                csv_writer.writerow(field_names)
+            self.files[path] = (csv_file, csv_writer)
+        else:
+            self.files.move_to_end(path)
+        return csv_writer
+
+    def maybe_flush(self):
+        """Flush the files if flush_interval seconds have passed."""
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        for csv_file, _ in self.files.values():
+            csv_file.flush()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        for csv_file, _ in self.files.values():
+            csv_file.close()
+        self.files.clear()
+
+
+class MessageWriter(BaseMessageWriter):
+    """Write the MQTT messages to the sensor files in a separate thread.
+
+    See BaseMessageWriter for the details.  The messages are written
+    one at a time, and the files are flushed when no new messages arrive
+    for flush_interval seconds.  The metrics are written to
+    log_dir/metrics/csvwriter.prom.
+    """
+
+    def __init__(self, max_queue_size=10_000, *,
+                 flush_interval=config.csvwriter_flush_interval,
+                 metrics_interval=config.mqtt_metrics_interval):
+        super().__init__('csvwriter', max_queue_size,
+                         batch_interval=flush_interval,
+                         metrics_interval=metrics_interval)
+
+    def write_batch(self, batch):
+        written = 0
+        for topic, payload in batch:
+            try:
+                written += write_message(topic, payload)
+            except Exception as err:
+                print(f'Unable to write message <{topic}>: {err}')
+        return written
+
+    def idle(self):
+        CSV_FILES.flush()  # no new messages, flush the pending ones
+
+
+CSV_FILES = CSVFileCache(config.csvwriter_max_open_files,
+                         config.csvwriter_flush_interval)
+# (sensor, aggregated): ['n', 'timestamp', *sensor_fields]
+FIELD_NAMES = {}
+# (location, host, sensor, aggregated): ColumnarWriter, used if
+# data_format != 'csv'
+COLUMNAR_WRITERS = {}
+WRITER = MessageWriter(config.csvwriter_queue_size)
 
 
 def on_connect(client, userdata, flags, rc, properties=None):
@@ -12,31 +106,81 @@ def on_connect(client, userdata, flags, rc, properties=None):
     client.subscribe(config.mqtt_topic_sub)
 
 def on_message(client, userdata, msg):
-    payload = msg.payload.decode("utf-8")
-    topic = msg.topic
+    WRITER.put(msg.topic, msg.payload)
+
+def write_message(topic, payload):
+    """Parse the message payload and write it to the sensor file.
+
+    Return True if the message was written, False if it was skipped.
+    """
+    payload = payload.decode("utf-8")
     print(f"Received message <{topic}>: {payload}")
     try:
         data = json.loads(payload)
         location, host, sensor = topic.split('/')
-        sensor_fields = SENSOR_DATA[sensor].data.keys()
+        aggregated = is_aggregated(data)
+        field_names = get_field_names(sensor, aggregated)
     except (json.JSONDecodeError, ValueError) as e:
         print(f"Skipping invalid message <{topic}>: {payload} ({e})")
-        return
+        return False
     except KeyError as e:
         print(f"Skipping unknown sensor <{topic}>: {sensor} ({e})")
-        return
-    csv_file_path = config.data_dir / f'{location}_{host}_{sensor}.csv'
+        return False
+    if config.data_format != 'csv':
+        write_columnar(location, host, sensor, data)
+        return True
+    name = get_file_name(location, host, sensor, aggregated)
+    csv_file_path = config.data_dir / f'{name}.csv'
     # append the data to the CSV file
-    with open(csv_file_path, 'a', newline='') as csv_file:
-        csv_writer = csv.writer(csv_file)
-        field_names = ['n', 'timestamp', *sensor_fields]
-        # if the file is empty, add headers
-        if csv_file.tell() == 0:
-            csv_writer.writerow(field_names)
-        # append data row to the CSV file
-        csv_writer.writerow([data.get(field, '') for field in field_names])
+    csv_writer = CSV_FILES.get_writer(csv_file_path, field_names)
+    csv_writer.writerow([data.get(field, '') for field in field_names])
+    CSV_FILES.maybe_flush()
+    return True
+
+def get_file_name(location, host, sensor, aggregated=False):
+    """Return the name of the data file (without extension) of a sensor.
+
+    The aggregated readings are written in a separate file, since they
+    have additional <field>_<stat> and samples columns.
+    """
+    name = f'{location}_{host}_{sensor}'
+    return f'{name}_aggregated' if aggregated else name
+
+def get_reading_info(sensor, aggregated=False):
+    """Return the reading_info of the sensor (or of its aggregated readings)."""
+    reading_info = SENSOR_DATA[sensor].data
+    return get_aggregated_info(reading_info) if aggregated else reading_info
+
+def get_field_names(sensor, aggregated=False):
+    """Return the list of CSV columns of the given sensor."""
+    key = (sensor, aggregated)
+    if key not in FIELD_NAMES:
+        sensor_fields = get_reading_info(sensor, aggregated).keys()
+        FIELD_NAMES[key] = ['n', 'timestamp', *sensor_fields]
+    return FIELD_NAMES[key]
+
+def write_columnar(location, host, sensor, data):
+    """Add the data to the columnar writer of the sensor."""
+    aggregated = is_aggregated(data)
+    key = (location, host, sensor, aggregated)
+    if key not in COLUMNAR_WRITERS:
+        COLUMNAR_WRITERS[key] = ColumnarWriter(
+            config.data_dir, get_file_name(location, host, sensor, aggregated),
+            get_reading_info(sensor, aggregated), format=config.data_format,
+            flush_rows=config.columnar_flush_rows,
+        )
+    COLUMNAR_WRITERS[key].add(data)
+
+def close_columnar_writers():
+    for writer in COLUMNAR_WRITERS.values():
+        writer.close()
+    COLUMNAR_WRITERS.clear()
 
 def main():
+    try:
+        check_data_format(config.data_format)
+    except (ValueError, ImportError) as err:
+        sys.exit(f'Error: {err}')
     if not config.data_dir.exists():
         print(f"Creating data directory: {config.data_dir}")
         config.data_dir.mkdir(exist_ok=True)
@@ -44,12 +188,16 @@ def main():
     client.on_connect = on_connect
     client.on_message = on_message
     client.connect(config.mqtt_host, config.mqtt_port)
+    WRITER.start()
     try:
         client.loop_forever()
     except KeyboardInterrupt:
         print("Interrupted by user, disconnecting...")
         client.disconnect()
     finally:
+        WRITER.stop()
+        CSV_FILES.close()
+        close_columnar_writers()
         print("Disconnected from MQTT broker")
 
 if __name__ == '__main__':
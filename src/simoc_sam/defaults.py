@@ -14,11 +14,41 @@ volume = 0
 # Sensors and data collection
 sensors = ['bme688', 'scd30', 'sgp30']
 sensor_read_delay = 10.0
+# Per-sensor windowed aggregation: sample the sensor every sample_delay
+# seconds and publish one reading with the mean (and <field>_<stat>
+# fields for the other stats, by default min/max/rms/stddev) every
+# window seconds or samples samples.
+# If log_raw is True, the raw samples are logged instead.  E.g.:
+# sensor_aggregation = {
+#     'scd30': dict(window=60, sample_delay=1, log_raw=True,
+#                   stats=['min', 'max', 'stddev']),
+# }
+sensor_aggregation = {}
+# If True, the result of the MCP2221 (USB to I2C adapter) detection is
+# cached in data_dir/mcp2221.json until the next reboot (note that
+# adapters plugged in later won't be detected until then)
+mcp2221_disk_cache = False
 
 
 # Display configuration
 display = 'ssd1306'
+# the displays are updated when new readings arrive (at most every
+# display_min_interval seconds) or every display_refresh seconds
 display_refresh = 1.0
+display_min_interval = 0.2
+# when there are more rows than the display can show, truncate them
+# (''), cycle through pages every display_page_interval seconds
+# ('page'), or scroll the rows by display_scroll_speed pixels/second
+# ('scroll')
+display_layout = ''
+display_page_interval = 5.0
+display_scroll_speed = 10
+# the framebuffer display renders the frames of framebuffer_display and,
+# if framebuffer_png is True, saves them in data_dir/display.png (scaled
+# by framebuffer_scale), to view them through the siobridge
+framebuffer_display = 'ssd1306'
+framebuffer_png = True
+framebuffer_scale = 2
 display_format = """
 SIMOC LIVE
 Up {uptime}
@@ -41,22 +71,69 @@ mqtt_port = 1883
 mqtt_secure = False
 mqtt_certs_dir = '~/.mqttcerts'
 mqtt_reconnect_delay = 5.0
+# sensors reconnect with an exponential backoff (with jitter) starting
+# from mqtt_reconnect_delay and up to mqtt_reconnect_max_delay seconds
+mqtt_reconnect_max_delay = 300.0
+# write the sensors' MQTT metrics (in the Prometheus text format) to
+# log_dir/metrics/*.prom every mqtt_metrics_interval seconds (0 to disable)
+mqtt_metrics_interval = 60.0
+# Per-sensor/field deadbands: only publish a reading if one of the
+# fields changed by more than its deadband since the last published
+# reading, or if publish_max_silence seconds passed.  E.g.:
+# publish_deadbands = {
+#     'bme688': {'temperature': 0.05, 'humidity': 0.5, 'pressure': 0.1},
+# }
+publish_deadbands = {}
+publish_max_silence = 60.0
+# Store the readings in an on-disk queue (in log_dir/mqtt-buffer/) while
+# the broker is unreachable and send them at most mqtt_buffer_drain_rate
+# messages/second after reconnecting.  Sizes are in bytes.
+mqtt_buffer_enabled = True
+mqtt_buffer_max_size = 50_000_000
+mqtt_buffer_segment_size = 1_000_000
+mqtt_buffer_drain_rate = 20.0
 
 
 # SIMOC Web / SIO bridge configuration
 sio_host = 'localhost'
 sio_port = 8081
-data_source = 'mqtt'  # 'mqtt' or 'logs'
+data_source = 'mqtt'  # 'mqtt', 'logs', or 'replay'
+# 'replay' merges the logs of the configured sensors and replays them at
+# replay_speed times the real-time speed (0 for as fast as possible),
+# from replay_start to replay_end (e.g. '2024-03-06 14:00', or None),
+# emitting a bundle every sensor_read_delay seconds of log time
+replay_speed = 1.0
+replay_start = None
+replay_end = None
 mqtt_topic_sub = '#'
 simoc_web_dist_dir = '/var/www/simoc'
+# max number of readings returned by the /api/readings endpoint
+api_max_readings = 10_000
 
 
 # Verbosity and logging
 verbose_sensor = False
 verbose_mqtt = False
 enable_jsonl_logging = True
+# add an entry to the <log>.jsonl.idx time index every N lines (0 to disable)
+log_index_interval = 100
 log_dir = '~/logs'
 data_dir = '~/data'
+# Format of the files written by the csvwriter and sioclient: 'csv',
+# or 'parquet'/'feather' (requires pyarrow) to write typed columns to
+# one file per sensor per hour, flushing every columnar_flush_rows rows
+data_format = 'csv'
+columnar_flush_rows = 1000
+# the csvwriter keeps up to csvwriter_max_open_files CSV files open and
+# flushes them every csvwriter_flush_interval seconds
+csvwriter_max_open_files = 32
+csvwriter_flush_interval = 5.0
+# max number of MQTT messages waiting to be written by the csvwriter
+csvwriter_queue_size = 10_000
+# the sqlitewriter records the data in data_dir/readings.db, committing
+# up to sqlite_batch_size readings every sqlite_commit_interval seconds
+sqlite_batch_size = 500
+sqlite_commit_interval = 1.0
 
 
 # BNO085 accelerometer/gyroscope/magnetometer configuration
@@ -73,3 +150,13 @@ bno085_enabled_features = [
     # 'STABILITY_CLASSIFIER', 'ACTIVITY_CLASSIFIER',
     # 'STEP_COUNTER', 'SHAKE_DETECTOR'
 ]
+
+# Streaming mode: read the reports in a background thread every
+# bno085_report_interval seconds and keep the last bno085_buffer_size
+# samples in a ring buffer.  Each reading is then either the 'latest'
+# sample or the mean/min/max/RMS/stddev of the samples in the 'window'
+# since the previous reading (the same stats used by sensor_aggregation).
+bno085_streaming = False
+bno085_report_interval = 0.05
+bno085_buffer_size = 1000
+bno085_stream_output = 'window'  # 'latest' or 'window'
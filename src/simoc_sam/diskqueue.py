@@ -0,0 +1,182 @@
+"""Disk-backed FIFO queue used to buffer data while offline."""
+
+import os
+import threading
+
+from pathlib import Path
+
+
+class DiskQueue:
+    """A bounded, disk-backed FIFO queue of single-line strings.
+
+    Items are appended to numbered segment files in dir_path, and a new
+    segment is started once the current one reaches segment_size bytes.
+    A cursor file keeps track of the next item to read, so that the
+    items survive restarts.  Fully consumed segments are deleted, and if
+    the total size exceeds max_size bytes the oldest segments are dropped
+    (the number of dropped items is stored in self.dropped).
+
+    The directory is only created when the first item is added.
+    """
+
+    SEGMENT_SUFFIX = '.seg'
+
+    def __init__(self, dir_path, *, max_size=50_000_000,
+                 segment_size=1_000_000):
+        if segment_size > max_size:
+            raise ValueError('segment_size must not be greater than max_size')
+        self.dir_path = Path(dir_path)
+        self.cursor_path = self.dir_path / 'cursor'
+        self.max_size = max_size
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self.write_file = None
+        self.read_file = None
+        # find existing segments (left by a previous run)
+        self.segments = []  # segment numbers, oldest first
+        if self.dir_path.exists():
+            self.segments = sorted(
+                int(path.stem)
+                for path in self.dir_path.glob(f'*{self.SEGMENT_SUFFIX}')
+            )
+        self.sizes = {seg: self.segment_path(seg).stat().st_size
+                      for seg in self.segments}
+        self.read_segment, self.read_offset = self.load_cursor()
+        self.length = sum(self.count_items(seg) for seg in self.segments)
+
+    def __len__(self):
+        return self.length
+
+    def segment_path(self, segment):
+        return self.dir_path / f'{segment:010}{self.SEGMENT_SUFFIX}'
+
+    @property
+    def size(self):
+        """Return the total size of the segments in bytes."""
+        return sum(self.sizes.values())
+
+    def load_cursor(self):
+        """Return the (segment, offset) of the next item to read."""
+        if not self.segments:
+            return None, 0
+        try:
+            segment, offset = map(int, self.cursor_path.read_text().split())
+        except (OSError, ValueError):
+            return self.segments[0], 0
+        if segment not in self.sizes:
+            return self.segments[0], 0  # the segment was dropped
+        return segment, min(offset, self.sizes[segment])
+
+    def save_cursor(self):
+        tmp_path = self.cursor_path.with_suffix('.tmp')
+        tmp_path.write_text(f'{self.read_segment} {self.read_offset}\n')
+        os.replace(tmp_path, self.cursor_path)
+
+    def count_items(self, segment):
+        """Return the number of unread items in the given segment."""
+        offset = self.read_offset if segment == self.read_segment else 0
+        with open(self.segment_path(segment), 'rb') as f:
+            f.seek(offset)
+            return sum(chunk.count(b'\n')
+                       for chunk in iter(lambda: f.read(65536), b''))
+
+    def put(self, item):
+        """Add an item (a string without newlines) at the end of the queue."""
+        data = f'{item}\n'.encode('utf-8')
+        with self.lock:
+            if (self.write_file is None or
+                    self.sizes[self.segments[-1]] >= self.segment_size):
+                self.start_segment()
+            self.write_file.write(data)
+            self.write_file.flush()
+            self.sizes[self.segments[-1]] += len(data)
+            self.length += 1
+            while self.size > self.max_size and len(self.segments) > 1:
+                self.drop_oldest_segment()
+
+    def start_segment(self):
+        """Start a new segment file for writing."""
+        if self.write_file is not None:
+            self.write_file.close()
+        self.dir_path.mkdir(parents=True, exist_ok=True)
+        segment = self.segments[-1] + 1 if self.segments else 0
+        self.segments.append(segment)
+        self.sizes[segment] = 0
+        self.write_file = open(self.segment_path(segment), 'ab')
+        if self.read_segment is None:
+            self.read_segment, self.read_offset = segment, 0
+
+    def drop_oldest_segment(self):
+        """Remove the oldest segment and the items it contains."""
+        segment = self.segments[0]
+        dropped = self.count_items(segment)
+        self.dropped += dropped
+        self.length -= dropped
+        self.remove_segment(segment)
+
+    def remove_segment(self, segment):
+        self.segments.remove(segment)
+        del self.sizes[segment]
+        if segment == self.read_segment:
+            if self.read_file is not None:
+                self.read_file.close()
+                self.read_file = None
+            self.read_segment, self.read_offset = self.segments[0], 0
+            self.save_cursor()
+        self.segment_path(segment).unlink(missing_ok=True)
+
+    def peek(self):
+        """Return the first item of the queue without removing it.
+
+        Return None if the queue is empty.
+        """
+        with self.lock:
+            line = self.read_line()
+            return None if line is None else line.decode('utf-8').rstrip('\n')
+
+    def read_line(self):
+        while self.length:
+            if self.read_file is None:
+                self.read_file = open(self.segment_path(self.read_segment),
+                                      'rb')
+            self.read_file.seek(self.read_offset)
+            line = self.read_file.readline()
+            if line.endswith(b'\n'):
+                return line
+            if self.read_segment == self.segments[-1]:
+                return None  # the last item is incomplete
+            # the segment has been fully read, move on to the next one
+            self.remove_segment(self.read_segment)
+        return None
+
+    def pop(self):
+        """Remove and return the first item of the queue (or None)."""
+        with self.lock:
+            line = self.read_line()
+            if line is None:
+                return None
+            self.read_offset += len(line)
+            self.length -= 1
+            if not self.length:
+                self.clear_segments()  # reclaim disk space
+            else:
+                self.save_cursor()
+            return line.decode('utf-8').rstrip('\n')
+
+    def clear_segments(self):
+        """Remove all the segments once they have been read."""
+        self.close()
+        for segment in self.segments:
+            self.segment_path(segment).unlink(missing_ok=True)
+        self.cursor_path.unlink(missing_ok=True)
+        self.segments.clear()
+        self.sizes.clear()
+        self.read_segment, self.read_offset = None, 0
+
+    def close(self):
+        """Close the open segment files."""
+        for f in (self.write_file, self.read_file):
+            if f is not None:
+                f.close()
+        self.write_file = self.read_file = None
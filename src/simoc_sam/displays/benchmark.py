@@ -0,0 +1,263 @@
+"""Benchmark the rendering pipeline of the display drivers.
+
+The drivers are imported with fake board/displayio/adafruit_* modules,
+and the frames are drawn with their own FrameDrawer, so that the full
+pipeline (format_values -> layout/draw_image ->
+show_image/blit_image_to_bitmap) can be measured without hardware.
+Each frame changes a fraction of the displayed values (the change rate),
+and the time spent in each stage is reported together with the frames/s
+and the amount of data sent to the (fake) display.
+
+Usage:
+  python -m simoc_sam.displays.benchmark --display ssd1306 ssd1327 \\
+      --rows 5 10 30 --change-rate 0 0.1 1 --frames 200
+"""
+
+import sys
+import time
+import random
+import argparse
+import importlib
+import contextlib
+
+from types import ModuleType
+from unittest.mock import patch
+
+from simoc_sam import config
+from simoc_sam.displays import utils as display_utils
+
+
+DISPLAYS = ('ssd1306', 'ssd1327')
+STAGES = ('format', 'layout', 'transfer')
+
+
+class FakeI2CDevice:
+    """Count the data written to the I2C device."""
+
+    def __init__(self):
+        self.writes = 0
+        self.bytes_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def write(self, data):
+        self.writes += 1
+        self.bytes_written += len(data)
+
+
+class FakeSSD1306:
+    """Stand-in for adafruit_ssd1306.SSD1306_I2C."""
+
+    def __init__(self, width, height, i2c=None, *, addr=0x3C, reset=None):
+        self.width, self.height = width, height
+        # the first byte is the 0x40 control byte, as in the real driver
+        self.buffer = bytearray(width * height // 8 + 1)
+        self.buffer[0] = 0x40
+        self.i2c_device = FakeI2CDevice()
+        self.commands = 0
+
+    def write_cmd(self, cmd):
+        self.commands += 1
+
+    def fill(self, color):
+        self.buffer[1:] = bytes([0xFF if color else 0]) * (len(self.buffer) - 1)
+
+    def image(self, image):
+        """Copy the image in the buffer pixel by pixel, like framebuf."""
+        if image.size != (self.width, self.height):
+            raise ValueError('Image must be same dimensions as display')
+        self.fill(0)
+        buffer, width = self.buffer, self.width
+        pixels = image.load()
+        for y in range(self.height):
+            offset, bit = 1 + (y // 8) * width, 1 << (y % 8)
+            for x in range(width):
+                if pixels[x, y]:
+                    buffer[offset + x] |= bit
+
+    def show(self):
+        with self.i2c_device:
+            self.i2c_device.write(self.buffer)
+
+
+class FakeBitmap:
+    """Stand-in for displayio.Bitmap (one byte per pixel)."""
+
+    def __init__(self, width, height, value_count):
+        self.width, self.height = width, height
+        self.data = bytearray(width * height)
+        self.pixels_written = 0
+
+    def __setitem__(self, xy, value):
+        x, y = xy
+        self.data[y * self.width + x] = value
+        self.pixels_written += 1
+
+    def __getitem__(self, xy):
+        x, y = xy
+        return self.data[y * self.width + x]
+
+
+class FakeDisplay:
+    """Stand-in for adafruit_ssd1327.SSD1327."""
+
+    def __init__(self, *args, **kwargs):
+        self.refreshes = 0
+
+    def refresh(self):
+        self.refreshes += 1
+
+
+def make_fake_modules():
+    """Return a dict with the fake hardware modules used by the drivers."""
+    modules = {name: ModuleType(name) for name in [
+        'board', 'digitalio', 'adafruit_ssd1306', 'displayio',
+        'adafruit_ssd1327', 'i2cdisplaybus',
+    ]}
+    modules['adafruit_ssd1306'].SSD1306_I2C = FakeSSD1306
+    modules['displayio'].Bitmap = FakeBitmap
+    modules['adafruit_ssd1327'].SSD1327 = FakeDisplay
+    modules['i2cdisplaybus'].I2CDisplayBus = FakeDisplay
+    return modules
+
+@contextlib.contextmanager
+def fake_hardware():
+    """Temporarily replace the hardware modules with the fake ones."""
+    with patch.dict(sys.modules, make_fake_modules()):
+        yield
+
+def import_driver(display):
+    """Import the driver of the given display (within fake_hardware())."""
+    if display not in DISPLAYS:
+        raise ValueError(f'Unknown display: {display!r}')
+    name = f'simoc_sam.displays.{display}'
+    sys.modules.pop(name, None)  # reimport it with the fake modules
+    return importlib.import_module(name)
+
+
+def make_display_format(rows):
+    """Return a display format and the readings for the given rows."""
+    lines = ['SIMOC LIVE', 'Up {uptime}', '']
+    lines += [f'F{x}: {{bench_f{x}:.2f}}' for x in range(rows - len(lines))]
+    readings = {'bench': {f'f{x}': 0.0 for x in range(rows - 3)}}
+    return '\n'.join(lines[:rows]), readings
+
+
+class Pipeline:
+    """Draw the frames with the FrameDrawer of a driver and a fake display.
+
+    The time spent sending the frames to the display is measured by
+    wrapping the show() function of the drawer.
+    """
+
+    def __init__(self, display, *, layout=''):
+        driver = import_driver(display)
+        info = display_utils.DISPLAY_DATA[display]
+        if display == 'ssd1306':
+            self.oled = FakeSSD1306(info.width, info.height)
+            self.drawer = driver.create_drawer(self.oled, mode=layout)
+        else:
+            self.bitmap = FakeBitmap(info.width, info.height, 2)
+            self.display = FakeDisplay()
+            self.drawer = driver.create_drawer(self.display, self.bitmap,
+                                               info.width, info.height,
+                                               mode=layout)
+        self.transfer_time = 0.0
+        show = self.drawer.show
+        def timed_show(image):
+            start = time.perf_counter()
+            show(image)
+            self.transfer_time += time.perf_counter() - start
+        self.drawer.show = timed_show
+
+    @property
+    def transferred(self):
+        """Return the bytes (or pixels) sent to the display so far."""
+        if hasattr(self, 'oled'):
+            return self.oled.i2c_device.bytes_written
+        return self.bitmap.pixels_written
+
+
+def run_benchmark(display, rows, change_rate, frames, *, layout='',
+                  frame_interval=None, seed=0):
+    """Draw frames with the given display and return a dict with the results.
+
+    change_rate is the fraction of values that changes at every frame.
+    """
+    frame_interval = frame_interval or config.display_min_interval
+    display_format, readings = make_display_format(rows)
+    rng = random.Random(seed)
+    fields = readings['bench']
+    times = dict.fromkeys(STAGES, 0.0)
+    drawn = 0
+    with fake_hardware(), \
+         patch.object(config, 'display_format', display_format):
+        pipeline = Pipeline(display, layout=layout)
+        for frame in range(frames):
+            for field in rng.sample(sorted(fields),
+                                    round(len(fields) * change_rate)):
+                fields[field] = rng.uniform(0, 1000)
+            t0 = time.perf_counter()
+            formatted = display_utils.format_values(readings)
+            t1 = time.perf_counter()
+            transfer_time = pipeline.transfer_time
+            now = frame * frame_interval
+            drawn += pipeline.drawer.draw(formatted, now=now)
+            t2 = time.perf_counter()
+            transfer = pipeline.transfer_time - transfer_time
+            times['format'] += t1 - t0
+            times['layout'] += t2 - t1 - transfer
+            times['transfer'] += transfer
+    total = sum(times.values())
+    return dict(
+        display=display, rows=rows, change_rate=change_rate, frames=frames,
+        drawn=drawn, times=times, total=total,
+        fps=frames / total if total else float('inf'),
+        transferred=pipeline.transferred,
+    )
+
+
+def format_result(result):
+    frames = result['frames']
+    stages = ' '.join(f'{result["times"][stage] / frames * 1000:8.3f}'
+                      for stage in STAGES)
+    return (f'{result["display"]:<8} {result["rows"]:>4} '
+            f'{result["change_rate"]:>6.2f} {stages} '
+            f'{result["fps"]:>9.1f} {result["drawn"]:>6} '
+            f'{result["transferred"] / frames:>10.0f}')
+
+def parse_args(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--display', nargs='+', choices=DISPLAYS,
+                        default=list(DISPLAYS), help='The displays to test.')
+    parser.add_argument('--rows', nargs='+', type=int, default=[5, 10, 30],
+                        help='The number of rows of the display format.')
+    parser.add_argument('--change-rate', nargs='+', type=float,
+                        default=[0, 0.1, 1],
+                        help='The fraction of values changed every frame.')
+    parser.add_argument('--frames', type=int, default=200,
+                        help='The number of frames for each run.')
+    parser.add_argument('--layout', choices=display_utils.LAYOUT_MODES,
+                        default='', help='The layout used for the rows.')
+    return parser.parse_args(arguments)
+
+def main(arguments=None):
+    args = parse_args(arguments)
+    print(f'{"display":<8} {"rows":>4} {"change":>6} '
+          f'{"format":>8} {"layout":>8} {"transfer":>8} '
+          f'{"frames/s":>9} {"drawn":>6} {"sent/frame":>10}')
+    print(f'{"":<20} {"(ms/frame)":^26}')
+    for display in args.display:
+        for rows in args.rows:
+            for change_rate in args.change_rate:
+                result = run_benchmark(display, rows, change_rate,
+                                       args.frames, layout=args.layout)
+                print(format_result(result))
+
+
+if __name__ == '__main__':
+    main()
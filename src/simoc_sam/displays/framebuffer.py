@@ -0,0 +1,205 @@
+"""Headless display driver that renders into an in-memory framebuffer.
+
+The driver renders the same frames that the emulated OLED display
+(config.framebuffer_display) would show, using the same layout and
+partial updates, and optionally saves them as PNG in data_dir, where
+they can be viewed through the /api/display.png endpoint of the
+siobridge.
+"""
+
+import os
+import asyncio
+
+from PIL import Image
+
+from simoc_sam import config
+from simoc_sam.displays import utils as display_utils
+
+
+# store latest readings from each sensor (updated by MQTT handler)
+SENSOR_READINGS = {}
+
+# display: (max rows, rotate, memory layout), as in the drivers/displays
+EMULATED_DISPLAYS = {
+    'ssd1306': (10, True, 'pages'),
+    'ssd1327': (15, False, 'gray4'),
+}
+
+# the 4 bytes of 4-bit pixels (0x0 or 0xF) for each byte of 8 1-bit pixels
+GRAY4_BYTES = [
+    bytes((0xF0 if byte & (0x80 >> x) else 0) |
+          (0x0F if byte & (0x40 >> x) else 0) for x in range(0, 8, 2))
+    for byte in range(256)
+]
+
+
+def get_frame_path():
+    return config.data_dir / 'display.png'
+
+
+def to_pages(image):
+    """Convert a 1-bit image to the page layout of the SSD1306 memory.
+
+    Each page is a band of 8 rows stored as one byte per column, with
+    the top pixel in the least significant bit.
+    """
+    width, height = image.size
+    data = bytearray()
+    for y in range(0, height, 8):
+        page = image.crop((0, y, width, y + 8))
+        # turn the columns into rows of 8 pixels, with the top pixel last
+        data += page.transpose(Image.TRANSPOSE).transpose(
+            Image.FLIP_LEFT_RIGHT).tobytes()
+    return bytes(data)
+
+def from_pages(data, size):
+    """Convert the SSD1306 page layout back to a 1-bit image."""
+    width, height = size
+    image = Image.new('1', size, 0)
+    for n, y in enumerate(range(0, height, 8)):
+        page = Image.frombytes('1', (8, width), data[n*width:(n+1)*width])
+        image.paste(page.transpose(Image.FLIP_LEFT_RIGHT).transpose(
+            Image.TRANSPOSE), (0, y))
+    return image
+
+def to_gray4(image):
+    """Convert a 1-bit image to the 4-bit grayscale SSD1327 memory.
+
+    Each byte stores 2 pixels, with the left pixel in the high nibble.
+    """
+    data = b''.join([GRAY4_BYTES[byte] for byte in image.tobytes()])
+    width, height = image.size
+    if width % 8:
+        # remove the padding of the rows of the 1-bit image
+        padded, stride = (width + 7) // 8 * 4, (width + 1) // 2
+        data = b''.join([data[y*padded:y*padded+stride]
+                         for y in range(height)])
+    return data
+
+def from_gray4(data, size):
+    """Convert the 4-bit grayscale SSD1327 memory back to a 1-bit image."""
+    image = Image.frombytes('L', size, bytes(data), 'raw', 'L;4')
+    return image.point(lambda value: 255 if value else 0, '1')
+
+MEMORY_LAYOUTS = {
+    # name: (encode, decode, bytes per row of pixels or page)
+    'pages': (to_pages, from_pages, lambda width: width),
+    'gray4': (to_gray4, from_gray4, lambda width: (width + 1) // 2),
+}
+
+
+class FrameBuffer:
+    """The memory of an OLED display, updated like the real one.
+
+    The frames are converted to the memory layout of the display:
+    'pages' for the SSD1306 (8 rows per byte) or 'gray4' for the SSD1327
+    (2 pixels per byte).  Only the bands of bytes that changed since the
+    previous frame are copied in the buffer, so bytes_transferred counts
+    the display data that would be sent with partial updates (excluding
+    the commands that set the address window).
+    If rotate is True, the frames are drawn rotated by 90 degrees, as for
+    the displays that are mounted rotated, and get_image() turns them
+    upright.
+    """
+
+    def __init__(self, width, height, *, memory='pages', rotate=False):
+        try:
+            self.encode, self.decode, get_stride = MEMORY_LAYOUTS[memory]
+        except KeyError:
+            raise ValueError(f'Unknown memory layout: {memory!r}') from None
+        if memory == 'pages' and height % 8:
+            raise ValueError('The height must be a multiple of 8')
+        self.size = (width, height)
+        self.memory = memory
+        self.rotate = rotate
+        self.stride = get_stride(width)
+        self.buffer = bytearray(len(self.encode(Image.new('1', self.size))))
+        self.tracker = display_utils.DirtyTracker(self.stride)
+        self.frames = 0
+        self.bytes_transferred = 0
+
+    def update(self, image):
+        """Copy the changed parts of the image in the buffer.
+
+        Return the number of bands of rows (or pages) that changed.
+        """
+        if image.size != self.size:
+            raise ValueError(f'Expected a {self.size} image, got {image.size}')
+        data = self.encode(image)
+        bands = self.tracker.get_bands(data)
+        for row0, row1, col0, col1 in bands:
+            for row in range(row0, row1):
+                start = row * self.stride
+                self.buffer[start+col0:start+col1] = data[start+col0:start+col1]
+                self.bytes_transferred += col1 - col0
+        self.tracker.update(data)
+        if bands:
+            self.frames += 1
+        return len(bands)
+
+    def get_image(self):
+        """Return the content of the buffer as it appears on the display."""
+        image = self.decode(bytes(self.buffer), self.size)
+        if self.rotate:
+            image = image.rotate(-90, expand=True)
+        return image
+
+    def save_png(self, path, scale=1):
+        """Atomically save the (scaled) content of the buffer as PNG."""
+        image = self.get_image()
+        if scale > 1:
+            image = image.resize((image.width * scale, image.height * scale),
+                                 Image.NEAREST)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'.{path.name}.tmp')
+        image.save(tmp_path, format='PNG', optimize=True)
+        os.replace(tmp_path, path)
+
+
+def create_framebuffer(display=None):
+    """Return a (framebuffer, layout) tuple emulating the given display."""
+    display = display or config.framebuffer_display
+    try:
+        max_rows, rotate, memory = EMULATED_DISPLAYS[display]
+    except KeyError:
+        raise ValueError(f'Unsupported display: {display!r}') from None
+    info = display_utils.DISPLAY_DATA[display]
+    framebuffer = FrameBuffer(info.width, info.height, memory=memory,
+                              rotate=rotate)
+    # swap height/width if the screen is rotated 90 degrees
+    width, height = (info.height, info.width) if rotate else (info.width,
+                                                               info.height)
+    layout = display_utils.PagedLayout(width, height, max_rows, rotate=rotate)
+    return framebuffer, layout
+
+
+async def update_display(framebuffer, layout, notifier, frame_path=None):
+    """Update the framebuffer when new sensor values arrive."""
+    def show(image):
+        if framebuffer.update(image) and frame_path:
+            framebuffer.save_png(frame_path, config.framebuffer_scale)
+    drawer = display_utils.FrameDrawer(layout, show)
+    async for _ in display_utils.iter_frames(
+            notifier, idle_interval=layout.idle_interval):
+        drawer.draw(display_utils.format_values(SENSOR_READINGS))
+
+
+async def main():
+    """Main loop: monitor MQTT and render sensor values in the framebuffer."""
+    framebuffer, layout = create_framebuffer()
+    frame_path = get_frame_path() if config.framebuffer_png else None
+    print(f'Framebuffer display started ({config.framebuffer_display}).')
+    if frame_path:
+        print(f'Saving the frames to {frame_path}')
+    notifier = display_utils.ChangeNotifier()
+    await asyncio.gather(
+        display_utils.mqtt_monitor(SENSOR_READINGS, notifier),
+        update_display(framebuffer, layout, notifier, frame_path),
+    )
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\nFramebuffer display stopped.")
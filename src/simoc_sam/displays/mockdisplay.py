@@ -14,16 +14,19 @@ SENSOR_READINGS = {}
 # total rows to display (including header)
 MAX_ROWS = 50
 
-async def update_display():
-    """Continuously update the console display with latest sensor values."""
+async def update_display(notifier):
+    """Update the console display when new sensor values arrive."""
     delimiter = "-" * 40
-    with Live(refresh_per_second=1 / config.display_refresh) as live:
+    # the console can't scroll smoothly, so show the rows a page at a time
+    mode = config.display_layout and 'page'
+    layout = display_utils.PagedLayout(None, None, MAX_ROWS, mode=mode)
+    with Live(auto_refresh=False) as live:
         try:
-            while True:
-                rows = display_utils.format_values(SENSOR_READINGS, max_rows=MAX_ROWS)
+            async for _ in display_utils.iter_frames(notifier):
+                rows = layout.get_rows(
+                    display_utils.format_values(SENSOR_READINGS))
                 output = Text("\n".join([delimiter, *rows, delimiter]))
-                live.update(output)
-                await asyncio.sleep(config.display_refresh)
+                live.update(output, refresh=True)
         except asyncio.CancelledError:
             print("\nMockDisplay stopped.")
             raise
@@ -32,9 +35,10 @@ async def main():
     """Main loop: monitor MQTT and display sensor values."""
     print("MockDisplay started. Press Ctrl+C to exit.")
     # start MQTT monitor and display update tasks
+    notifier = display_utils.ChangeNotifier()
     await asyncio.gather(
-        display_utils.mqtt_monitor(SENSOR_READINGS),
-        update_display(),
+        display_utils.mqtt_monitor(SENSOR_READINGS, notifier),
+        update_display(notifier),
     )
 
 if __name__ == "__main__":
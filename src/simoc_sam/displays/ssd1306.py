@@ -4,12 +4,8 @@ import time
 import asyncio
 
 from simoc_sam.sensors import utils as sensor_utils
-board = sensor_utils.import_board()
 
-import digitalio
-import adafruit_ssd1306
-
-from simoc_sam import utils, config
+from simoc_sam import utils
 from simoc_sam.displays import utils as display_utils
 
 
@@ -19,30 +15,68 @@ SENSOR_READINGS = {}
 # number of rows for 128x64 rotated 90 degrees (including header)
 MAX_ROWS = 10
 
+# commands used to set the address window (from the SSD1306 datasheet)
+SET_COL_ADDR = 0x21
+SET_PAGE_ADDR = 0x22
+
+
+def show_bands(oled, bands):
+    """Send the (page0, page1, col0, col1) bands of the buffer to the OLED."""
+    width = oled.width
+    col_offset = (128 - width) // 2  # narrower displays are centered
+    framebuf = memoryview(oled.buffer)[1:]  # skip the 0x40 control byte
+    for page0, page1, col0, col1 in bands:
+        # set the window that will be filled by the data
+        for cmd in (SET_COL_ADDR, col0 + col_offset, col1 - 1 + col_offset,
+                    SET_PAGE_ADDR, page0, page1 - 1):
+            oled.write_cmd(cmd)
+        data = bytearray([0x40])
+        for page in range(page0, page1):
+            data += framebuf[page*width+col0:page*width+col1]
+        with oled.i2c_device:
+            oled.i2c_device.write(data)
+
 
-def show_image(oled, image):
-    """Show the given image on the OLED display."""
-    oled.image(image.rotate(90, expand=True))
+def show_image(oled, image, tracker):
+    """Show the given (rotated) image on the OLED.
+
+    Only the pages that changed since the last frame are sent.
+    """
+    oled.image(image)
+    framebuf = bytes(memoryview(oled.buffer)[1:])
+    bands = tracker.get_bands(framebuf)
+    if not bands:
+        return  # nothing changed
     for attempt in range(3):
         try:
-            oled.show()
+            show_bands(oled, bands)
+            tracker.update(framebuf)
             break
         except OSError as e:
             time.sleep(0.1)
     else:
         print(f"Failed to update display after 3 attempts")
+        tracker.reset()  # the display state is unknown, resend everything
+
 
+def create_drawer(oled, *, mode=None):
+    """Return a FrameDrawer that shows the frames on the OLED."""
+    # each page is a row of 8 pixels stored in width bytes
+    tracker = display_utils.DirtyTracker(oled.width)
+    # swap height/width because the screen is rotated 90 degrees
+    layout = display_utils.PagedLayout(oled.height, oled.width, MAX_ROWS,
+                                       rotate=True, mode=mode)
+    return display_utils.FrameDrawer(
+        layout, lambda image: show_image(oled, image, tracker)
+    )
 
-async def update_display(oled):
-    """Continuously update the display with latest sensor values."""
+async def update_display(oled, notifier):
+    """Update the display when new sensor values arrive."""
+    drawer = create_drawer(oled)
     try:
-        while True:
-            rows = display_utils.format_values(SENSOR_READINGS, max_rows=MAX_ROWS)
-            # swap height/width because the screen is rotated 90 degrees
-            image = display_utils.draw_image(oled.height, oled.width, rows)
-            if image:
-                show_image(oled, image)
-            await asyncio.sleep(config.display_refresh)
+        async for _ in display_utils.iter_frames(
+                notifier, idle_interval=drawer.layout.idle_interval):
+            drawer.draw(display_utils.format_values(SENSOR_READINGS))
     except asyncio.CancelledError:
         # clear display on shutdown
         oled.fill(0)
@@ -53,6 +87,10 @@ async def update_display(oled):
 async def main():
     """Main loop: read sensor values and display them on the OLED."""
     display_config = display_utils.DISPLAY_DATA['ssd1306']
+    # import_board() must be called before importing the Blinka modules
+    board = sensor_utils.import_board()
+    import digitalio
+    import adafruit_ssd1306
     # initialize display
     oled_reset = digitalio.DigitalInOut(getattr(board, display_config.reset_pin))
     oled = adafruit_ssd1306.SSD1306_I2C(
@@ -65,9 +103,10 @@ async def main():
     oled.fill(0)
     oled.show()
     # start MQTT monitor and display update tasks
+    notifier = display_utils.ChangeNotifier()
     await asyncio.gather(
-        display_utils.mqtt_monitor(SENSOR_READINGS),
-        update_display(oled),
+        display_utils.mqtt_monitor(SENSOR_READINGS, notifier),
+        update_display(oled, notifier),
     )
 
 
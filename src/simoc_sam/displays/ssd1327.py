@@ -1,6 +1,5 @@
 """Driver for the Adafruit SSD1327 OLED display (128x128 Grayscale)."""
 
-import time
 import asyncio
 
 import displayio
@@ -8,7 +7,7 @@ import adafruit_ssd1327
 
 from i2cdisplaybus import I2CDisplayBus
 
-from simoc_sam import utils, config
+from simoc_sam import utils
 from simoc_sam.displays import utils as display_utils
 
 
@@ -19,40 +18,44 @@ SENSOR_READINGS = {}
 MAX_ROWS = 15
 
 
-def blit_image_to_bitmap(bitmap, image, width):
+def blit_image_to_bitmap(bitmap, image, width, tracker=None):
     """Write a 1-bit PIL image into the existing bitmap in-place.
 
-    Only writes pixels that differ from the bitmap's current state.
-    Returns the number of pixels changed.
+    If a DirtyTracker (with a stride of width/8 bytes) is given, only the
+    rectangles of rows/bytes that changed since the previous frame are
+    written.  Returns the number of rectangles written.
     """
-    pixels = image.getdata()
-    changes = 0
-    for i, pixel in enumerate(pixels):
-        val = 1 if pixel else 0
-        x = i % width
-        y = i // width
-        if bitmap[x, y] != val:
-            bitmap[x, y] = val
-            changes += 1
-    return changes
-
-
-async def update_display(display, bitmap, width, height):
-    """Continuously update the display with latest sensor values."""
-    prev_rows = None
-    while True:
-        t_start = time.time()
-        rows = display_utils.format_values(SENSOR_READINGS, max_rows=MAX_ROWS)
-        if rows != prev_rows:
-            image = display_utils.draw_image(width, height, rows)
-            if image:
-                blit_image_to_bitmap(bitmap, image, width)
-                display.refresh()
-            prev_rows = rows
-        # subtract full cycle time (writes + I2C refresh) from sleep
-        elapsed = time.time() - t_start
-        sleep_time = max(0, config.display_refresh - elapsed)
-        await asyncio.sleep(sleep_time)
+    data = image.tobytes()  # packed, 8 pixels per byte
+    stride = (width + 7) // 8
+    if tracker is None:
+        tracker = display_utils.DirtyTracker(stride)
+    bands = tracker.get_bands(data)
+    for y0, y1, col0, col1 in bands:
+        x0, x1 = col0 * 8, min(col1 * 8, width)
+        # one byte per pixel (0 or 255) for the pixels of the rectangle
+        pixels = image.crop((x0, y0, x1, y1)).convert('L').tobytes()
+        rect_width = x1 - x0
+        for i, pixel in enumerate(pixels):
+            bitmap[x0 + i % rect_width, y0 + i // rect_width] = 1 if pixel else 0
+    tracker.update(data)
+    return len(bands)
+
+
+def create_drawer(display, bitmap, width, height, *, mode=None):
+    """Return a FrameDrawer that shows the frames on the display."""
+    tracker = display_utils.DirtyTracker((width + 7) // 8)
+    layout = display_utils.PagedLayout(width, height, MAX_ROWS, mode=mode)
+    def show(image):
+        if blit_image_to_bitmap(bitmap, image, width, tracker):
+            display.refresh()
+    return display_utils.FrameDrawer(layout, show)
+
+async def update_display(display, bitmap, width, height, notifier):
+    """Update the display when new sensor values arrive."""
+    drawer = create_drawer(display, bitmap, width, height)
+    async for _ in display_utils.iter_frames(
+            notifier, idle_interval=drawer.layout.idle_interval):
+        drawer.draw(display_utils.format_values(SENSOR_READINGS))
 
 
 async def main():
@@ -77,9 +80,10 @@ async def main():
     display.root_group = group
     display.auto_refresh = False
     # start MQTT monitor and display update tasks
+    notifier = display_utils.ChangeNotifier()
     await asyncio.gather(
-        display_utils.mqtt_monitor(SENSOR_READINGS),
-        update_display(display, bitmap, width, height),
+        display_utils.mqtt_monitor(SENSOR_READINGS, notifier),
+        update_display(display, bitmap, width, height, notifier),
     )
 
 
@@ -1,10 +1,13 @@
 """Utilities for display drivers."""
 
 import json
+import time
+import string
 import pathlib
 import asyncio
+import functools
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from dataclasses import dataclass
 
 import tomli
@@ -54,48 +57,366 @@ for name, info in DISPLAY_DATA.items():
     I2C_TO_DISPLAY_NAMES[info.i2c_address].append(name)
 
 
+class DisplayTemplate:
+    """A compiled display_format.
+
+    Each line of the format knows which keys it needs (e.g. 'scd30_co2'
+    for the co2 field of the scd30 sensor, or 'uptime'), lines with
+    missing values are skipped, and lines are only formatted again when
+    their values changed since the previous frame.
+    """
+
+    def __init__(self, display_format):
+        self.lines = []  # list of (line, keys) tuples
+        formatter = string.Formatter()
+        for line in display_format.splitlines():
+            try:
+                keys = tuple(dict.fromkeys(
+                    field_name.split('.')[0].split('[')[0]
+                    for _, field_name, _, _ in formatter.parse(line)
+                    if field_name is not None
+                ))
+            except ValueError as e:
+                print(f"Error parsing line {line!r}: {e}")
+                continue  # skip lines with formatting errors
+            self.lines.append((line, keys))
+        self.cache = {}  # line index: (values, formatted line or None)
+        self.splits = {}  # key: (sensor, field)
+
+    def lookup(self, key, sensor_readings):
+        """Return the value of the given key, or raise KeyError."""
+        if key == 'uptime':
+            return utils.uptime()
+        if key not in self.splits:
+            # find the sensor (the sensor name might contain '_' too)
+            for sensor, data in sensor_readings.items():
+                field = key[len(sensor)+1:]
+                if data and key.startswith(f'{sensor}_') and field in data:
+                    self.splits[key] = (sensor, field)
+                    break
+            else:
+                raise KeyError(key)
+        sensor, field = self.splits[key]
+        return (sensor_readings.get(sensor) or {})[field]
+
+    def format(self, sensor_readings, max_rows=None):
+        """Return the list of formatted rows."""
+        rows = []
+        for index, (line, keys) in enumerate(self.lines):
+            try:
+                values = {key: self.lookup(key, sensor_readings)
+                          for key in keys}
+            except KeyError:
+                continue  # skip lines without corresponding values
+            cached = self.cache.get(index)
+            if cached is None or cached[0] != values:
+                try:
+                    row = line.format_map(values)
+                except (ValueError, TypeError, KeyError) as e:
+                    print(f"Error formatting line {line!r}: {e}")
+                    row = None  # skip lines with formatting errors
+                cached = self.cache[index] = (values, row)
+            if cached[1] is not None:
+                rows.append(cached[1])
+                if max_rows and len(rows) == max_rows:
+                    break
+        return rows
+
+
+@functools.lru_cache(maxsize=4)
+def compile_template(display_format):
+    """Return a (cached) DisplayTemplate for the given format."""
+    return DisplayTemplate(display_format)
+
 def format_values(sensor_readings_dict, max_rows=None):
     """Format sensor values for display using configured format string."""
-    # flatten sensor readings: {'scd30': {'co2': 450}} -> {'scd30_co2': 450}
-    flattened = {'uptime': utils.uptime()}  # add uptime
-    for sensor, data in sensor_readings_dict.items():
-        if not data:
-            continue
-        for key, val in data.items():
-            flattened[f"{sensor}_{key}"] = val
-    rows = []
-    for line in config.display_format.splitlines():
+    template = compile_template(config.display_format)
+    return template.format(sensor_readings_dict, max_rows)
+
+
+FONT = ImageFont.load_default()
+
+
+class RowCache:
+    """LRU cache of the bitmaps of the rendered text rows.
+
+    The bitmaps are keyed by (text, font, width, rotate) and, if rotate
+    is True, they are rotated by 90 degrees (counterclockwise).
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.bitmaps = OrderedDict()
+
+    def get(self, text, font, width, rotate=False):
+        """Return the bitmap of the given row, rendering it if needed."""
+        key = (text, font, width, rotate)
         try:
-            rows.append(line.format_map(flattened))
+            self.bitmaps.move_to_end(key)
+            return self.bitmaps[key]
         except KeyError:
-            continue  # skip lines without corresponding values
-        except (ValueError, TypeError) as e:
-            print(f"Error formatting line {line!r}: {e}")
-            continue  # skip lines with formatting errors
-    return rows[:max_rows] if max_rows else rows
+            pass
+        bottom = ImageDraw.Draw(Image.new("1", (1, 1))).textbbox(
+            (0, 0), text, font=font
+        )[3]
+        bitmap = Image.new("1", (width, max(bottom, 1)), 0)
+        ImageDraw.Draw(bitmap).text((0, 0), text, font=font, fill=255)
+        if rotate:
+            bitmap = bitmap.rotate(90, expand=True)
+        self.bitmaps[key] = bitmap
+        if len(self.bitmaps) > self.maxsize:
+            self.bitmaps.popitem(last=False)
+        return bitmap
 
 
-FONT = ImageFont.load_default()
+ROW_CACHE = RowCache()
 
-def draw_image(width, height, rows):
-    """Draw sensor values on a PIL image and return it."""
+def draw_image(width, height, rows, *, rotate=False):
+    """Draw sensor values on a PIL image and return it.
+
+    If rotate is True, return the image rotated by 90 degrees
+    (counterclockwise), i.e. with a size of (height, width).
+    The rows are composed from the bitmaps cached in ROW_CACHE.
+    """
     if not rows:
         return  # nothing to display
-    image = Image.new("1", (width, height), 0)  # black background
-    draw = ImageDraw.Draw(image)
+    size = (height, width) if rotate else (width, height)
+    image = Image.new("1", size, 0)  # black background
     spacing = max(8, height // len(rows))  # calc row height dynamically
     y = 0
     for row in rows:
         if not row.strip():
             y += 6  # extra spacing for blank lines
         else:
-            draw.text((0, y), row, font=FONT, fill=255)  # white text
+            bitmap = ROW_CACHE.get(row, FONT, width, rotate)
+            # paste the white text without clearing the rows above
+            image.paste(255, (y, 0) if rotate else (0, y), mask=bitmap)
             y += spacing
     return image
 
 
-async def mqtt_monitor(sensor_readings_dict):
-    """Add sensor data received from MQTT to the given dictionary (in place)."""
+LAYOUT_MODES = ('', 'page', 'scroll')
+
+class PagedLayout:
+    """Show more rows than fit on the display.
+
+    With mode='page' the rows are split in pages of max_rows rows that
+    are cycled every page_interval seconds, with mode='scroll' the rows
+    are scrolled continuously by scroll_speed pixels/second, and with
+    mode='' only the first max_rows rows are shown.  The images of the
+    pages (or the scrolling strip) are rendered once and reused until
+    their rows change, so the drivers can just compare the returned
+    images to know if the display has to be updated.
+    """
+
+    def __init__(self, width, height, max_rows, *, rotate=False, mode=None,
+                 page_interval=None, scroll_speed=None):
+        self.width, self.height = width, height
+        self.max_rows = max_rows
+        self.rotate = rotate
+        self.mode = config.display_layout if mode is None else mode
+        if self.mode not in LAYOUT_MODES:
+            raise ValueError(f'Unknown layout mode: {self.mode!r}')
+        self.page_interval = page_interval or config.display_page_interval
+        self.scroll_speed = scroll_speed or config.display_scroll_speed
+        # scrolling needs a frame every time the strip moves
+        if self.mode == 'scroll':
+            self.idle_interval = max(config.display_min_interval,
+                                     1 / self.scroll_speed)
+        else:
+            self.idle_interval = config.display_refresh
+        self.images = {}  # tuple of rows: image
+        self.window = None  # (strip, offset, image) of the last scroll frame
+
+    def get_pages(self, rows):
+        """Split the rows in pages of max_rows rows."""
+        if not self.mode:
+            return [rows[:self.max_rows]]
+        step = self.max_rows
+        return [rows[x:x+step] for x in range(0, len(rows), step)] or [[]]
+
+    def get_rows(self, rows, now=None):
+        """Return the rows of the page that should be shown now."""
+        pages = self.get_pages(rows)
+        now = time.monotonic() if now is None else now
+        return pages[int(now // self.page_interval) % len(pages)]
+
+    def render(self, rows, now=None):
+        """Return the image that should be shown now (or None)."""
+        now = time.monotonic() if now is None else now
+        if self.mode == 'scroll' and len(rows) > self.max_rows:
+            return self.render_scroll(rows, now)
+        # pre-render all the pages, reusing the ones that didn't change
+        pages = [tuple(page) for page in self.get_pages(rows)]
+        self.images = {
+            page: self.images.get(page) or draw_image(
+                self.width, self.height, page, rotate=self.rotate)
+            for page in pages
+        }
+        return self.images[pages[int(now // self.page_interval) % len(pages)]]
+
+    def render_scroll(self, rows, now):
+        key = tuple(rows)
+        if key not in self.images:
+            spacing = max(8, self.height // self.max_rows)
+            length = spacing * len(rows)
+            image = draw_image(self.width, length, rows, rotate=self.rotate)
+            # repeat the rows, so that the window can wrap around
+            if self.rotate:
+                strip = Image.new("1", (2 * length, self.width), 0)
+                strip.paste(image, (0, 0))
+                strip.paste(image, (length, 0))
+            else:
+                strip = Image.new("1", (self.width, 2 * length), 0)
+                strip.paste(image, (0, 0))
+                strip.paste(image, (0, length))
+            self.images = {key: (strip, length)}
+        strip, length = self.images[key]
+        offset = int(now * self.scroll_speed) % length
+        if self.window and self.window[:2] == (strip, offset):
+            return self.window[2]  # the strip didn't move
+        if self.rotate:
+            box = (offset, 0, offset + self.height, self.width)
+        else:
+            box = (0, offset, self.width, offset + self.height)
+        image = strip.crop(box)
+        self.window = (strip, offset, image)
+        return image
+
+
+class FrameDrawer:
+    """Render the rows with a layout and show the images that changed.
+
+    show(image) is only called when the layout returns a different image,
+    since the layouts reuse the images of the pages that didn't change.
+    The drivers call draw() for each frame yielded by iter_frames().
+    """
+
+    def __init__(self, layout, show):
+        self.layout = layout
+        self.show = show
+        self.prev_image = None
+
+    def draw(self, rows, now=None):
+        """Render the rows and return True if a new image was shown."""
+        image = self.layout.render(rows, now)
+        if image is self.prev_image:
+            return False
+        self.prev_image = image
+        if not image:
+            return False
+        self.show(image)
+        return True
+
+
+def get_dirty_bands(prev, cur, stride):
+    """Compare two buffers made of rows of stride bytes each.
+
+    Return a list of (row0, row1, col0, col1) tuples (with exclusive
+    ends), one for each band of consecutive changed rows, where col0/col1
+    delimit the changed bytes in the band.  If prev is None, the whole
+    buffer is returned as a single band.
+    """
+    rows = len(cur) // stride
+    if prev is None or len(prev) != len(cur):
+        return [(0, rows, 0, stride)] if rows else []
+    bands = []
+    band = None
+    for row in range(rows):
+        start = row * stride
+        prev_row, cur_row = prev[start:start+stride], cur[start:start+stride]
+        if prev_row == cur_row:
+            band = None
+            continue
+        # find the first and last changed bytes of the row
+        col0 = next(x for x in range(stride) if prev_row[x] != cur_row[x])
+        col1 = next(x for x in reversed(range(stride))
+                    if prev_row[x] != cur_row[x]) + 1
+        if band is None:
+            band = [row, row + 1, col0, col1]
+            bands.append(band)
+        else:
+            band[1] = row + 1
+            band[2], band[3] = min(band[2], col0), max(band[3], col1)
+    return [tuple(band) for band in bands]
+
+
+class DirtyTracker:
+    """Remember the last frame sent to a display and find what changed.
+
+    The frames are buffers made of rows (or pages) of stride bytes.
+    """
+
+    def __init__(self, stride):
+        self.stride = stride
+        self.prev = None
+
+    def get_bands(self, data):
+        """Return the bands of data that changed since the last update."""
+        return get_dirty_bands(self.prev, data, self.stride)
+
+    def update(self, data):
+        """Remember data as the frame currently shown on the display."""
+        self.prev = bytes(data)
+
+    def reset(self):
+        """Forget the last frame, so that the next one is sent in full."""
+        self.prev = None
+
+
+class ChangeNotifier:
+    """Notify the display drivers when new readings arrive."""
+
+    def __init__(self):
+        self.event = asyncio.Event()
+        self.changed = set()
+
+    def notify(self, sensor):
+        """Record that the readings of the given sensor changed."""
+        self.changed.add(sensor)
+        self.event.set()
+
+    async def wait(self, timeout=None):
+        """Wait for changes and return the set of changed sensors.
+
+        Return an empty set if nothing changed within timeout seconds.
+        """
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.event.clear()
+        changed, self.changed = self.changed, set()
+        return changed
+
+
+async def iter_frames(notifier, *, min_interval=None, idle_interval=None):
+    """Yield the set of changed sensors whenever a frame should be drawn.
+
+    A frame is drawn as soon as new readings arrive, but at most every
+    min_interval seconds (config.display_min_interval), or after
+    idle_interval seconds (config.display_refresh) without new readings
+    (e.g. to update the uptime).
+    """
+    if min_interval is None:
+        min_interval = config.display_min_interval
+    if idle_interval is None:
+        idle_interval = config.display_refresh
+    loop = asyncio.get_running_loop()
+    while True:
+        changed = await notifier.wait(idle_interval)
+        frame_start = loop.time()
+        yield changed
+        # the changes received in the meantime are drawn in the next frame
+        elapsed = loop.time() - frame_start
+        await asyncio.sleep(max(0, min_interval - elapsed))
+
+
+async def mqtt_monitor(sensor_readings_dict, notifier=None):
+    """Add sensor data received from MQTT to the given dictionary (in place).
+
+    If a ChangeNotifier is given, it's notified of each new reading.
+    """
     mqtt_host, mqtt_port = config.mqtt_host, config.mqtt_port
     mqtt_addr = f"{mqtt_host}:{mqtt_port}"
     mqtt_topic_sub = config.mqtt_topic_sub
@@ -116,6 +437,8 @@ async def mqtt_monitor(sensor_readings_dict):
                         print(f'Error processing MQTT message: {e}')
                         continue
                     sensor_readings_dict[sensor] = payload
+                    if notifier is not None:
+                        notifier.notify(sensor)
                     if config.verbose_mqtt:
                         print(f'Received from {sensor}: {payload}')
         except asyncio.CancelledError:
@@ -0,0 +1,107 @@
+"""Measure the import time of the simoc_sam entry points.
+
+Each module is imported in a new interpreter with `python -X importtime`
+(repeat times, reporting the median), and the slowest imports of each
+module are listed, to spot the dependencies that should be imported
+lazily.  The modules that fail to import (e.g. because of missing
+hardware libraries) are reported too.
+
+Usage:
+  python -m simoc_sam.importbench [--repeat 5] [--top 5] [module ...]
+"""
+
+import sys
+import argparse
+import statistics
+import subprocess
+
+from simoc_sam.sensors import utils as sensor_utils
+
+
+def get_default_modules():
+    """Return the services, displays, and sensor entry points."""
+    modules = ['simoc_sam.siobridge', 'simoc_sam.sioclient',
+               'simoc_sam.csvwriter', 'simoc_sam.sqlitewriter',
+               'simoc_sam.displays.ssd1306', 'simoc_sam.displays.ssd1327',
+               'simoc_sam.displays.framebuffer']
+    modules += sorted({info.module for info in sensor_utils.SENSOR_DATA.values()
+                       if info.module})
+    return modules
+
+
+def parse_importtime(output):
+    """Parse the output of -X importtime.
+
+    Return a {module: (self us, cumulative us, level)} dict, where
+    level is the nesting level of the import (0 for the top-level ones).
+    """
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        try:
+            self_us, cumulative_us, name = line[12:].split('|', 2)
+            self_us, cumulative_us = int(self_us), int(cumulative_us)
+        except ValueError:
+            continue  # the header line
+        name = name[1:]  # remove the separator space
+        stripped = name.lstrip()
+        level = (len(name) - len(stripped)) // 2
+        times[stripped] = (self_us, cumulative_us, level)
+    return times
+
+def get_import_time(module, times):
+    """Return the time (in us) spent importing module and its parents."""
+    parts = module.split('.')
+    chain = {'.'.join(parts[:n]) for n in range(1, len(parts) + 1)}
+    return sum(cumulative for name, (_, cumulative, level) in times.items()
+               if level == 0 and name in chain)
+
+def measure(module, python=sys.executable):
+    """Import module in a new interpreter and return (us, times, error)."""
+    result = subprocess.run(
+        [python, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True,
+    )
+    times = parse_importtime(result.stderr)
+    error = None
+    if result.returncode:
+        lines = [line for line in result.stderr.splitlines()
+                 if not line.startswith('import time:')]
+        error = lines[-1] if lines else f'exit code {result.returncode}'
+    return get_import_time(module, times), times, error
+
+def benchmark(module, repeat=5):
+    """Return (median ms, slowest imports, error) for the given module."""
+    results = [measure(module) for x in range(repeat)]
+    median = statistics.median(us for us, _, _ in results) / 1000
+    times, error = results[-1][1:]
+    slowest = sorted(((self_us / 1000, name)
+                      for name, (self_us, _, _) in times.items()
+                      if name != module), reverse=True)
+    return median, slowest, error
+
+
+def parse_args(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('modules', nargs='*', metavar='module',
+                        help='The modules to import (default: the services, '
+                             'displays, and sensors).')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='How many times each module is imported.')
+    parser.add_argument('--top', type=int, default=5,
+                        help='How many of the slowest imports are listed.')
+    return parser.parse_args(arguments)
+
+def main(arguments=None):
+    args = parse_args(arguments)
+    for module in args.modules or get_default_modules():
+        median, slowest, error = benchmark(module, args.repeat)
+        status = f' (failed: {error})' if error else ''
+        print(f'{module}: {median:.1f} ms{status}')
+        for ms, name in slowest[:args.top]:
+            print(f'  {ms:8.1f} ms  {name}')
+
+
+if __name__ == '__main__':
+    main()
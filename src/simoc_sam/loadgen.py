@@ -0,0 +1,202 @@
+"""Simulate many mock sensors to load test the MQTT broker and siobridge.
+
+A single asyncio loop generates readings for thousands of virtual mock
+sensors (see simoc_sam.sensors.mocksensor), publishes them to the MQTT
+broker at the given rate, and optionally connects a set of virtual
+Socket.IO clients to the siobridge to measure the end-to-end throughput
+and latency (using a 'sent' field added to each reading).
+
+Usage:
+  python -m simoc_sam.loadgen --sensors 1000 --rate 1 --clients 10
+
+NumPy is used to generate the readings if available.
+"""
+
+import json
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+from datetime import datetime
+
+import aiomqtt
+import socketio
+
+from . import config
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# field: (base value, offset, (min, max)), as in mocksensor.Mock
+FIELDS = {
+    'co2': (1000, 50, (0, 5000)),
+    'temperature': (20, 1, (0, 40)),
+    'humidity': (50, 3, (0, 100)),
+    'altitude': (1000, 1, (0, 10000)),
+    'pressure': (900, 5, (0, 10000)),
+}
+
+
+class VirtualSensors:
+    """Generate random walk readings for n mock sensors at once.
+
+    Each field of each sensor starts from the base value and changes
+    with a gaussian step (with sigma = offset/3) at every step().
+    extra_fields adds extra_0..extra_N fields, to test larger payloads.
+    """
+
+    def __init__(self, n, fields=None, *, extra_fields=0, use_numpy=True):
+        fields = {field: FIELDS[field] for field in fields or FIELDS}
+        for x in range(extra_fields):
+            fields[f'extra_{x}'] = (0, 3, (-100, 100))
+        self.n = n
+        self.fields = list(fields)
+        bases, offsets, ranges = zip(*fields.values())
+        self.sigmas = [offset / 3 for offset in offsets]
+        self.mins, self.maxs = zip(*ranges)
+        self.use_numpy = use_numpy and np is not None
+        if self.use_numpy:
+            self.rng = np.random.default_rng()
+            self.values = np.tile(np.array(bases, dtype=float), (n, 1))
+            self.sigmas = np.array(self.sigmas)
+        else:
+            self.values = [list(map(float, bases)) for _ in range(n)]
+
+    def step(self):
+        """Update the values and return a list with a reading per sensor."""
+        if self.use_numpy:
+            self.values += self.rng.normal(0, self.sigmas, self.values.shape)
+            np.clip(self.values, self.mins, self.maxs, out=self.values)
+            rows = self.values.tolist()
+        else:
+            bounds = list(zip(self.sigmas, self.mins, self.maxs))
+            for row in self.values:
+                for x, (sigma, vmin, vmax) in enumerate(bounds):
+                    row[x] = max(vmin, min(random.gauss(row[x], sigma), vmax))
+            rows = self.values
+        return [dict(zip(self.fields, row)) for row in rows]
+
+
+class LatencyStats:
+    """Collect the end-to-end latencies of the received readings."""
+
+    def __init__(self):
+        self.latencies = []
+        self.received = 0
+
+    def add_batch(self, batch, now=None):
+        now = time.time() if now is None else now
+        for bundle in batch:
+            for reading in bundle['readings'].values():
+                self.received += 1
+                if 'sent' in reading:
+                    self.latencies.append(now - reading['sent'])
+
+    def pop_summary(self):
+        """Return a summary string and reset the stats."""
+        received, latencies = self.received, sorted(self.latencies)
+        self.received, self.latencies = 0, []
+        if len(latencies) < 2:
+            return f'received {received} readings'
+        p50, p95 = [statistics.quantiles(latencies, n=100)[p - 1]
+                    for p in (50, 95)]
+        return (f'received {received} readings; latency p50 {p50:.3f}s, '
+                f'p95 {p95:.3f}s, max {latencies[-1]:.3f}s')
+
+
+async def publish_readings(sensors, client, rate, counter):
+    """Publish a reading for each sensor every 1/rate seconds."""
+    location = config.location or 'loadgen'
+    topics = [f'{location}/loadgen{x:05}/mock' for x in range(sensors.n)]
+    interval = 1 / rate
+    loop = asyncio.get_running_loop()
+    next_time = loop.time()
+    n = 0
+    while True:
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+        sent = time.time()
+        for topic, reading in zip(topics, sensors.step()):
+            reading.update(n=n, timestamp=timestamp, sent=sent)
+            await client.publish(topic, json.dumps(reading))
+            counter['published'] += 1
+        n += 1
+        next_time += interval
+        delay = next_time - loop.time()
+        if delay < 0:
+            counter['late'] += 1  # can't keep up with the rate
+            next_time = loop.time()
+        await asyncio.sleep(max(delay, 0))
+
+async def start_client(url, stats):
+    """Connect a virtual Socket.IO client to the siobridge."""
+    sio = socketio.AsyncClient()
+    sio.on('step-batch', stats.add_batch)
+    await sio.connect(url)
+    await sio.emit('register-client')
+    return sio
+
+async def report(counter, stats, interval):
+    """Print the throughput and latency every interval seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        published, counter['published'] = counter['published'], 0
+        late, counter['late'] = counter['late'], 0
+        print(f'published {published / interval:.0f} msg/s '
+              f'({late} late steps); {stats.pop_summary()}')
+
+async def run(args):
+    fields = args.fields.split(',') if args.fields else None
+    sensors = VirtualSensors(args.sensors, fields,
+                             extra_fields=args.extra_fields)
+    counter = dict(published=0, late=0)
+    stats = LatencyStats()
+    clients = []
+    url = f'http://{args.sio_host}:{args.sio_port}'
+    for x in range(args.clients):
+        clients.append(await start_client(url, stats))
+    print(f'Simulating {args.sensors} sensors at {args.rate} readings/s '
+          f'with {args.clients} Socket.IO client(s)')
+    try:
+        async with aiomqtt.Client(args.mqtt_host, args.mqtt_port) as client:
+            tasks = [publish_readings(sensors, client, args.rate, counter),
+                     report(counter, stats, args.report_interval)]
+            await asyncio.wait_for(asyncio.gather(*tasks), args.duration)
+    except asyncio.TimeoutError:
+        pass  # the duration elapsed
+    finally:
+        for sio in clients:
+            await sio.disconnect()
+
+def parse_args(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sensors', type=int, default=1000,
+                        help='The number of virtual sensors.')
+    parser.add_argument('--rate', type=float, default=1.0,
+                        help='Readings per second for each sensor.')
+    parser.add_argument('--fields', help='Comma-separated list of fields '
+                        f'(default: {",".join(FIELDS)}).')
+    parser.add_argument('--extra-fields', type=int, default=0,
+                        help='Number of extra fields added to the readings.')
+    parser.add_argument('--clients', type=int, default=0,
+                        help='The number of virtual Socket.IO clients.')
+    parser.add_argument('--duration', type=float, default=60,
+                        help='How many seconds the test should last.')
+    parser.add_argument('--report-interval', type=float, default=5,
+                        help='How many seconds between reports.')
+    parser.add_argument('--mqtt-host', default=config.mqtt_host)
+    parser.add_argument('--mqtt-port', type=int, default=config.mqtt_port)
+    parser.add_argument('--sio-host', default=config.sio_host)
+    parser.add_argument('--sio-port', type=int, default=config.sio_port)
+    return parser.parse_args(arguments)
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(run(parse_args()))
+    except KeyboardInterrupt:
+        print('Interrupted by user')
@@ -0,0 +1,102 @@
+"""Sparse time index for the JSONL sensor logs.
+
+The index is stored in a <log>.jsonl.idx sidecar file, with a
+"<timestamp>\\t<byte offset>" line every `interval` lines of the log.
+read_log_range() uses it to binary search the first line of a time range
+and only reads the lines in the range.
+
+Usage (to (re)build the index of existing logs):
+  python -m simoc_sam.logindex ~/logs/*.jsonl
+"""
+
+import sys
+import json
+import bisect
+
+from pathlib import Path
+
+from . import config
+
+
+def get_index_path(log_path):
+    return log_path.with_name(f'{log_path.name}.idx')
+
+
+class LogIndexWriter:
+    """Add an entry to the index of a log every interval lines."""
+
+    def __init__(self, log_path, interval=100):
+        self.path = get_index_path(log_path)
+        self.interval = interval
+        self.lines = 0  # the first line logged after a restart is indexed
+
+    def add(self, timestamp, offset):
+        """Record that the line at offset has the given timestamp."""
+        if self.lines % self.interval == 0:
+            with open(self.path, 'a') as f:
+                f.write(f'{timestamp}\t{offset}\n')
+        self.lines += 1
+
+
+def load_index(log_path):
+    """Return a sorted list of (timestamp, offset) tuples."""
+    entries = []
+    try:
+        with open(get_index_path(log_path)) as f:
+            for line in f:
+                timestamp, sep, offset = line.rstrip('\n').partition('\t')
+                if sep and offset.isdigit():
+                    entries.append((timestamp, int(offset)))
+    except FileNotFoundError:
+        pass
+    return entries
+
+def find_offset(entries, start):
+    """Return the offset of an indexed line before the start timestamp."""
+    # find the last entry with a timestamp < start
+    pos = bisect.bisect_left(entries, (start,)) - 1
+    return entries[pos][1] if pos >= 0 else 0
+
+def read_log_range(log_path, start=None, end=None):
+    """Yield the readings with start <= timestamp < end from a JSONL log.
+
+    start/end are timestamps (e.g. '2024-03-06 14:00'); if start is
+    given, the index is used to skip the earlier lines.
+    """
+    offset = find_offset(load_index(log_path), start) if start else 0
+    with open(log_path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            try:
+                reading = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # skip incomplete/invalid lines
+            timestamp = reading.get('timestamp', '')
+            if start and timestamp < start:
+                continue
+            if end and timestamp >= end:
+                break
+            yield reading
+
+def build_index(log_path, interval=100):
+    """(Re)build the index of an existing log."""
+    index_path = get_index_path(log_path)
+    with open(log_path, 'rb') as log, open(index_path, 'w') as index:
+        offset = next_line = 0
+        for n, line in enumerate(log):
+            if n >= next_line:
+                try:
+                    timestamp = json.loads(line)['timestamp']
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    pass  # try again with the next line
+                else:
+                    index.write(f'{timestamp}\t{offset}\n')
+                    next_line = n + interval
+            offset += len(line)
+    return index_path
+
+
+if __name__ == '__main__':
+    for arg in sys.argv[1:]:
+        path = build_index(Path(arg), config.log_index_interval or 100)
+        print(f'Index written to {path}')
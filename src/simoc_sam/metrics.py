@@ -0,0 +1,135 @@
+"""Minimal metrics (counters, gauges, histograms) that can be scraped locally.
+
+The metrics are exported using the Prometheus text format, and can be
+written to a .prom file (e.g. for the node exporter textfile collector)
+or returned as a string.
+"""
+
+import os
+import bisect
+import threading
+
+from pathlib import Path
+
+
+class Counter:
+    """A value that can only increase."""
+    type = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        yield self.name, self.value
+
+
+class Gauge:
+    """A value that can go up and down, or that is returned by func."""
+    type = 'gauge'
+
+    def __init__(self, name, help, func=None):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.func() if self.func is not None else self.value
+
+    def samples(self):
+        yield self.name, self.get()
+
+
+class Histogram:
+    """Count observed values in cumulative buckets."""
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last is +Inf
+        self.sum = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip([*self.buckets, '+Inf'], self.counts):
+            cumulative += count
+            yield f'{self.name}_bucket{{le="{bound}"}}', cumulative
+        yield f'{self.name}_sum', self.sum
+        yield f'{self.name}_count', self.count
+
+
+class Metrics:
+    """A collection of metrics sharing the same labels."""
+
+    def __init__(self, labels=None):
+        self.labels = labels or {}
+        self.metrics = {}
+
+    def add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help):
+        return self.add(Counter(name, help))
+
+    def gauge(self, name, help, func=None):
+        return self.add(Gauge(name, help, func))
+
+    def histogram(self, name, help, buckets):
+        return self.add(Histogram(name, help, buckets))
+
+    def __getitem__(self, name):
+        return self.metrics[name]
+
+    def add_labels(self, sample_name):
+        """Add self.labels to the labels of a sample name."""
+        if not self.labels:
+            return sample_name
+        labels = ','.join(f'{k}="{v}"' for k, v in self.labels.items())
+        if sample_name.endswith('}'):
+            return f'{sample_name[:-1]},{labels}}}'
+        return f'{sample_name}{{{labels}}}'
+
+    def to_prometheus(self):
+        """Return the metrics as a string in the Prometheus text format."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for sample_name, value in metric.samples():
+                lines.append(f'{self.add_labels(sample_name)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self):
+        """Return a {sample_name: value} dict with all the samples."""
+        return {sample_name: value
+                for metric in self.metrics.values()
+                for sample_name, value in metric.samples()}
+
+    def write(self, path):
+        """Atomically write the metrics to the given path."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_text(self.to_prometheus())
+        os.replace(tmp_path, path)
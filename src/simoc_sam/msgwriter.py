@@ -0,0 +1,139 @@
+"""Write the received MQTT messages to disk in a separate thread."""
+
+import time
+import queue
+import threading
+
+from abc import ABC, abstractmethod
+
+from simoc_sam import config
+from simoc_sam.metrics import Metrics
+
+
+class BaseMessageWriter(ABC):
+    """Base class of the writers used by the MQTT recorders.
+
+    The messages are added to a queue of up to max_queue_size messages
+    by the paho network thread and then handled by the writer thread,
+    so that slow disk writes don't block the network handling.  If the
+    queue is full, new messages are dropped.
+
+    The writer thread collects up to batch_size messages (waiting at
+    most batch_interval seconds after the first one) and passes them to
+    write_batch(), which must be implemented by the subclasses and must
+    return the number of messages that were written.  idle() is called
+    when no messages arrive for batch_interval seconds.
+
+    The queue depth and the number of written/skipped/dropped messages
+    are written to log_dir/metrics/<name>.prom every metrics_interval
+    seconds, using <name>_ as prefix for the metrics.
+    """
+
+    def __init__(self, name, max_queue_size=10_000, *, batch_size=1,
+                 batch_interval=1.0,
+                 metrics_interval=config.mqtt_metrics_interval):
+        self.name = name
+        self.queue = queue.Queue(max_queue_size)
+        self.thread = None
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.metrics_interval = metrics_interval
+        self.metrics_path = config.log_dir / 'metrics' / f'{name}.prom'
+        self.last_metrics_write = time.monotonic()
+        self.metrics = Metrics()
+        self.metrics.counter(f'{name}_messages_total',
+                             'Messages written to disk.')
+        self.metrics.counter(f'{name}_skipped_total',
+                             'Invalid messages that were not written.')
+        self.metrics.counter(f'{name}_dropped_total',
+                             'Messages dropped because the queue was full.')
+        self.metrics.gauge(f'{name}_queue_depth',
+                           'Messages waiting to be written.',
+                           func=self.queue.qsize)
+
+    @property
+    def written(self):
+        return self.metrics[f'{self.name}_messages_total'].value
+
+    @property
+    def skipped(self):
+        return self.metrics[f'{self.name}_skipped_total'].value
+
+    @property
+    def dropped(self):
+        return self.metrics[f'{self.name}_dropped_total'].value
+
+    def put(self, topic, payload):
+        """Add a message to the queue (called by the network thread)."""
+        try:
+            self.queue.put_nowait((topic, payload))
+        except queue.Full:
+            self.metrics[f'{self.name}_dropped_total'].inc()
+            dropped = self.dropped
+            if dropped == 1 or dropped % 1000 == 0:
+                print(f'Writer queue full, {dropped} messages dropped')
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Write the remaining messages and stop the writer thread."""
+        if self.thread is not None:
+            self.queue.put(None)  # wait for a free slot
+            self.thread.join()
+            self.thread = None
+        if self.metrics_interval:
+            self.write_metrics()
+
+    def get_batch(self):
+        """Return the next batch of messages (possibly empty).
+
+        The batch ends with None if the writer has been stopped.
+        """
+        try:
+            batch = [self.queue.get(timeout=self.batch_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size and batch[-1] is not None:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=max(timeout, 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        running = True
+        while running:
+            batch = self.get_batch()
+            if not batch:
+                self.idle()  # no new messages
+            elif batch[-1] is None:
+                running = False
+                batch.pop()
+            if batch:
+                written = self.write_batch(batch)
+                self.metrics[f'{self.name}_messages_total'].inc(written)
+                self.metrics[f'{self.name}_skipped_total'].inc(
+                    len(batch) - written)
+            if (self.metrics_interval and time.monotonic() -
+                    self.last_metrics_write >= self.metrics_interval):
+                self.write_metrics()
+
+    @abstractmethod
+    def write_batch(self, batch):
+        """Write a list of (topic, payload) messages and return the count."""
+        raise NotImplementedError()
+
+    def idle(self):
+        """Called when no messages arrived for batch_interval seconds."""
+
+    def write_metrics(self):
+        """Write the metrics to log_dir/metrics/<name>.prom."""
+        self.last_metrics_write = time.monotonic()
+        try:
+            self.metrics.write(self.metrics_path)
+        except OSError as err:
+            print(f'Unable to write metrics: {err}')
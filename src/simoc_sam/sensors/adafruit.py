@@ -11,14 +11,12 @@ from contextlib import ExitStack
 from . import utils
 from .basesensor import MQTTWrapper
 
-board = utils.import_board()
-
-import busio
-
-from adafruit_blinka.microcontroller.mcp2221.mcp2221 import MCP2221
-
 
 async def main():
+    # import_board() must be called before importing busio/adafruit_blinka
+    utils.import_board()
+    import busio
+    from adafruit_blinka.microcontroller.mcp2221.mcp2221 import MCP2221
     addresses = MCP2221.available_paths()
 
     sensors_classes = []
@@ -52,4 +50,6 @@ async def main():
                        for sensor in sensors]
         await asyncio.gather(*[mqttw.start(host, port) for mqttw in mqttwrappers])
 
-asyncio.run(main())
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,185 @@
+"""Helpers to compute statistics over windows of sensor readings."""
+
+import math
+import time
+
+# stats added as <field>_<stat> when aggregating (the mean replaces <field>),
+# used by both the BNO085 windows and config.sensor_aggregation
+DEFAULT_STATS = ('min', 'max', 'rms', 'stddev')
+VALID_STATS = {'mean', 'min', 'max', 'rms', 'stddev'}
+# the order of the <field>_<stat> columns used by the recorders
+STATS_ORDER = ('mean', 'min', 'max', 'rms', 'stddev')
+
+
+def is_numeric(value):
+    """Return True if value can be aggregated (bools are excluded)."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class FieldStats:
+    """Incrementally compute mean/min/max/RMS/stddev of a numeric field."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sum_sq = 0.0
+        self.m2 = 0.0  # sum of squared differences from the mean
+
+    def add(self, value):
+        """Update the stats with a new value."""
+        # use Welford's algorithm to avoid storing the values
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.sum_sq += value * value
+
+    @property
+    def rms(self):
+        return math.sqrt(self.sum_sq / self.count) if self.count else 0.0
+
+    @property
+    def stddev(self):
+        """Return the population standard deviation."""
+        return math.sqrt(self.m2 / self.count) if self.count else 0.0
+
+    def get(self, stat):
+        """Return the value of the given stat (e.g. 'mean' or 'rms')."""
+        if stat not in VALID_STATS:
+            raise ValueError(f'Unknown stat: {stat!r}')
+        return getattr(self, stat)
+
+
+class ReadingAggregator:
+    """Incrementally aggregate sensor readings over a window.
+
+    The window ends after `window` seconds (measured from the first
+    reading) or after `samples` readings, whichever comes first.
+    If `fields` is given, only those fields are aggregated, and fields
+    whose info has `aggregate = false` keep the latest value; otherwise
+    all numeric fields are aggregated.  Boolean flags (e.g. the BNO085
+    shake detector) are True if they were True in any of the readings.
+    """
+
+    def __init__(self, fields=None, *, window=None, samples=None,
+                 stats=DEFAULT_STATS):
+        unknown = set(stats) - VALID_STATS
+        if unknown:
+            raise ValueError(f'Unknown stats: {sorted(unknown)} '
+                             f'(valid options: {sorted(VALID_STATS)})')
+        if fields is not None:
+            fields = {field for field, info in fields.items()
+                      if info.get('aggregate', True)}
+        self.fields = fields
+        self.window = window
+        self.samples = samples
+        self.stats = stats
+        self.reset()
+
+    def reset(self):
+        """Discard the current window."""
+        self.count = 0
+        self.start_time = None
+        self.field_stats = {}
+        self.latest = {}
+
+    def add(self, reading):
+        """Add a reading to the current window."""
+        if self.start_time is None:
+            self.start_time = time.monotonic()
+        self.count += 1
+        fields = self.fields
+        for field, value in reading.items():
+            if is_numeric(value) and (fields is None or field in fields):
+                self.field_stats.setdefault(field, FieldStats()).add(value)
+            elif isinstance(value, bool):
+                self.latest[field] = self.latest.get(field, False) or value
+            else:
+                self.latest[field] = value
+
+    def is_ready(self):
+        """Return True if the current window is complete."""
+        if not self.count:
+            return False
+        if self.samples is not None and self.count >= self.samples:
+            return True
+        if self.window is not None:
+            return time.monotonic() - self.start_time >= self.window
+        return False
+
+    def pop(self):
+        """Return the aggregated reading and start a new window."""
+        result = {}
+        for field, fstats in self.field_stats.items():
+            result[field] = fstats.mean
+            for stat in self.stats:
+                result[f'{field}_{stat}'] = fstats.get(stat)
+        result.update(self.latest)
+        if result:
+            result['samples'] = self.count
+        self.reset()
+        return result
+
+
+def aggregate_readings(readings, fields=None, *, stats=DEFAULT_STATS):
+    """Aggregate a sequence of readings into a single reading.
+
+    Numeric fields are replaced by their mean, and a <field>_<stat> field
+    is added for each of the given stats.  Non-numeric fields (e.g. the
+    BNO085 classifications) keep the latest value, and boolean flags are
+    True if any reading had them set.  If `fields` is given, it is used
+    as in ReadingAggregator.  A 'samples' field with the number of
+    aggregated readings is also added.
+    """
+    aggregator = ReadingAggregator(fields, stats=stats)
+    for reading in readings:
+        aggregator.add(reading)
+    return aggregator.pop()
+
+
+def is_aggregated(reading):
+    """Return True if reading was produced by a ReadingAggregator."""
+    return 'samples' in reading
+
+def get_aggregated_info(reading_info):
+    """Return the reading_info of the aggregated readings.
+
+    The numeric fields that are aggregated become floats (their mean)
+    and are followed by a <field>_<stat> float field for each valid
+    stat, and a 'samples' int field is added at the end, so that the
+    recorders can store all the fields of the aggregated readings.
+    """
+    info = {}
+    for field, field_info in reading_info.items():
+        if (field_info.get('type', 'float') not in {'float', 'int'} or
+                not field_info.get('aggregate', True)):
+            info[field] = field_info
+            continue
+        info[field] = dict(field_info, type='float')
+        for stat in STATS_ORDER:
+            info[f'{field}_{stat}'] = dict(
+                label=f'{field_info.get("label", field)} ({stat})',
+                unit=field_info.get('unit', ''), type='float',
+            )
+    info['samples'] = dict(label='Samples', unit='', type='int')
+    return info
+
+
+def make_aggregator(settings, reading_info):
+    """Create a ReadingAggregator from a config.sensor_aggregation entry."""
+    settings = dict(settings)
+    window = settings.pop('window', None)
+    samples = settings.pop('samples', None)
+    stats = settings.pop('stats', DEFAULT_STATS)
+    settings.pop('sample_delay', None)  # used by BaseSensor.iter_readings
+    settings.pop('log_raw', None)  # used by BaseSensor.iter_readings
+    if settings:
+        raise ValueError(f'Unknown aggregation settings: {sorted(settings)}')
+    if window is None and samples is None:
+        raise ValueError('Either "window" or "samples" must be set.')
+    return ReadingAggregator(reading_info, window=window, samples=samples,
+                             stats=stats)
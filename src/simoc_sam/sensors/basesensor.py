@@ -2,12 +2,17 @@ import time
 import json
 import random
 import socket
+import threading
 
 from datetime import datetime
 from abc import ABC, abstractmethod
 
 import paho.mqtt.client as mqtt
 from .. import config
+from ..metrics import Metrics
+from ..diskqueue import DiskQueue
+from ..logindex import LogIndexWriter
+from .aggregation import make_aggregator, is_numeric
 
 
 def get_sensor_id(sensor_name, *, sep='.'):
@@ -19,6 +24,16 @@ def get_log_path(sensor_name):
     sensor_id = get_sensor_id(sensor_name, sep='_')
     return config.log_dir / f'{sensor_id}.jsonl'
 
+def get_buffer_dir(sensor_name):
+    """Return the dir used to buffer MQTT messages while offline."""
+    sensor_id = get_sensor_id(sensor_name, sep='_')
+    return config.log_dir / 'mqtt-buffer' / sensor_id
+
+def get_metrics_path(sensor_name):
+    """Return the path of the .prom file with the MQTT metrics."""
+    sensor_id = get_sensor_id(sensor_name, sep='_')
+    return config.log_dir / 'metrics' / f'{sensor_id}.prom'
+
 
 class BaseSensor(ABC):
     """The base class Sensors should inherit from."""
@@ -43,14 +58,27 @@ class BaseSensor(ABC):
         if cls.__doc__ is None:
             cls.__doc__ = f'Represent a {cls.type} sensor.'
 
-    def __init__(self, *, description=None, verbose=False):
-        """Initialize the sensor."""
+    def __init__(self, *, description=None, verbose=False, aggregation=None):
+        """Initialize the sensor.
+
+        If aggregation is a dict of settings (by default taken from
+        config.sensor_aggregation), iter_readings yields windowed
+        statistics of the readings instead of the readings themselves.
+        """
         self.id = get_sensor_id(self.name)
         self.description = description
         self.verbose = verbose
         # the total number of values read through iter_readings
         self.reading_num = 0
+        if aggregation is None:
+            aggregation = config.sensor_aggregation.get(self.name)
+        self.aggregation = aggregation or {}
+        self.aggregator = None
+        if self.aggregation:
+            self.aggregator = make_aggregator(self.aggregation,
+                                              self.reading_info)
         self.log_path = get_log_path(self.name)
+        self.log_index = None  # created when the first line is logged
         if config.enable_jsonl_logging:
             config.log_dir.mkdir(exist_ok=True)  # ensure the log dir exists
 
@@ -81,10 +109,17 @@ class BaseSensor(ABC):
         if self.verbose:
             print(*args, **kwargs)
 
-    def log(self, payload):
+    def log(self, payload, timestamp=None):
+        """Append payload to the log, indexing it if timestamp is given."""
         try:
             with open(self.log_path, 'a') as f:
+                offset = f.tell()
                 f.write(f'{payload}\n')
+            if timestamp and config.log_index_interval:
+                if self.log_index is None:
+                    self.log_index = LogIndexWriter(self.log_path,
+                                                    config.log_index_interval)
+                self.log_index.add(timestamp, offset)
         except Exception as err:
             self.print(f'Unable to write log file: {err}')
 
@@ -113,8 +148,17 @@ class BaseSensor(ABC):
         'timestamp' field with the value returned by self.get_timestamp().
         If add_n is true, add an auto-incrementing 'n' field.
 
+        If the sensor has an aggregator, the sensor is sampled every
+        aggregation['sample_delay'] seconds (defaults to delay), and an
+        aggregated reading is yielded at the end of each window.  If
+        aggregation['log_raw'] is true, the raw samples are logged
+        instead of the aggregated readings.
+
         """
         read_forever = not n
+        aggregator = self.aggregator
+        delay = self.aggregation.get('sample_delay', delay)
+        log_raw = self.aggregation.get('log_raw', False)
         while True:
             try:
                 data = self.read_sensor_data()
@@ -124,12 +168,21 @@ class BaseSensor(ABC):
             if not data:
                 time.sleep(delay)
                 continue  # keep trying until we get a reading
+            if aggregator:
+                if log_raw and config.enable_jsonl_logging:
+                    sample = dict(data, timestamp=self.get_timestamp())
+                    self.log(json.dumps(sample), sample['timestamp'])
+                aggregator.add(data)
+                if not aggregator.is_ready():
+                    time.sleep(delay)
+                    continue  # keep sampling until the window is complete
+                data = aggregator.pop()
             if add_timestamp:
                 data['timestamp'] = self.get_timestamp()
             if add_n:
                 data['n'] = self.reading_num
-            if config.enable_jsonl_logging:
-                self.log(json.dumps(data))
+            if config.enable_jsonl_logging and not (aggregator and log_raw):
+                self.log(json.dumps(data), data.get('timestamp'))
             yield data
             self.reading_num += 1
             if not read_forever:
@@ -139,13 +192,111 @@ class BaseSensor(ABC):
             time.sleep(delay)
 
 
+class DeadbandFilter:
+    """Decide which readings should be published.
+
+    A reading is published if any of the fields in deadbands changed by
+    more than its deadband since the last published reading, or if at
+    least max_silence seconds passed since then.  Fields without a
+    deadband don't affect the decision.  If deadbands is empty, every
+    reading is published.
+    """
+
+    def __init__(self, deadbands, *, max_silence=None):
+        self.deadbands = deadbands
+        self.max_silence = max_silence
+        self.last_values = None
+        self.last_time = None
+
+    def changed(self, reading):
+        """Return True if a field changed more than its deadband."""
+        for field, deadband in self.deadbands.items():
+            old, new = self.last_values.get(field), reading.get(field)
+            if is_numeric(old) and is_numeric(new):
+                if abs(new - old) > deadband:
+                    return True
+            elif old != new:
+                return True
+        return False
+
+    def should_publish(self, reading):
+        """Return True if reading should be published."""
+        now = time.monotonic()
+        if (self.last_values is None or not self.deadbands or
+                (self.max_silence is not None and
+                 now - self.last_time >= self.max_silence) or
+                self.changed(reading)):
+            self.last_values = {field: reading.get(field)
+                                for field in self.deadbands}
+            self.last_time = now
+            return True
+        return False
+
+
+class Backoff:
+    """Compute exponentially increasing delays with random jitter.
+
+    The n-th delay is a random value between d/2 and d, where d is
+    initial * factor**n capped to maximum.  The jitter prevents several
+    clients from reconnecting in lockstep after a broker restart.
+    """
+
+    def __init__(self, initial, maximum, *, factor=2):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.attempts = 0
+
+    def next_delay(self):
+        """Return the next delay (in seconds)."""
+        delay = min(self.maximum, self.initial * self.factor**self.attempts)
+        self.attempts += 1
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def reset(self):
+        self.attempts = 0
+
+
+# publish latency histogram buckets (in seconds)
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5]
+
 class MQTTWrapper:
     def __init__(self, sensor, *, read_delay=config.sensor_read_delay,
                  verbose=config.verbose_sensor, location=config.location,
-                 secure=config.mqtt_secure, certs_dir=config.mqtt_certs_dir):
+                 secure=config.mqtt_secure, certs_dir=config.mqtt_certs_dir,
+                 deadbands=None, max_silence=config.publish_max_silence,
+                 buffer=config.mqtt_buffer_enabled,
+                 drain_rate=config.mqtt_buffer_drain_rate,
+                 reconnect_delay=config.mqtt_reconnect_delay,
+                 max_reconnect_delay=config.mqtt_reconnect_max_delay,
+                 metrics_interval=config.mqtt_metrics_interval):
         self.sensor = sensor
         self.read_delay = read_delay  # how long to wait between readings
         self.verbose = verbose  # toggle verbose output
+        # only publish readings that changed significantly (if configured)
+        if deadbands is None:
+            deadbands = config.publish_deadbands.get(sensor.name, {})
+        self.filter = DeadbandFilter(deadbands, max_silence=max_silence)
+        # store readings on disk while disconnected and send them later
+        if buffer is True:
+            buffer = DiskQueue(get_buffer_dir(sensor.name),
+                               max_size=config.mqtt_buffer_max_size,
+                               segment_size=config.mqtt_buffer_segment_size)
+        elif buffer is False:
+            buffer = None
+        self.buffer = buffer
+        self.drain_rate = drain_rate  # max messages/second sent from buffer
+        self.drain_thread = None
+        self.network_thread = None
+        self.stop_event = threading.Event()
+        self.backoff = Backoff(reconnect_delay, max_reconnect_delay)
+        # publish times of the messages not yet handed over to the broker
+        self.in_flight = {}
+        self.early_acks = set()
+        self.in_flight_lock = threading.Lock()
+        self.metrics_interval = metrics_interval
+        self.metrics_path = get_metrics_path(sensor.name)
+        self.metrics = self.create_metrics()
         # aiomqtt still requires paho-mqtt 1.6
         # self.mqttc = mqttc = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
         self.mqttc = mqttc = mqtt.Client()
@@ -156,24 +307,81 @@ class MQTTWrapper:
                                keyfile=str(certs_dir / 'client.key'))
         mqttc.on_connect = self.on_connect
         mqttc.on_disconnect = self.on_disconnect
+        mqttc.on_publish = self.on_publish
         self.topic = get_sensor_id(sensor.name, sep='/')
 
+    def create_metrics(self):
+        """Create the connection health metrics."""
+        metrics = Metrics(labels={'sensor': self.sensor.name})
+        metrics.counter('mqtt_published_total',
+                        'Messages handed over to the MQTT client.')
+        metrics.counter('mqtt_publish_failures_total',
+                        'Messages that failed to be published.')
+        metrics.counter('mqtt_buffered_total',
+                        'Messages added to the offline buffer.')
+        metrics.counter('mqtt_connects_total',
+                        'Successful connections to the broker.')
+        metrics.counter('mqtt_disconnects_total',
+                        'Disconnections from the broker.')
+        metrics.counter('mqtt_reconnect_attempts_total',
+                        'Attempts to reconnect to the broker.')
+        metrics.gauge('mqtt_connected', 'Whether the client is connected.',
+                      lambda: int(self.mqttc.is_connected()))
+        metrics.gauge('mqtt_in_flight', 'Messages not yet sent to the broker.',
+                      lambda: len(self.in_flight))
+        buffer = self.buffer
+        metrics.gauge('mqtt_buffer_depth', 'Messages in the offline buffer.',
+                      lambda: len(buffer) if buffer is not None else 0)
+        metrics.gauge('mqtt_buffer_dropped', 'Messages dropped from the buffer.',
+                      lambda: buffer.dropped if buffer is not None else 0)
+        metrics.histogram('mqtt_publish_latency_seconds',
+                          'Time between publishing and sending a message.',
+                          LATENCY_BUCKETS)
+        return metrics
+
+    def write_metrics(self):
+        """Write the metrics to a .prom file in log_dir/metrics/."""
+        try:
+            self.metrics.write(self.metrics_path)
+        except OSError as err:
+            self.print(f'Unable to write metrics: {err}')
+
     def print(self, *args, **kwargs):
         """Receive and print if self.verbose is true."""
         if self.verbose:
             print(*args, **kwargs)
 
     def start(self, host, port):
-        self.mqttc.loop_start()
+        """Connect and start the network (and buffer drain) threads."""
+        self.stop_event.clear()
         self.connect(host, port)
+        self.network_thread = threading.Thread(target=self.network_loop,
+                                               daemon=True)
+        self.network_thread.start()
+        if self.buffer is not None:
+            self.drain_thread = threading.Thread(target=self.drain_buffer,
+                                                 daemon=True)
+            self.drain_thread.start()
 
     def stop(self):
-        self.mqttc.loop_stop()
+        """Stop the threads and disconnect."""
+        self.stop_event.set()
+        for thread in (self.drain_thread, self.network_thread):
+            if thread is not None:
+                thread.join()
+        self.drain_thread = self.network_thread = None
+        self.mqttc.disconnect()
+        if self.buffer is not None:
+            self.buffer.close()
+        if self.metrics_interval:
+            self.write_metrics()
 
     def on_connect(self, client, userdata, connect_flags,
                    reason_code, properties=None):
         if reason_code == 0:
             self.print("Connected to MQTT broker")
+            self.metrics['mqtt_connects_total'].inc()
+            self.backoff.reset()
         else:
             self.print(f"Connection failed with code {reason_code}")
 
@@ -183,6 +391,26 @@ class MQTTWrapper:
         # with the old API the reason_code is actually assigned to
         # disconnect_flags, but we are not using it so it's ok
         self.print("Disconnected from MQTT broker")
+        self.metrics['mqtt_disconnects_total'].inc()
+        # on_publish won't be called for the messages that were still
+        # pending, so forget them to avoid inflating mqtt_in_flight
+        with self.in_flight_lock:
+            lost = len(self.in_flight)
+            self.in_flight.clear()
+            self.early_acks.clear()
+        if lost:
+            self.print(f"{lost} messages were not handed over to the broker")
+
+    def on_publish(self, client, userdata, mid,
+                   reason_code=None, properties=None):
+        now = time.monotonic()
+        with self.in_flight_lock:
+            start_time = self.in_flight.pop(mid, None)
+            if start_time is None:
+                # the callback was called before publish() returned
+                self.early_acks.add(mid)
+                return
+        self.metrics['mqtt_publish_latency_seconds'].observe(now - start_time)
 
     def connect(self, host, port):
         """Called when the sensor connects to the server."""
@@ -196,6 +424,32 @@ class MQTTWrapper:
         except Exception as err:
             self.print(f'Connection failed with error: {err}')
 
+    def reconnect(self):
+        """Wait according to the backoff and try to reconnect."""
+        delay = self.backoff.next_delay()
+        self.print(f'Reconnecting in {delay:.1f} seconds...')
+        if self.stop_event.wait(delay):
+            return  # stopped while waiting
+        self.metrics['mqtt_reconnect_attempts_total'].inc()
+        try:
+            self.mqttc.reconnect()
+        except Exception as err:
+            self.print(f'Reconnection failed with error: {err}')
+
+    def network_loop(self):
+        """Handle the network traffic, reconnecting when needed."""
+        last_write = time.monotonic()
+        while not self.stop_event.is_set():
+            if self.mqttc.socket() is None:
+                self.reconnect()  # not connected
+            else:
+                # this returns an error code if the connection is lost
+                self.mqttc.loop(timeout=1.0)
+            now = time.monotonic()
+            if self.metrics_interval and now - last_write >= self.metrics_interval:
+                self.write_metrics()
+                last_write = now
+
     def send_data(self, n=0):
         """Called when the server requests data, runs in an endless loop."""
         self.print('Server requested data')
@@ -203,9 +457,64 @@ class MQTTWrapper:
         # and replace it with a non-blocking asyncio.sleep in the for loop
         readings = self.sensor.iter_readings(delay=self.read_delay, n=n)
         for reading in readings:
-            try:
-                jreading = json.dumps(reading)
-                self.mqttc.publish(self.topic, payload=jreading)
-                self.print(reading)
-            except Exception as err:
-                self.print(f'No longer connected to the server ({err})...')
+            if not self.filter.should_publish(reading):
+                self.print(f'Not publishing (below deadband): {reading}')
+                continue
+            self.publish(json.dumps(reading))
+
+    def try_publish(self, payload):
+        """Try to publish the payload and return True if successful."""
+        start_time = time.monotonic()
+        try:
+            info = self.mqttc.publish(self.topic, payload=payload)
+        except Exception as err:
+            self.print(f'No longer connected to the server ({err})...')
+            self.metrics['mqtt_publish_failures_total'].inc()
+            return False
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            self.print(f'Failed to publish: {mqtt.error_string(info.rc)}')
+            self.metrics['mqtt_publish_failures_total'].inc()
+            return False
+        self.metrics['mqtt_published_total'].inc()
+        with self.in_flight_lock:
+            if info.mid in self.early_acks:
+                self.early_acks.discard(info.mid)
+                latency = time.monotonic() - start_time
+                self.metrics['mqtt_publish_latency_seconds'].observe(latency)
+            else:
+                self.in_flight[info.mid] = start_time
+        return True
+
+    def publish(self, payload):
+        """Publish the payload, or add it to the buffer if offline."""
+        buffer = self.buffer
+        # if the buffer is not empty, add the payload at the end to
+        # preserve the order, it will be sent by the drain thread
+        if buffer is not None and (len(buffer) or
+                                   not self.mqttc.is_connected()):
+            self.add_to_buffer(payload)
+            return
+        if self.try_publish(payload):
+            self.print(payload)
+        elif buffer is not None:
+            self.add_to_buffer(payload)
+
+    def add_to_buffer(self, payload):
+        self.buffer.put(payload)
+        self.metrics['mqtt_buffered_total'].inc()
+        self.print(f'Buffered reading ({len(self.buffer)} in buffer)')
+
+    def drain_buffer(self):
+        """Publish the buffered readings at most drain_rate per second."""
+        buffer = self.buffer
+        interval = 1 / self.drain_rate
+        while not self.stop_event.is_set():
+            if not len(buffer) or not self.mqttc.is_connected():
+                self.stop_event.wait(1)
+                continue
+            payload = buffer.peek()
+            if payload is not None and self.try_publish(payload):
+                buffer.pop()
+                if not len(buffer):
+                    self.print('Buffer drained')
+            self.stop_event.wait(interval)
@@ -2,13 +2,12 @@
 from . import utils
 from .basesensor import BaseSensor
 
-board = utils.import_board()
-import adafruit_bme680
-
 
 class BME688(BaseSensor):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        board = utils.import_board()
+        import adafruit_bme680
         i2c = board.I2C()
         self.sensor = adafruit_bme680.Adafruit_BME680_I2C(i2c, debug=False)
 
@@ -2,13 +2,12 @@
 from . import utils
 from .basesensor import BaseSensor
 
-board = utils.import_board()
-import adafruit_bmp3xx
-
 
 class BMP388(BaseSensor):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        board = utils.import_board()
+        import adafruit_bmp3xx
         i2c = board.I2C()
         self.sensor = adafruit_bmp3xx.BMP3XX_I2C(i2c)
         # Set oversampling for better accuracy
@@ -1,15 +1,14 @@
 """Driver for the BNO085 9-DOF Orientation IMU sensor."""
 import time
+import threading
+
+from collections import deque
 
 from . import utils
 from .. import config
+from .aggregation import aggregate_readings
 from .basesensor import BaseSensor
 
-board = utils.import_board()
-busio = utils.import_busio()
-import adafruit_bno08x
-from adafruit_bno08x.i2c import BNO08X_I2C
-
 
 # Note: this sensor seems to have several issues and often receives
 # invalid packets and/or gets stuck.
@@ -25,6 +24,9 @@ from adafruit_bno08x.i2c import BNO08X_I2C
 
 ERR_VALUE = getattr(config, 'bno085_default_err_value', 0)
 
+# valid values for config.bno085_stream_output (see defaults.py)
+STREAM_OUTPUTS = {'latest', 'window'}
+
 # map available feature names to the corresponding BNO085 attributes
 FEATURE_TO_ATTR = {
     'RAW_ACCELEROMETER': 'raw_acceleration',
@@ -45,12 +47,67 @@ FEATURE_TO_ATTR = {
 }
 
 class BNO085(BaseSensor):
-    def __init__(self, **kwargs):
+    def __init__(self, *, streaming=config.bno085_streaming,
+                 report_interval=config.bno085_report_interval,
+                 buffer_size=config.bno085_buffer_size,
+                 stream_output=config.bno085_stream_output, **kwargs):
         super().__init__(**kwargs)
+        if stream_output not in STREAM_OUTPUTS:
+            raise ValueError(f'Unknown stream output: {stream_output!r} '
+                             f'(valid options: {STREAM_OUTPUTS})')
+        self.streaming = streaming
+        self.report_interval = report_interval  # in seconds
+        self.stream_output = stream_output
+        self.samples = deque(maxlen=buffer_size)  # ring buffer
+        self.samples_lock = threading.Lock()
+        self.bno_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.stream_thread = None
+        board = utils.import_board()
+        busio = utils.import_busio()
+        from adafruit_bno08x.i2c import BNO08X_I2C
         self.i2c = busio.I2C(board.SCL, board.SDA, frequency=800000)
         self.bno = BNO08X_I2C(self.i2c)
         self.enable_features()
 
+    def __enter__(self):
+        if self.streaming:
+            self.start_streaming()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop_streaming()
+        return False  # let exceptions propagate
+
+    def start_streaming(self):
+        """Start a thread that continuously reads the report stream."""
+        if self.stream_thread is not None:
+            return  # already streaming
+        print(f'Streaming reports every {self.report_interval}s '
+              f'(buffer size: {self.samples.maxlen})')
+        self.stop_event.clear()
+        self.stream_thread = threading.Thread(target=self.stream_reports,
+                                              daemon=True)
+        self.stream_thread.start()
+
+    def stop_streaming(self):
+        """Stop the streaming thread (if running)."""
+        if self.stream_thread is None:
+            return
+        self.stop_event.set()
+        self.stream_thread.join()
+        self.stream_thread = None
+
+    def stream_reports(self):
+        """Read the enabled reports and add them to the ring buffer."""
+        while not self.stop_event.is_set():
+            t_start = time.monotonic()
+            sample = self.read_reports()
+            with self.samples_lock:
+                self.samples.append(sample)
+            elapsed = time.monotonic() - t_start
+            self.stop_event.wait(max(0, self.report_interval - elapsed))
+
     def enable_features(self, features=None):
         """Enable all requested features."""
         if features is None:
@@ -69,11 +126,16 @@ class BNO085(BaseSensor):
 
     def enable_feature(self, feature_name):
         """Enable a single feature (retrying in case of failure)."""
+        import adafruit_bno08x
         feature = getattr(adafruit_bno08x, f'BNO_REPORT_{feature_name}')
         print(f'  Enabling {feature_name}...', end=' ')
+        # when streaming, ask the sensor to send reports at our read rate
+        kwargs = {}
+        if self.streaming:
+            kwargs['report_interval'] = int(self.report_interval * 1_000_000)
         for attempt in range(10):
             try:
-                self.bno.enable_feature(feature)
+                self.bno.enable_feature(feature, **kwargs)
                 print('done')
                 return 1
             except Exception as err:
@@ -106,11 +168,13 @@ class BNO085(BaseSensor):
                 print(f'Error while reading {attr_name!r}: {err.__class__.__name__}: {err}')
         return default
 
-    def read_sensor_data(self):
+    def read_reports(self):
+        """Read all the enabled features and return them as a dict."""
         enabled_features = self.enabled_features
         attrs = {}
-        for feature in enabled_features:
-            attrs[feature] = self.read_attribute(FEATURE_TO_ATTR[feature])
+        with self.bno_lock:
+            for feature in enabled_features:
+                attrs[feature] = self.read_attribute(FEATURE_TO_ATTR[feature])
         reading = {}
         # Raw Acceleration/Gyro/Magnetometer
         if 'RAW_ACCELEROMETER' in enabled_features:
@@ -165,6 +229,25 @@ class BNO085(BaseSensor):
         # Shake detector (bool)
         if 'SHAKE_DETECTOR' in enabled_features:
             reading.update(shake=attrs['SHAKE_DETECTOR'])
+        return reading
+
+    def read_buffered_reports(self):
+        """Return the latest sample or the aggregated buffered samples."""
+        with self.samples_lock:
+            if not self.samples:
+                return {}  # no samples received yet
+            if self.stream_output == 'latest':
+                return dict(self.samples[-1])
+            samples = list(self.samples)
+            self.samples.clear()  # start a new window
+        # use the reading_info so that e.g. the step count isn't averaged
+        return aggregate_readings(samples, self.reading_info)
+
+    def read_sensor_data(self):
+        if self.stream_thread is not None:
+            reading = self.read_buffered_reports()
+        else:
+            reading = self.read_reports()
         self.print_reading(reading)
         return reading
 
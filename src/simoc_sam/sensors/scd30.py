@@ -2,14 +2,13 @@
 from . import utils
 from .basesensor import BaseSensor
 
-board = utils.import_board()
-busio = utils.import_busio()
-import adafruit_scd30
-
 
 class SCD30(BaseSensor):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        board = utils.import_board()
+        busio = utils.import_busio()
+        import adafruit_scd30
         i2c = busio.I2C(board.SCL, board.SDA, frequency=50000)
         self.scd = adafruit_scd30.SCD30(i2c)
 
@@ -2,13 +2,12 @@
 from . import utils
 from .basesensor import BaseSensor
 
-board = utils.import_board()
-import adafruit_scd4x
-
 
 class SCD41(BaseSensor):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        board = utils.import_board()
+        import adafruit_scd4x
         i2c = board.I2C()
         self.scd = adafruit_scd4x.SCD4X(i2c)
         self.scd.start_periodic_measurement()
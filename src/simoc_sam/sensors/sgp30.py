@@ -4,10 +4,6 @@ import math
 from . import utils
 from .basesensor import BaseSensor
 
-board = utils.import_board()
-busio = utils.import_busio()
-import adafruit_sgp30
-
 
 # These equations are provided by the Sensirion datasheet for the SGP-30.
 # 20997 and 14296 are experimental values in a room assumed to have "typical"
@@ -26,6 +22,9 @@ def tick_conversion_H2(signal_output):
 class SGP30(BaseSensor):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        board = utils.import_board()
+        busio = utils.import_busio()
+        import adafruit_sgp30
         i2c = busio.I2C(board.SCL, board.SDA, frequency=100000)
         self.sensor = adafruit_sgp30.Adafruit_SGP30(i2c)
         self.sensor.iaq_init()
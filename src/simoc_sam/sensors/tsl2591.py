@@ -2,14 +2,12 @@
 from . import utils
 from .basesensor import BaseSensor
 
-board = utils.import_board()
-
-import adafruit_tsl2591
-
 
 class TSL2591(BaseSensor):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        board = utils.import_board()
+        import adafruit_tsl2591
         i2c = board.I2C()
         self.tsl = adafruit_tsl2591.TSL2591(i2c)
 
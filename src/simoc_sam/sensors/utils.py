@@ -1,7 +1,7 @@
 import os
+import json
 import pathlib
 import argparse
-import subprocess
 
 from typing import Dict, Any
 from datetime import datetime
@@ -9,10 +9,9 @@ from collections import defaultdict
 from dataclasses import dataclass, field
 
 from .basesensor import MQTTWrapper
+from .aggregation import is_aggregated, get_aggregated_info
 from .. import config
 
-import tomli
-
 
 def format_reading(reading, *, time_fmt='%H:%M:%S', sensor_info=None):
     """Format a sensor reading and return it as a string."""
@@ -22,11 +21,13 @@ def format_reading(reading, *, time_fmt='%H:%M:%S', sensor_info=None):
     timestamp = dt.strftime(time_fmt)
     sensor_id = sensor_info['sensor_id'] if sensor_info else '-'
     reading_info = sensor_info['reading_info'] if sensor_info else None
+    if reading_info and is_aggregated(reading):
+        reading_info = get_aggregated_info(reading_info)
     result = []
     for key, value in r.items():
         v = f'{value:.2f}' if isinstance(value, float) else str(value)
         label, unit = key, ''
-        if reading_info:
+        if reading_info and key in reading_info:
             label = reading_info[key]['label']
             unit = ' ' + reading_info[key]['unit']
         result.append(f'{label}: {v}{unit}')
@@ -65,6 +66,7 @@ class SensorData:
 SENSORS_TOML = pathlib.Path(__file__).with_name('sensors.toml')
 
 def load_sensor_data(file_path=SENSORS_TOML):
+    import tomli
     with open(file_path, 'rb') as f:
         sensors = tomli.load(f)
     sensor_data = {}
@@ -80,16 +82,86 @@ def load_sensor_data(file_path=SENSORS_TOML):
         )
     return sensor_data
 
-SENSOR_DATA = load_sensor_data()
-I2C_TO_SENSOR_NAMES = defaultdict(list)
-for name, info in SENSOR_DATA.items():
-    I2C_TO_SENSOR_NAMES[info.i2c_address].append(name)
+def load_registry():
+    """Load SENSOR_DATA and I2C_TO_SENSOR_NAMES from sensors.toml."""
+    global SENSOR_DATA, I2C_TO_SENSOR_NAMES
+    SENSOR_DATA = load_sensor_data()
+    I2C_TO_SENSOR_NAMES = defaultdict(list)
+    for name, info in SENSOR_DATA.items():
+        I2C_TO_SENSOR_NAMES[info.i2c_address].append(name)
+
+def __getattr__(name):
+    # SENSOR_DATA and I2C_TO_SENSOR_NAMES are loaded on first access
+    if name in {'SENSOR_DATA', 'I2C_TO_SENSOR_NAMES'}:
+        load_registry()
+        return globals()[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+# USB vendor/product IDs of the MCP2221(A)
+MCP2221_USB_ID = ('04d8', '00dd')
+SYSFS_USB_DEVICES = pathlib.Path('/sys/bus/usb/devices')
+BOOT_ID_PATH = pathlib.Path('/proc/sys/kernel/random/boot_id')
+
+_mcp2221_cache = {}
+
+
+def get_usb_ids():
+    """Return a set of (vendor id, product id) of the connected USB devices."""
+    usb_ids = set()
+    for vendor_path in SYSFS_USB_DEVICES.glob('*/idVendor'):
+        try:
+            vendor_id = vendor_path.read_text().strip().lower()
+            product_path = vendor_path.with_name('idProduct')
+            product_id = product_path.read_text().strip().lower()
+        except OSError:
+            continue  # the device was unplugged or isn't readable
+        usb_ids.add((vendor_id, product_id))
+    return usb_ids
+
+def get_boot_id():
+    """Return the ID of the current boot, or None if not available."""
+    try:
+        return BOOT_ID_PATH.read_text().strip() or None
+    except OSError:
+        return None
+
+def detect_mcp2221():
+    """Scan the USB devices in sysfs and return True if there's a MCP2221.
+
+    If config.mcp2221_disk_cache is True, the result is cached on disk
+    and reused until the next boot.
+    """
+    cache_path = config.data_dir / 'mcp2221.json'
+    boot_id = get_boot_id() if config.mcp2221_disk_cache else None
+    if boot_id:
+        try:
+            cache = json.loads(cache_path.read_text())
+            if cache['boot_id'] == boot_id:
+                return cache['has_mcp2221']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass  # missing or invalid cache
+    found = MCP2221_USB_ID in get_usb_ids()
+    if boot_id:
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            cache_path.write_text(json.dumps(dict(boot_id=boot_id,
+                                                  has_mcp2221=found)))
+        except OSError as err:
+            print(f'Failed to write the MCP2221 cache: {err}')
+    return found
 
 def has_mcp2221():
-    return b'MCP2221' in subprocess.check_output("lsusb")
+    """Return True if a MCP2221 is connected (detected once per process)."""
+    if 'found' not in _mcp2221_cache:
+        _mcp2221_cache['found'] = detect_mcp2221()
+    return _mcp2221_cache['found']
 
 def import_board():
-    """Import the board module while checking for MCP2221s."""
+    """Import the board module while checking for MCP2221s.
+
+    The drivers call this when the sensors/displays are initialized
+    rather than at import time, since it's slow (it imports Blinka).
+    """
     if has_mcp2221():
         os.environ['BLINKA_MCP2221'] = '1'
         os.environ['BLINKA_MCP2221_RESET_DELAY'] = '-1'
@@ -2,14 +2,12 @@
 from . import utils
 from .basesensor import BaseSensor
 
-board = utils.import_board()
-
-import adafruit_veml7700
-
 
 class VEML7700(BaseSensor):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        board = utils.import_board()
+        import adafruit_veml7700
         i2c = board.I2C()
         self.tsl = adafruit_veml7700.VEML7700(i2c)
 
@@ -1,12 +1,14 @@
 import json
 import copy
+import heapq
 import socket
+import sqlite3
 import asyncio
 import ipaddress
 import traceback
 
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
 from collections import defaultdict, deque
 
 import aiomqtt
@@ -17,8 +19,10 @@ from aiohttp import web
 
 from . import utils
 from . import config
+from .logindex import read_log_range
 from .sensors import utils as sensor_utils
 from .sensors.basesensor import get_log_path, get_sensor_id
+from .sqlitewriter import SQLiteStore, get_db_path
 
 
 # default host:port of the server
@@ -129,6 +133,25 @@ async def emit_to_subscribers(*args, **kwargs):
 
 # main loop that broadcasts bundles
 
+async def emit_bundle(n, timestamp):
+    """Emit a bundle with the latest reading of all sensors.
+
+    Return True if the bundle was emitted successfully.
+    """
+    sensors_readings = {sid: readings[-1]
+                        for sid, readings in SENSOR_READINGS.items()
+                        if readings}
+    bundle = dict(n=n, timestamp=timestamp, readings=sensors_readings)
+    # print(bundle)
+    try:
+        # the frontend expects a list of bundles
+        await emit_to_subscribers('step-batch', [bundle])
+    except Exception as e:
+        print('!!! Failed to emit step-batch:')
+        traceback.print_exc()
+        return False
+    return True
+
 async def emit_readings():
     """Emit a bundle with the latest reading of all sensors."""
     delay = config.sensor_read_delay  # emit at the same rate data is read
@@ -141,20 +164,10 @@ async def emit_readings():
         print('Last readings:',
               {k: [v[-1]['n'], v[-1]['timestamp']]
                for k, v in SENSOR_READINGS.items()})
-        sensors_readings = {sid: readings[-1]
-                            for sid, readings in SENSOR_READINGS.items()
-                            if readings}
-        bundle = dict(n=n, timestamp=timestamp, readings=sensors_readings)
-        # print(bundle)
-        try:
-            # the frontend expects a list of bundles
-            await emit_to_subscribers('step-batch', [bundle])
+        if await emit_bundle(n, timestamp):
             n += 1
             print(f'{len(SENSORS)} sensor(s); {len(SUBSCRIBERS)} '
                     f'subscriber(s); {n} readings broadcasted')
-        except Exception as e:
-            print('!!! Failed to emit step-batch:')
-            traceback.print_exc()
         await sio.sleep(delay)
 
 
@@ -196,9 +209,8 @@ async def mqtt_handler():
             await asyncio.sleep(interval)
 
 
-async def process_sensor_log(sensor):
-    """Process a single sensor's log file continuously."""
-    log_file = get_log_path(sensor)
+async def add_log_sensor_info(sensor, log_file):
+    """Add the info of a sensor read from a log file and return its id."""
     location, host, sensor_name = get_sensor_id(sensor).split('.')
     sensor_id = f'{host}.{sensor_name}'
     # ensure sensor info is available
@@ -209,6 +221,12 @@ async def process_sensor_log(sensor):
         info['sensor_desc'] = f'{sensor} sensor from log file {log_file.name}'
         SENSOR_INFO[sensor_id] = info
         await emit_to_subscribers('sensor-info', SENSOR_INFO)
+    return sensor_id
+
+async def process_sensor_log(sensor):
+    """Process a single sensor's log file continuously."""
+    log_file = get_log_path(sensor)
+    sensor_id = await add_log_sensor_info(sensor, log_file)
     print(f'Starting to process log file for {sensor}: {log_file}')
     # read and process each line from the log file continuously
     try:
@@ -234,22 +252,187 @@ async def log_handler():
     await asyncio.gather(*tasks, return_exceptions=True)
 
 
+def tag_readings(readings, sensor_id):
+    """Yield (datetime, sensor_id, reading) tuples.
+
+    The readings without a valid timestamp are skipped.
+    """
+    for reading in readings:
+        try:
+            reading_time = datetime.fromisoformat(reading['timestamp'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        yield reading_time, sensor_id, reading
+
+async def replay_handler():
+    """Replay the readings of the configured sensors from the log files.
+
+    The readings of all the logs are merged in timestamp order and added
+    to SENSOR_READINGS, optionally starting from config.replay_start and
+    ending at config.replay_end.  A bundle with the latest readings is
+    emitted every config.sensor_read_delay seconds of log time (skipping
+    the intervals without readings), using the log time as timestamp.
+    The replay runs at config.replay_speed times the real-time speed, or
+    as fast as possible if the speed is 0, in which case every bundle is
+    still emitted.
+    """
+    streams = []
+    for sensor in config.sensors:
+        log_file = get_log_path(sensor)
+        if not log_file.exists():
+            print(f'Log file for {sensor} not found: {log_file}')
+            continue
+        sensor_id = await add_log_sensor_info(sensor, log_file)
+        readings = read_log_range(log_file, config.replay_start,
+                                  config.replay_end)
+        streams.append(tag_readings(readings, sensor_id))
+    if not streams:
+        raise FileNotFoundError(f'No log files to replay in {config.log_dir}')
+    speed = config.replay_speed
+    delay = timedelta(seconds=config.sensor_read_delay)
+    print(f'Replaying {len(streams)} log file(s) at {speed or "max"}x speed')
+    loop = asyncio.get_running_loop()
+    first_time = start_time = emit_time = None
+    count = n = 0
+    pending = False  # True if there are readings not emitted yet
+
+    async def emit(emit_time):
+        if speed:
+            elapsed = (emit_time - first_time).total_seconds() / speed
+            wait = start_time + elapsed - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+        await emit_bundle(n, emit_time.strftime('%Y-%m-%d %H:%M:%S'))
+
+    for reading_time, sensor_id, reading in heapq.merge(*streams,
+                                                        key=lambda t: t[0]):
+        if first_time is None:
+            first_time, start_time = reading_time, loop.time()
+            emit_time = first_time + delay
+        if reading_time >= emit_time:
+            if pending:
+                await emit(emit_time)
+                n += 1
+                pending = False
+            # skip the intervals without readings
+            emit_time += delay * ((reading_time - emit_time) // delay + 1)
+        SENSOR_READINGS[sensor_id].append(reading)
+        pending = True
+        count += 1
+        if not speed and count % 100 == 0:
+            await asyncio.sleep(0)  # let the other tasks run
+    if pending:
+        await emit(emit_time)
+        n += 1
+    print(f'Replay finished: {count} readings replayed, {n} bundles emitted')
+
+
+# historical data API (using the data recorded by the sqlitewriter)
+
+def parse_sensor_id(sensor_id):
+    """Return a (<location>.<host>.<sensor>, <sensor>) tuple.
+
+    sensor_id can also be <host>.<sensor> (as in SENSOR_INFO), in which
+    case the current location is used.
+    """
+    parts = sensor_id.split('.')
+    if len(parts) == 2:
+        parts.insert(0, config.location)
+    if len(parts) != 3 or not all(parts):
+        raise ValueError(f'Invalid sensor id: {sensor_id!r}')
+    return '.'.join(parts), parts[-1]
+
+def query_readings(sensor, sensor_id, start, end, resolution, fields,
+                   max_readings):
+    """Return up to max_readings readings from the recorder database."""
+    store = SQLiteStore(get_db_path(), readonly=True)
+    try:
+        if resolution:
+            columns, rows = store.query_downsampled(
+                sensor, sensor_id, start, end, resolution, fields
+            )
+        else:
+            columns, rows = store.query(sensor, sensor_id, start, end, fields)
+        return [dict(zip(columns, row)) for row in rows.fetchmany(max_readings)]
+    finally:
+        store.close()
+
+async def get_readings(request):
+    """Return the readings of a sensor between two timestamps.
+
+    The query parameters are sensor (e.g. samrpi1.scd30), from/to
+    (timestamps, defaulting to the last hour), resolution (to average
+    the readings every N seconds), and fields (comma-separated).
+    """
+    query = request.query
+    try:
+        sensor_id, sensor = parse_sensor_id(query.get('sensor', ''))
+        resolution = int(query.get('resolution', 0))
+        if resolution < 0:
+            raise ValueError('The resolution must be a non-negative integer '
+                             '(0 to disable the downsampling)')
+    except ValueError as err:
+        raise web.HTTPBadRequest(text=str(err))
+    now = datetime.now()
+    hour_ago = now - timedelta(hours=1)
+    end = query.get('to', now.strftime('%Y-%m-%d %H:%M:%S'))
+    start = query.get('from', hour_ago.strftime('%Y-%m-%d %H:%M:%S'))
+    fields = query['fields'].split(',') if query.get('fields') else None
+    max_readings = config.api_max_readings
+    try:
+        readings = await asyncio.to_thread(
+            query_readings, sensor, sensor_id, start, end, resolution,
+            fields, max_readings + 1,
+        )
+    except ValueError as err:
+        raise web.HTTPBadRequest(text=str(err))
+    except KeyError:
+        raise web.HTTPNotFound(text=f'No data for sensor: {sensor_id}')
+    except sqlite3.OperationalError as err:
+        raise web.HTTPServiceUnavailable(text=f'No recorded data: {err}')
+    truncated = len(readings) > max_readings
+    return web.json_response(dict(
+        sensor_id=sensor_id, start=start, end=end, resolution=resolution,
+        truncated=truncated, readings=readings[:max_readings],
+    ))
+
+
+async def get_display_frame(request):
+    """Return the last frame rendered by the framebuffer display (PNG)."""
+    # imported here to avoid loading PIL & co. when the endpoint isn't used
+    from .displays.framebuffer import get_frame_path
+    frame_path = get_frame_path()
+    try:
+        body = await asyncio.to_thread(frame_path.read_bytes)
+    except FileNotFoundError:
+        raise web.HTTPNotFound(text='No frames rendered by the display')
+    return web.Response(body=body, content_type='image/png',
+                        headers={'Cache-Control': 'no-cache'})
+
+
 # app setup
 
 def create_app():
     app = web.Application()
+    app.router.add_get('/api/readings', get_readings)
+    app.router.add_get('/api/display.png', get_display_frame)
     return app
 
 async def init_app(app):
     # start handlers based on configuration
     sio.attach(app)
-    sio.start_background_task(emit_readings)
+    if config.data_source != 'replay':
+        # the replay handler emits the bundles following the log time
+        sio.start_background_task(emit_readings)
     if config.data_source == 'mqtt':
         print('Starting MQTT handler for sensor data')
         asyncio.ensure_future(mqtt_handler())
     elif config.data_source == 'logs':
         print('Starting log handler for sensor data')
         asyncio.ensure_future(log_handler())
+    elif config.data_source == 'replay':
+        print('Starting replay handler for sensor data')
+        asyncio.ensure_future(replay_handler())
     else:
         raise ValueError(f"Unsupported data source: {config.data_source}")
     return app
@@ -1,12 +1,15 @@
-import os
 import csv
-import shutil
+import sys
 import asyncio
 import datetime
 
+from pathlib import Path
+
 import socketio
 
 from .sensors import utils
+from .columnar import ColumnarWriter, check_data_format
+from .sensors.aggregation import get_aggregated_info, is_aggregated
 from . import config
 
 
@@ -46,12 +49,16 @@ async def sensor_info(data):
     print('Received sensor info:', data)
     SENSOR_INFO.clear()  # remove old info
     SENSOR_INFO.update(data)
+    update_columns()
 
 @sio.on('step-batch')
 async def step_batch(batch):
     """Handle batches of step data received by the server."""
     #print(f'Received a batch of {len(batch)} bundles from the server:')
-    to_csv(batch)
+    if config.data_format == 'csv':
+        to_csv(batch)
+    else:
+        to_columnar(batch)
     for bundle in batch:
         for sensor, reading in bundle['readings'].items():
             sensor_info = SENSOR_INFO[sensor]
@@ -59,8 +66,88 @@ async def step_batch(batch):
 
 # csv
 
-fpath = None
+class CSVLogWriter:
+    """Append rows to a CSV log without ever rewriting it.
+
+    The file is kept open and the header is tracked in memory.  When the
+    rows have new fields, the current file is closed and a new segment
+    (e.g. simoc_log_<timestamp>_2.csv) with the extended header is
+    started, so that the data already written are left untouched.
+    """
+
+    def __init__(self, base_path):
+        self.base_path = Path(base_path)
+        self.fieldnames = []
+        self.fieldset = set()
+        self.segment = 0
+        self.path = None
+        self.file = None
+        self.writer = None
+
+    def segment_path(self, segment):
+        if segment == 1:
+            return self.base_path
+        base = self.base_path
+        return base.with_name(f'{base.stem}_{segment}{base.suffix}')
+
+    def start_segment(self, fieldnames):
+        """Close the current segment and start a new one with fieldnames."""
+        self.close()
+        self.segment += 1
+        self.path = self.segment_path(self.segment)
+        self.fieldnames = list(fieldnames)
+        self.fieldset = set(fieldnames)
+        if self.segment > 1:
+            print(f'New CSV fields found, starting new segment: {self.path}')
+        self.file = open(self.path, 'w', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=self.fieldnames)
+        self.writer.writeheader()
+
+    def write_rows(self, rows, fieldnames):
+        """Write the rows, starting a new segment if fieldnames changed."""
+        if self.file is None or not self.fieldset.issuperset(fieldnames):
+            self.start_segment(fieldnames)
+        self.writer.writerows(rows)
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = self.writer = None
+
+
+csv_writer = None
 FIELDNAMES = ['timestamp']
+FIELDSET = set(FIELDNAMES)
+# map sensors to a {field: column} dict (None for fields not written),
+# the columns are only added to FIELDNAMES when a value is received
+COLUMNS = {}
+SKIPPED_FIELDS = ('timestamp', 'n')
+
+def add_column(column):
+    """Add column to FIELDNAMES (if missing) and return it."""
+    if column not in FIELDSET:
+        FIELDSET.add(column)
+        FIELDNAMES.append(column)
+    return column
+
+def get_columns(sid):
+    """Return a {field: column} dict for the given sensor."""
+    sensor_id = SENSOR_INFO[sid]['sensor_id']
+    if not sensor_id:
+        raise ValueError('sensor_id must be defined for all sensors')
+    columns = dict.fromkeys(SKIPPED_FIELDS)
+    for field in SENSOR_INFO[sid].get('reading_info') or {}:
+        columns[field] = f'{sensor_id}_{field}'
+    COLUMNS[sid] = columns
+    return columns
+
+def update_columns():
+    """Precompute the columns of all sensors in SENSOR_INFO."""
+    COLUMNS.clear()
+    for sid, info in SENSOR_INFO.items():
+        if info['sensor_id']:
+            get_columns(sid)
 
 def to_csv(batch):
     """Update fieldnames in logfile to latest sensor_info and write readings
@@ -73,53 +160,67 @@ def to_csv(batch):
     for bundle in batch:
         row = {'timestamp': bundle['timestamp']}
         for sid, reading in bundle['readings'].items():
-            if not SENSOR_INFO[sid]['sensor_id']:
-                raise ValueError('sensor_id must be defined for all sensors')
-            sensor_id = SENSOR_INFO[sid]['sensor_id']
+            columns = COLUMNS.get(sid) or get_columns(sid)
             for field, value in reading.items():
-                if field in {'timestamp', 'n'}:
-                    continue
-                field_id = f'{sensor_id}_{field}'
-                if field_id not in FIELDNAMES:
-                    FIELDNAMES.append(field_id)
-                row[field_id] = value
+                try:
+                    column = columns[field]
+                except KeyError:
+                    # field not listed in the reading_info
+                    sensor_id = SENSOR_INFO[sid]['sensor_id']
+                    column = columns[field] = f'{sensor_id}_{field}'
+                if column is not None:
+                    if column not in FIELDSET:
+                        add_column(column)
+                    row[column] = value
         rows.append(row)
 
-    global fpath
-    if fpath is None:
+    global csv_writer
+    if csv_writer is None:
         timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        fpath = f'simoc_log_{timestamp}.csv'
+        csv_writer = CSVLogWriter(f'simoc_log_{timestamp}.csv')
+    csv_writer.write_rows(rows, FIELDNAMES)
 
-    # Initialize log file w/ headers
-    if not os.path.exists(fpath):
-        with open(fpath, 'w') as f:
-            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
-            writer.writeheader()
+# columnar formats
 
-    # Update log file for new columns
-    else:
-        with open(fpath, 'r') as f:
-            reader = csv.DictReader(f)
-            fieldnames = reader.fieldnames
-            if not set(FIELDNAMES).issubset(fieldnames):
-                print('Updating CSV header...')
-                with open('temp_output.csv', 'w') as f:
-                    fieldnames += [f for f in FIELDNAMES if f not in fieldnames]
-                    writer = csv.DictWriter(f, fieldnames=fieldnames)
-                    writer.writeheader()
-                    for row in reader:
-                        writer.writerow(row)
-                shutil.move('temp_output.csv', fpath)
-
-    # Write new readings
-    with open(fpath, 'a') as f:
-        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
-        writer.writerows(rows)
+COLUMNAR_WRITERS = {}  # (sid, aggregated): ColumnarWriter
+
+def to_columnar(batch):
+    """Write the readings to one columnar file per sensor per hour.
+
+    The aggregated readings (that include <field>_<stat> and samples
+    fields) are written to separate files.
+    """
+    for bundle in batch:
+        for sid, reading in bundle['readings'].items():
+            key = (sid, is_aggregated(reading))
+            if key not in COLUMNAR_WRITERS:
+                info = SENSOR_INFO[sid]
+                name = f'simoc_log_{info["sensor_id"]}'
+                reading_info = info['reading_info']
+                if key[1]:
+                    name += '_aggregated'
+                    reading_info = get_aggregated_info(reading_info)
+                COLUMNAR_WRITERS[key] = ColumnarWriter(
+                    Path.cwd(), name, reading_info, format=config.data_format,
+                    flush_rows=config.columnar_flush_rows,
+                )
+            COLUMNAR_WRITERS[key].add(reading)
+
+def close_writers():
+    if csv_writer is not None:
+        csv_writer.close()
+    for writer in COLUMNAR_WRITERS.values():
+        writer.close()
+    COLUMNAR_WRITERS.clear()
 
 # main
 
 async def main(host=SIO_HOST, port=SIO_PORT):
     """Connect to the server and register as a client."""
+    try:
+        check_data_format(config.data_format)
+    except (ValueError, ImportError) as err:
+        sys.exit(f'Error: {err}')
     # connect to the server and wait
     for n in range(10):
         print(f'Connecting to <{host}:{port}>...')
@@ -132,6 +233,7 @@ async def main(host=SIO_HOST, port=SIO_PORT):
             await asyncio.sleep(5)
     else:
         print(f'Giving up after {n+1} attempts')
+    close_writers()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,324 @@
+"""Record the MQTT sensor data in a SQLite database and query them.
+
+Usage:
+  python -m simoc_sam.sqlitewriter  # record the data
+  python -m simoc_sam.sqlitewriter query scd30 --host samrpi1 \\
+      --from '2024-03-06 14:00' --to '2024-03-06 15:00' --fields co2
+
+The readings of each sensor type (e.g. scd30) are stored in a separate
+table with a column for each field listed in sensors.toml, and with an
+index on (sensor_id, timestamp), where sensor_id is <location>.<host>.<sensor>.
+"""
+
+import csv
+import sys
+import json
+import sqlite3
+import argparse
+
+import paho.mqtt.client as mqtt
+
+from simoc_sam import config
+from simoc_sam.columnar import get_field_types
+from simoc_sam.msgwriter import BaseMessageWriter
+from simoc_sam.sensors.utils import SENSOR_DATA
+from simoc_sam.sensors.aggregation import get_aggregated_info, is_aggregated
+
+
+SQL_TYPES = {'float': 'REAL', 'int': 'INTEGER', 'bool': 'INTEGER',
+             'str': 'TEXT', 'timestamp': 'TEXT'}
+
+
+def get_db_path():
+    return config.data_dir / 'readings.db'
+
+def quote(name):
+    """Quote a table/column name for SQL."""
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+class SQLiteStore:
+    """Store sensor readings in a SQLite database (in WAL mode).
+
+    add() only queues the readings in memory, and commit() writes all
+    the queued readings in a single transaction.  The <field>_<stat>
+    and samples columns of the aggregated readings are added to the
+    table of the sensor when its first aggregated reading is added.
+    If readonly is True, the existing database is opened in read-only
+    mode (e.g. to query it while the recorder is running).
+    """
+
+    def __init__(self, path, sensor_data=SENSOR_DATA, *, readonly=False):
+        self.path = path
+        self.columns = {}  # sensor: ['sensor_id', 'n', 'timestamp', ...]
+        self.numeric = {}  # sensor: set of numeric columns
+        self.inserts = {}  # sensor: INSERT statement
+        self.pending = {}  # sensor: list of rows to insert
+        self.sensor_data = sensor_data
+        self.aggregated = set()  # sensors with the aggregation columns
+        if readonly:
+            self.conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True,
+                                        check_same_thread=False)
+            for sensor in sensor_data:
+                self.load_table(sensor)
+            return
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        for sensor, data in sensor_data.items():
+            self.create_table(sensor, data.data)
+
+    def load_table(self, sensor):
+        """Load the columns of an existing table."""
+        table = quote(sensor)
+        table_info = list(self.conn.execute(f'PRAGMA table_info({table})'))
+        if table_info:
+            self.columns[sensor] = [row[1] for row in table_info]
+            self.numeric[sensor] = {row[1] for row in table_info
+                                    if row[2] in {'REAL', 'INTEGER'}}
+
+    def create_table(self, sensor, reading_info):
+        """Create the table of the sensor or add the new columns."""
+        table = quote(sensor)
+        types = get_field_types(reading_info)
+        columns = ['sensor_id', *types]
+        sql_columns = ['sensor_id TEXT NOT NULL'] + [
+            f'{quote(field)} {SQL_TYPES[field_type]}'
+            for field, field_type in types.items()
+        ]
+        with self.conn:
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS {table} '
+                              f'({", ".join(sql_columns)})')
+            # add the fields that were added to sensors.toml later
+            existing = {row[1] for row in
+                        self.conn.execute(f'PRAGMA table_info({table})')}
+            for column, sql_column in zip(columns, sql_columns):
+                if column not in existing:
+                    self.conn.execute(f'ALTER TABLE {table} '
+                                      f'ADD COLUMN {sql_column}')
+            index = quote(f'{sensor}_sensor_id_timestamp')
+            self.conn.execute(f'CREATE INDEX IF NOT EXISTS {index} '
+                              f'ON {table} (sensor_id, timestamp)')
+        self.load_table(sensor)
+        # use the order of the table, since add() follows it
+        columns = self.columns[sensor]
+        placeholders = ', '.join('?' * len(columns))
+        self.inserts[sensor] = (
+            f'INSERT INTO {table} ({", ".join(map(quote, columns))}) '
+            f'VALUES ({placeholders})'
+        )
+
+    def add(self, sensor, sensor_id, reading):
+        """Queue a reading, to be written on the next commit()."""
+        if sensor not in self.columns:
+            raise KeyError(f'Unknown sensor: {sensor!r}')
+        if is_aggregated(reading) and sensor not in self.aggregated:
+            self.commit()  # the pending rows use the current columns
+            reading_info = self.sensor_data[sensor].data
+            self.create_table(sensor, get_aggregated_info(reading_info))
+            self.aggregated.add(sensor)
+        reading = dict(reading, sensor_id=sensor_id)
+        row = [reading.get(column) for column in self.columns[sensor]]
+        self.pending.setdefault(sensor, []).append(row)
+
+    def commit(self):
+        """Write all the queued readings in a single transaction."""
+        if not self.pending:
+            return
+        with self.conn:
+            for sensor, rows in self.pending.items():
+                self.conn.executemany(self.inserts[sensor], rows)
+        self.pending.clear()
+
+    def query(self, sensor, sensor_id=None, start=None, end=None,
+              fields=None):
+        """Return a (columns, rows) tuple with the matching readings.
+
+        start/end are timestamps (e.g. '2024-03-06 14:00'), start is
+        inclusive and end is exclusive.  rows is an iterator.
+        """
+        columns = self.get_columns(sensor, fields)
+        where, params = self.get_conditions(sensor_id, start, end)
+        sql = (f'SELECT {", ".join(map(quote, columns))} '
+               f'FROM {quote(sensor)}{where} ORDER BY sensor_id, timestamp')
+        return columns, self.conn.execute(sql, params)
+
+    def query_downsampled(self, sensor, sensor_id=None, start=None, end=None,
+                          resolution=60, fields=None):
+        """Like query(), but aggregate readings every resolution seconds.
+
+        The timestamp is the start of the interval, numeric fields are
+        averaged, the other fields keep the highest value, and the 'n'
+        column is replaced by a 'samples' column with the number of
+        aggregated readings.
+        """
+        columns = self.get_columns(sensor, fields)[3:]
+        where, params = self.get_conditions(sensor_id, start, end)
+        bucket = ("CAST(strftime('%s', timestamp) AS INTEGER) / ? * ?")
+        aggregates = [
+            f'{"AVG" if column in self.numeric[sensor] else "MAX"}'
+            f'({quote(column)})' for column in columns
+        ]
+        sql = (f"SELECT datetime({bucket}, 'unixepoch') AS bucket, "
+               f"COUNT(*), {', '.join(['sensor_id', *aggregates])} "
+               f"FROM {quote(sensor)}{where} "
+               f"GROUP BY sensor_id, bucket ORDER BY sensor_id, bucket")
+        params = [resolution, resolution, *params]
+        return ['timestamp', 'samples', 'sensor_id', *columns], \
+            self.conn.execute(sql, params)
+
+    def get_columns(self, sensor, fields=None):
+        """Return the sensor_id/n/timestamp columns followed by fields."""
+        if sensor not in self.columns:
+            raise KeyError(f'Unknown sensor: {sensor!r}')
+        if not fields:
+            return self.columns[sensor]
+        unknown = set(fields) - set(self.columns[sensor])
+        if unknown:
+            raise ValueError(f'Unknown fields for {sensor}: {sorted(unknown)}')
+        return ['sensor_id', 'n', 'timestamp', *fields]
+
+    def get_conditions(self, sensor_id=None, start=None, end=None):
+        """Return a (WHERE clause, params) tuple."""
+        conditions, params = [], []
+        for condition, param in [('sensor_id = ?', sensor_id),
+                                 ('timestamp >= ?', start),
+                                 ('timestamp < ?', end)]:
+            if param is not None:
+                conditions.append(condition)
+                params.append(param)
+        if not conditions:
+            return '', params
+        return f' WHERE {" AND ".join(conditions)}', params
+
+    def close(self):
+        if self.pending:
+            self.commit()
+        self.conn.close()
+
+
+class SQLiteWriter(BaseMessageWriter):
+    """Write the MQTT messages to a SQLiteStore in a separate thread.
+
+    See BaseMessageWriter for the details.  The messages are written in
+    batches of up to batch_size messages, at least every commit_interval
+    seconds, and each batch is committed in a single transaction.  The
+    metrics are written to log_dir/metrics/sqlitewriter.prom.
+    """
+
+    def __init__(self, store, *, batch_size=500, commit_interval=1.0,
+                 max_queue_size=10_000,
+                 metrics_interval=config.mqtt_metrics_interval):
+        super().__init__('sqlitewriter', max_queue_size,
+                         batch_size=batch_size, batch_interval=commit_interval,
+                         metrics_interval=metrics_interval)
+        self.store = store
+
+    def write_batch(self, batch):
+        added = sum(self.add_message(topic, payload)
+                    for topic, payload in batch)
+        try:
+            self.store.commit()
+        except sqlite3.Error as err:
+            print(f'Unable to write {len(batch)} messages: {err}')
+            self.store.pending.clear()
+            return 0
+        return added
+
+    def add_message(self, topic, payload):
+        """Parse a message, add it to the store, and return True if added."""
+        try:
+            data = json.loads(payload.decode('utf-8'))
+            location, host, sensor = topic.split('/')
+            self.store.add(sensor, f'{location}.{host}.{sensor}', data)
+        except (json.JSONDecodeError, ValueError) as e:
+            print(f"Skipping invalid message <{topic}>: {payload} ({e})")
+        except KeyError as e:
+            print(f"Skipping unknown sensor <{topic}>: {e}")
+        else:
+            return True
+        return False
+
+
+def on_connect(client, userdata, flags, rc, properties=None):
+    print(f'Connected with result code {rc}')
+    client.subscribe(config.mqtt_topic_sub)
+
+def on_message(client, userdata, msg):
+    userdata.put(msg.topic, msg.payload)  # userdata is the SQLiteWriter
+
+def record(db_path):
+    """Subscribe to the MQTT topics and record the readings."""
+    config.data_dir.mkdir(exist_ok=True)
+    print(f'Recording MQTT data in {db_path}')
+    store = SQLiteStore(db_path)
+    writer = SQLiteWriter(store, batch_size=config.sqlite_batch_size,
+                          commit_interval=config.sqlite_commit_interval)
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2,
+                         userdata=writer)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(config.mqtt_host, config.mqtt_port)
+    writer.start()
+    try:
+        client.loop_forever()
+    except KeyboardInterrupt:
+        print("Interrupted by user, disconnecting...")
+        client.disconnect()
+    finally:
+        writer.stop()
+        store.close()
+        print(f'{writer.written} messages written, {writer.skipped} skipped, '
+              f'{writer.dropped} dropped')
+
+def query(args):
+    """Print the readings matching the args as CSV."""
+    try:
+        store = SQLiteStore(args.db, readonly=True)
+    except sqlite3.Error as err:
+        sys.exit(f'Error: unable to open {args.db}: {err}')
+    sensor_id = None
+    if args.host:
+        location = args.location or config.location
+        sensor_id = f'{location}.{args.host}.{args.sensor}'
+    fields = args.fields.split(',') if args.fields else None
+    try:
+        columns, rows = store.query(args.sensor, sensor_id, args.start,
+                                    args.end, fields)
+    except (KeyError, ValueError) as err:
+        sys.exit(f'Error: {err.args[0]}')
+    csv_writer = csv.writer(sys.stdout)
+    csv_writer.writerow(columns)
+    csv_writer.writerows(rows)
+    store.close()
+
+def parse_args(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db', default=get_db_path(),
+                        help='The path of the SQLite database.')
+    subparsers = parser.add_subparsers(dest='command')
+    query_parser = subparsers.add_parser(
+        'query', help='Print the readings of a sensor as CSV.'
+    )
+    query_parser.add_argument('sensor', help='The sensor type (e.g. scd30).')
+    query_parser.add_argument('--host', help='Only show the readings of '
+                              'the sensor on the given host.')
+    query_parser.add_argument('--location', help='The location of the host '
+                              '(defaults to the current location).')
+    query_parser.add_argument('--from', dest='start', metavar='TIMESTAMP',
+                              help='Start timestamp (inclusive).')
+    query_parser.add_argument('--to', dest='end', metavar='TIMESTAMP',
+                              help='End timestamp (exclusive).')
+    query_parser.add_argument('--fields', help='Comma-separated list of '
+                              'fields to show (all by default).')
+    return parser.parse_args(arguments)
+
+def main(arguments=None):
+    args = parse_args(arguments)
+    if args.command == 'query':
+        query(args)
+    else:
+        record(args.db)
+
+if __name__ == '__main__':
+    main()
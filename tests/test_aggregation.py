@@ -0,0 +1,141 @@
+import math
+
+import pytest
+
+from simoc_sam.sensors import aggregation
+
+
+def test_is_numeric():
+    assert aggregation.is_numeric(1)
+    assert aggregation.is_numeric(1.5)
+    assert not aggregation.is_numeric(True)
+    assert not aggregation.is_numeric('Stable')
+    assert not aggregation.is_numeric(None)
+
+def test_field_stats():
+    stats = aggregation.FieldStats()
+    for value in [1, 2, 3, 4]:
+        stats.add(value)
+    assert stats.count == 4
+    assert stats.mean == 2.5
+    assert stats.min == 1
+    assert stats.max == 4
+    assert stats.rms == pytest.approx(math.sqrt(30 / 4))
+    assert stats.get('mean') == 2.5
+    with pytest.raises(ValueError):
+        stats.get('median')
+
+def test_field_stats_empty():
+    assert aggregation.FieldStats().rms == 0.0
+
+def test_aggregate_readings():
+    readings = [
+        dict(accel_x=1.0, accel_y=-2.0, stability='Stable'),
+        dict(accel_x=3.0, accel_y=2.0, stability='In motion'),
+    ]
+    result = aggregation.aggregate_readings(readings)
+    assert result == dict(
+        accel_x=2.0, accel_x_min=1.0, accel_x_max=3.0,
+        accel_x_rms=pytest.approx(math.sqrt(5)), accel_x_stddev=1.0,
+        accel_y=0.0, accel_y_min=-2.0, accel_y_max=2.0, accel_y_rms=2.0,
+        accel_y_stddev=2.0,
+        stability='In motion',  # non-numeric values keep the latest value
+        samples=2,
+    )
+
+def test_aggregate_readings_custom_stats():
+    readings = iter([dict(co2=400), dict(co2=500)])  # works with iterators too
+    result = aggregation.aggregate_readings(readings, stats=['max'])
+    assert result == dict(co2=450, co2_max=500, samples=2)
+
+def test_aggregate_readings_fields():
+    # as in the BNO085 window mode, with the info from sensors.toml
+    fields = dict(accel_x={}, steps={'type': 'int', 'aggregate': False},
+                  shake={'type': 'bool'})
+    readings = [dict(accel_x=1.0, steps=10, shake=False),
+                dict(accel_x=3.0, steps=12, shake=True),
+                dict(accel_x=2.0, steps=13, shake=False)]
+    result = aggregation.aggregate_readings(readings, fields, stats=['max'])
+    # the step count keeps the latest value, and the shake is not lost
+    assert result == dict(accel_x=2.0, accel_x_max=3.0, steps=13, shake=True,
+                          samples=3)
+
+def test_aggregate_readings_empty():
+    assert aggregation.aggregate_readings([]) == {}
+
+def test_field_stats_stddev():
+    stats = aggregation.FieldStats()
+    for value in [2, 4, 4, 4, 5, 5, 7, 9]:
+        stats.add(value)
+    assert stats.mean == 5
+    assert stats.stddev == pytest.approx(2.0)
+
+def test_reading_aggregator_samples():
+    aggregator = aggregation.ReadingAggregator(samples=2, stats=['stddev'])
+    assert not aggregator.is_ready()
+    aggregator.add(dict(co2=400))
+    assert not aggregator.is_ready()
+    aggregator.add(dict(co2=600))
+    assert aggregator.is_ready()
+    assert aggregator.pop() == dict(co2=500, co2_stddev=100, samples=2)
+    # pop() starts a new window
+    assert not aggregator.is_ready()
+    assert aggregator.pop() == {}
+
+def test_reading_aggregator_window(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(aggregation.time, 'monotonic', lambda: now[0])
+    aggregator = aggregation.ReadingAggregator(window=60)
+    aggregator.add(dict(co2=400))
+    now[0] += 30
+    aggregator.add(dict(co2=500))
+    assert not aggregator.is_ready()
+    now[0] += 30
+    assert aggregator.is_ready()
+    assert aggregator.pop()['samples'] == 2
+
+def test_reading_aggregator_fields():
+    fields = dict(co2={}, steps={'aggregate': False})
+    aggregator = aggregation.ReadingAggregator(fields, samples=2, stats=[])
+    aggregator.add(dict(co2=400, steps=1, extra=5))
+    aggregator.add(dict(co2=600, steps=3, extra=7))
+    # only co2 is aggregated, the other fields keep the latest value
+    assert aggregator.pop() == dict(co2=500, steps=3, extra=7, samples=2)
+
+def test_reading_aggregator_invalid_stats():
+    with pytest.raises(ValueError, match='Unknown stats'):
+        aggregation.ReadingAggregator(stats=['median'])
+
+def test_make_aggregator():
+    info = dict(co2={}, temperature={})
+    aggregator = aggregation.make_aggregator(
+        dict(window=60, sample_delay=1, log_raw=True), info)
+    assert aggregator.window == 60
+    assert aggregator.samples is None
+    assert aggregator.fields == {'co2', 'temperature'}
+    # the same default stats as the BNO085 windows
+    assert aggregator.stats == aggregation.DEFAULT_STATS
+    with pytest.raises(ValueError, match='Unknown aggregation settings'):
+        aggregation.make_aggregator(dict(window=60, foo=1), info)
+    with pytest.raises(ValueError, match='"window" or "samples"'):
+        aggregation.make_aggregator(dict(sample_delay=1), info)
+
+def test_get_aggregated_info():
+    info = dict(co2=dict(label='CO2', unit='ppm', type='int'),
+                steps=dict(label='Steps', unit='', type='int',
+                           aggregate=False),
+                stability=dict(label='Stability', unit='', type='str'))
+    aggregated_info = aggregation.get_aggregated_info(info)
+    assert list(aggregated_info) == [
+        'co2', 'co2_mean', 'co2_min', 'co2_max', 'co2_rms', 'co2_stddev',
+        'steps', 'stability', 'samples',
+    ]
+    assert aggregated_info['co2']['type'] == 'float'  # the mean
+    assert aggregated_info['co2_max'] == dict(label='CO2 (max)', unit='ppm',
+                                              type='float')
+    assert aggregated_info['steps'] == info['steps']
+    assert aggregated_info['samples']['type'] == 'int'
+    reading = aggregation.aggregate_readings([dict(co2=400), dict(co2=600)])
+    assert aggregation.is_aggregated(reading)
+    assert set(reading) <= set(aggregated_info)
+    assert not aggregation.is_aggregated(dict(co2=400))
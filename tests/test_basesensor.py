@@ -1,3 +1,4 @@
+import json
 import time
 import pathlib
 import importlib
@@ -6,7 +7,10 @@ from unittest.mock import patch
 
 import pytest
 
+import paho.mqtt.client as mqtt
+
 from simoc_sam import config
+from simoc_sam.diskqueue import DiskQueue
 from simoc_sam.sensors import basesensor
 
 READING = dict(co2=100, rel_hum=50, temp=25)
@@ -27,8 +31,13 @@ def sensor():
     yield MySensor()
 
 @pytest.fixture
-def wrapper(sensor):
-    return basesensor.MQTTWrapper(sensor, read_delay=0)
+def buffer(tmp_path):
+    return DiskQueue(tmp_path / 'mqtt-buffer')
+
+@pytest.fixture
+def wrapper(sensor, buffer):
+    return basesensor.MQTTWrapper(sensor, read_delay=0, buffer=buffer,
+                                  metrics_interval=0)
 
 @pytest.fixture
 def mock_print(wrapper):
@@ -36,15 +45,22 @@ def mock_print(wrapper):
         yield mock_print
 
 @pytest.fixture(autouse=True)
-def reload_basesensor():
+def reload_basesensor(tmp_path, monkeypatch):
     # the logpath depends on config.location and hostname
     importlib.reload(config)
     importlib.reload(basesensor)
+    # write the logs, indexes, metrics, and MQTT buffers in a tmp dir
+    monkeypatch.setattr(config, 'log_dir', tmp_path / 'logs')
     yield
 
 @pytest.fixture(autouse=True)
 def mock_paho_client():
     with patch('paho.mqtt.client.Client', autospec=True) as mock_client:
+        mqttc = mock_client.return_value
+        mqttc.is_connected.return_value = True
+        mqttc.publish.return_value.rc = mqtt.MQTT_ERR_SUCCESS
+        # avoid busy-looping in the network thread
+        mqttc.loop.side_effect = lambda timeout: time.sleep(0.01)
         yield mock_client
 
 # Module-level function tests
@@ -158,6 +174,18 @@ def test_log(sensor, tmp_path):
         mock_print.assert_called_once()
         assert '/nonexistent/path/testlog.jsonl' in str(mock_print.call_args[0][0])
 
+def test_log_index(sensor, tmp_path, monkeypatch):
+    monkeypatch.setattr('simoc_sam.config.log_index_interval', 2)
+    sensor.log_path = tmp_path / 'testlog.jsonl'
+    for n in range(5):
+        sensor.log(json.dumps(dict(n=n)), f'2024-03-06 12:00:0{n}')
+    sensor.log(json.dumps(dict(n=5)))  # no timestamp, not indexed
+    index_path = tmp_path / 'testlog.jsonl.idx'
+    assert index_path.read_text().splitlines() == [
+        '2024-03-06 12:00:00\t0', '2024-03-06 12:00:02\t18',
+        '2024-03-06 12:00:04\t36',
+    ]
+
 def test_print_reading(sensor):
     # Test basic printing functionality
     with patch.object(sensor, 'print') as mock_print:
@@ -196,6 +224,47 @@ def test_iter_readings_logs(sensor, monkeypatch):
         readings = list(sensor.iter_readings(delay=0, n=3))
         mock_log.assert_not_called()
 
+def test_iter_readings_aggregation(monkeypatch):
+    monkeypatch.setattr(config, "enable_jsonl_logging", False)
+    sensor = MySensor(aggregation=dict(samples=3, stats=['min', 'max']))
+    readings = list(sensor.iter_readings(delay=0, n=2))
+    assert len(readings) == 2
+    assert sensor.reading_num == 2
+    for n, reading in enumerate(readings):
+        assert reading['n'] == n
+        assert reading['samples'] == 3
+        assert reading['co2'] == reading['co2_min'] == reading['co2_max'] == 100
+        assert 'timestamp' in reading
+
+def test_iter_readings_aggregation_from_config(monkeypatch):
+    monkeypatch.setattr(config, "sensor_aggregation",
+                        {'mysensor': dict(samples=2)})
+    sensor = MySensor()
+    assert sensor.aggregator.samples == 2
+    assert MySensor(aggregation={}).aggregator is None
+
+def test_iter_readings_aggregation_logs(monkeypatch):
+    monkeypatch.setattr(config, "enable_jsonl_logging", True)
+    # only the aggregated readings are logged by default
+    sensor = MySensor(aggregation=dict(samples=3))
+    with patch.object(sensor, 'log') as mock_log:
+        readings = list(sensor.iter_readings(delay=0, n=2))
+        assert mock_log.call_count == 2
+    # with log_raw the raw samples are logged instead
+    sensor = MySensor(aggregation=dict(samples=3, log_raw=True))
+    with patch.object(sensor, 'log') as mock_log:
+        readings = list(sensor.iter_readings(delay=0, n=2))
+        assert mock_log.call_count == 6
+        assert 'samples' not in mock_log.call_args[0][0]
+
+def test_iter_readings_aggregation_sample_delay():
+    sensor = MySensor(aggregation=dict(samples=3, sample_delay=0.05))
+    ts = time.time()
+    readings = list(sensor.iter_readings(delay=10, n=1))
+    te = time.time()
+    # 3 samples with a sample_delay of 0.05s, the delay arg is ignored
+    assert 0.1 <= te-ts < 1
+
 
 # MQTTWrapper tests
 
@@ -219,10 +288,75 @@ def test_mqttwrapper_connect_start_stop(wrapper):
     wrapper.connect('localhost', 1883)
     mqttc.connect.assert_called_with('localhost', 1883)
     wrapper.start('localhost', 1883)
-    mqttc.loop_start.assert_called_once()
+    assert wrapper.network_thread.is_alive()
     mqttc.connect.assert_called_with('localhost', 1883)
+    for x in range(50):
+        if mqttc.loop.called:
+            break
+        time.sleep(0.01)
+    mqttc.loop.assert_called_with(timeout=1.0)
     wrapper.stop()
-    mqttc.loop_stop.assert_called_once()
+    assert wrapper.network_thread is None
+    mqttc.disconnect.assert_called_once()
+
+def test_mqttwrapper_reconnect(wrapper, mock_print):
+    mqttc = wrapper.mqttc
+    mqttc.socket.return_value = None  # not connected
+    mqttc.reconnect.side_effect = ConnectionRefusedError('refused')
+    wrapper.backoff = basesensor.Backoff(0.01, 0.02)
+    wrapper.start('localhost', 1883)
+    for x in range(100):
+        if mqttc.reconnect.call_count >= 3:
+            break
+        time.sleep(0.01)
+    wrapper.stop()
+    assert mqttc.reconnect.call_count >= 3
+    mqttc.loop.assert_not_called()
+    attempts = wrapper.metrics['mqtt_reconnect_attempts_total'].value
+    assert attempts == mqttc.reconnect.call_count
+    mock_print.assert_any_call('Reconnection failed with error: refused')
+
+def test_backoff(monkeypatch):
+    monkeypatch.setattr(basesensor.random, 'uniform', lambda a, b: b)
+    backoff = basesensor.Backoff(1, 10)
+    assert [backoff.next_delay() for x in range(6)] == [1, 2, 4, 8, 10, 10]
+    backoff.reset()
+    assert backoff.next_delay() == 1
+    # the jitter is between half and the full delay
+    monkeypatch.setattr(basesensor.random, 'uniform', lambda a, b: a)
+    assert [backoff.next_delay() for x in range(3)] == [1, 2, 4]
+
+def test_mqttwrapper_metrics(wrapper, buffer, tmp_path, mock_print):
+    mqttc = wrapper.mqttc
+    mqttc.publish.return_value.mid = 1
+    wrapper.send_data(n=1)
+    metrics = wrapper.metrics
+    assert metrics['mqtt_published_total'].value == 1
+    assert metrics['mqtt_in_flight'].get() == 1
+    wrapper.on_publish(None, None, 1)
+    assert metrics['mqtt_in_flight'].get() == 0
+    assert metrics['mqtt_publish_latency_seconds'].count == 1
+    # on_publish can be called before publish() returns
+    wrapper.on_publish(None, None, 2)
+    mqttc.publish.return_value.mid = 2
+    wrapper.send_data(n=1)
+    assert metrics['mqtt_in_flight'].get() == 0
+    assert metrics['mqtt_publish_latency_seconds'].count == 2
+    # failed publications are buffered
+    mqttc.publish.return_value.rc = mqtt.MQTT_ERR_NO_CONN
+    wrapper.send_data(n=1)
+    assert metrics['mqtt_publish_failures_total'].value == 1
+    assert metrics['mqtt_buffered_total'].value == 1
+    assert metrics['mqtt_buffer_depth'].get() == 1
+    wrapper.on_connect(None, None, None, 0)
+    wrapper.on_disconnect(None, None, None)
+    assert metrics['mqtt_connects_total'].value == 1
+    assert metrics['mqtt_disconnects_total'].value == 1
+    # check that the metrics can be written to a file
+    wrapper.metrics_path = tmp_path / 'metrics' / 'test.prom'
+    wrapper.write_metrics()
+    text = wrapper.metrics_path.read_text()
+    assert 'mqtt_published_total{sensor="mysensor"} 2' in text
 
 def test_mqttwrapper_on_connect_and_disconnect(wrapper, mock_print):
     wrapper.verbose = True
@@ -233,6 +367,16 @@ def test_mqttwrapper_on_connect_and_disconnect(wrapper, mock_print):
     wrapper.on_disconnect(None, None, None)
     mock_print.assert_any_call("Disconnected from MQTT broker")
 
+def test_mqttwrapper_disconnect_clears_in_flight(wrapper, mock_print):
+    wrapper.mqttc.publish.return_value.mid = 1
+    assert wrapper.try_publish('{}')
+    assert wrapper.metrics.to_dict()['mqtt_in_flight'] == 1
+    wrapper.on_disconnect(None, None, None)
+    assert wrapper.metrics.to_dict()['mqtt_in_flight'] == 0
+    mock_print.assert_any_call("1 messages were not handed over to the broker")
+    wrapper.on_publish(None, None, 1)  # a late callback doesn't re-add it
+    assert not wrapper.in_flight
+
 def test_mqttwrapper_send_data(wrapper, mock_print):
     mqttc = wrapper.mqttc
     wrapper.send_data(n=2)
@@ -248,6 +392,56 @@ def test_mqttwrapper_send_data_publish_error(wrapper, mock_print):
     wrapper.send_data(n=1)
     mock_print.assert_any_call('No longer connected to the server (fail)...')
 
+def test_mqttwrapper_buffer_init(sensor, monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'log_dir', tmp_path)
+    wrapper = basesensor.MQTTWrapper(sensor, buffer=True)
+    assert isinstance(wrapper.buffer, DiskQueue)
+    assert wrapper.buffer.dir_path == basesensor.get_buffer_dir(sensor.name)
+    assert not wrapper.buffer.dir_path.exists()  # created lazily
+    wrapper = basesensor.MQTTWrapper(sensor, buffer=False)
+    assert wrapper.buffer is None
+
+def test_mqttwrapper_send_data_buffers_offline(wrapper, buffer, mock_print):
+    mqttc = wrapper.mqttc
+    mqttc.is_connected.return_value = False
+    wrapper.send_data(n=2)
+    mqttc.publish.assert_not_called()
+    assert len(buffer) == 2
+    # while the buffer is not empty new readings are added to the buffer
+    mqttc.is_connected.return_value = True
+    wrapper.send_data(n=1)
+    mqttc.publish.assert_not_called()
+    assert [json.loads(buffer.pop())['n'] for x in range(3)] == [0, 1, 2]
+
+def test_mqttwrapper_send_data_buffers_failures(wrapper, buffer, mock_print):
+    mqttc = wrapper.mqttc
+    mqttc.publish.return_value.rc = mqtt.MQTT_ERR_NO_CONN
+    wrapper.send_data(n=1)
+    assert mqttc.publish.call_count == 1
+    assert json.loads(buffer.pop())['n'] == 0
+    mqttc.publish.side_effect = RuntimeError("fail")
+    wrapper.send_data(n=1)
+    assert mqttc.publish.call_count == 2
+    assert json.loads(buffer.pop())['n'] == 1
+
+def test_mqttwrapper_drain_buffer(wrapper, buffer, mock_print):
+    mqttc = wrapper.mqttc
+    for n in range(3):
+        buffer.put(json.dumps(dict(n=n)))
+    wrapper.drain_rate = 1000
+    wrapper.start('localhost', 1883)
+    try:
+        for x in range(50):
+            if not len(buffer):
+                break
+            time.sleep(0.01)
+    finally:
+        wrapper.stop()
+    assert len(buffer) == 0
+    payloads = [call.kwargs['payload'] for call in mqttc.publish.call_args_list]
+    assert [json.loads(p)['n'] for p in payloads] == [0, 1, 2]
+    assert wrapper.drain_thread is None
+
 def test_mqttwrapper_insecure_init(sensor):
     """Test MQTTWrapper initialization with secure=False (default)."""
     wrapper = basesensor.MQTTWrapper(sensor, secure=False)
@@ -262,3 +456,59 @@ def test_mqttwrapper_secure_init(sensor):
         certfile='/test/certs/client.crt',
         keyfile='/test/certs/client.key'
     )
+
+
+# DeadbandFilter tests
+
+def test_deadband_filter_no_deadbands():
+    dbfilter = basesensor.DeadbandFilter({})
+    assert all(dbfilter.should_publish(READING) for x in range(3))
+
+def test_deadband_filter_changes():
+    dbfilter = basesensor.DeadbandFilter(dict(temp=0.05, co2=10))
+    assert dbfilter.should_publish(dict(temp=25.0, co2=400))  # first reading
+    assert not dbfilter.should_publish(dict(temp=25.04, co2=400))
+    assert not dbfilter.should_publish(dict(temp=24.96, co2=409))
+    # other fields are ignored
+    assert not dbfilter.should_publish(dict(temp=25.0, co2=400, hum=99))
+    assert dbfilter.should_publish(dict(temp=25.06, co2=400))
+    # changes are compared with the last published reading
+    assert not dbfilter.should_publish(dict(temp=25.1, co2=400))
+    assert dbfilter.should_publish(dict(temp=25.1, co2=411))
+    # missing and non-numeric values are published if they change
+    assert dbfilter.should_publish(dict(temp=25.1))
+    assert not dbfilter.should_publish(dict(temp=25.1))
+    assert dbfilter.should_publish(dict(temp=25.1, co2='error'))
+
+def test_deadband_filter_max_silence(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(basesensor.time, 'monotonic', lambda: now[0])
+    dbfilter = basesensor.DeadbandFilter(dict(temp=0.05), max_silence=60)
+    assert dbfilter.should_publish(dict(temp=25.0))
+    now[0] += 59
+    assert not dbfilter.should_publish(dict(temp=25.0))
+    now[0] += 1
+    assert dbfilter.should_publish(dict(temp=25.0))  # heartbeat
+    now[0] += 30
+    assert not dbfilter.should_publish(dict(temp=25.0))
+
+def test_mqttwrapper_deadbands(sensor, mock_print):
+    # MySensor always returns the same values, so only the first is sent
+    wrapper = basesensor.MQTTWrapper(sensor, read_delay=0,
+                                     deadbands=dict(co2=1))
+    wrapper.send_data(n=3)
+    assert wrapper.mqttc.publish.call_count == 1
+    # without deadbands all the readings are sent
+    wrapper.mqttc.publish.reset_mock()
+    wrapper = basesensor.MQTTWrapper(sensor, read_delay=0)
+    assert wrapper.filter.deadbands == {}
+    wrapper.send_data(n=3)
+    assert wrapper.mqttc.publish.call_count == 3
+
+def test_mqttwrapper_deadbands_from_config(sensor, monkeypatch):
+    monkeypatch.setattr(config, 'publish_deadbands',
+                        {'mysensor': dict(temp=0.1)})
+    wrapper = basesensor.MQTTWrapper(sensor, max_silence=30)
+    assert wrapper.filter.deadbands == dict(temp=0.1)
+    assert wrapper.filter.max_silence == 30
+
@@ -0,0 +1,88 @@
+from datetime import datetime
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+import pyarrow.parquet as pq
+
+from simoc_sam import columnar
+from simoc_sam.columnar import ColumnarWriter
+
+
+READING_INFO = {
+    'co2': {'label': 'CO2', 'unit': 'ppm'},
+    'steps': {'label': 'Steps', 'unit': '', 'type': 'int'},
+    'activity': {'label': 'Activity', 'unit': '', 'type': 'str'},
+}
+
+def make_reading(n, timestamp, **fields):
+    return dict(n=n, timestamp=timestamp, **fields)
+
+
+def test_get_field_types():
+    assert columnar.get_field_types(READING_INFO) == {
+        'n': 'int', 'timestamp': 'timestamp',
+        'co2': 'float', 'steps': 'int', 'activity': 'str',
+    }
+    with pytest.raises(ValueError, match='Unknown type'):
+        columnar.get_field_types({'x': {'type': 'complex'}})
+
+def test_invalid_format(tmp_path):
+    with pytest.raises(ValueError, match='Unknown format'):
+        ColumnarWriter(tmp_path, 'test', READING_INFO, format='xlsx')
+
+def test_check_data_format(monkeypatch):
+    for data_format in ['csv', 'parquet', 'feather']:
+        columnar.check_data_format(data_format)
+    with pytest.raises(ValueError, match='Unknown data_format'):
+        columnar.check_data_format('xlsx')
+    monkeypatch.setattr(columnar, 'import_pyarrow', lambda: False)
+    columnar.check_data_format('csv')  # doesn't need pyarrow
+    with pytest.raises(ImportError, match='pyarrow is required'):
+        columnar.check_data_format('parquet')
+
+def test_parquet(tmp_path):
+    writer = ColumnarWriter(tmp_path, 'test', READING_INFO, flush_rows=2)
+    writer.add(make_reading(0, '2024-03-06 12:00:00.5', co2=400,
+                            steps=3, activity='walking'))
+    assert not list(tmp_path.iterdir())  # still buffered
+    writer.add(make_reading(1, '2024-03-06 12:30:00', co2='invalid',
+                            unknown=1))
+    writer.add(make_reading(2, '2024-03-06 12:59:59', co2=420.5))
+    writer.close()
+    path = tmp_path / 'test_2024-03-06_12.parquet'
+    parquet_file = pq.ParquetFile(path)
+    assert parquet_file.num_row_groups == 2  # flushed every 2 rows
+    table = parquet_file.read()
+    assert table.schema.field('co2').type == pa.float64()
+    assert table.schema.field('steps').type == pa.int64()
+    assert table.schema.field('activity').type == pa.string()
+    assert table.column_names == ['n', 'timestamp', 'co2', 'steps', 'activity']
+    assert table.to_pydict() == {
+        'n': [0, 1, 2],
+        'timestamp': [datetime(2024, 3, 6, 12, 0, 0, 500000),
+                      datetime(2024, 3, 6, 12, 30), datetime(2024, 3, 6, 12, 59, 59)],
+        'co2': [400.0, None, 420.5],
+        'steps': [3, None, None],
+        'activity': ['walking', None, None],
+    }
+
+def test_new_file_every_hour(tmp_path):
+    writer = ColumnarWriter(tmp_path, 'test', READING_INFO, format='feather')
+    writer.add(make_reading(0, '2024-03-06 12:59:59', co2=400))
+    writer.add(make_reading(1, '2024-03-06 13:00:00', co2=410))
+    writer.close()
+    # restarting in the same hour doesn't overwrite the existing file
+    writer = ColumnarWriter(tmp_path, 'test', READING_INFO, format='feather')
+    writer.add(make_reading(2, '2024-03-06 13:10:00', co2=420))
+    writer.close()
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        'test_2024-03-06_12.arrow', 'test_2024-03-06_13.arrow',
+        'test_2024-03-06_13_2.arrow',
+    ]
+    for name, expected in [('test_2024-03-06_12.arrow', [400]),
+                           ('test_2024-03-06_13.arrow', [410]),
+                           ('test_2024-03-06_13_2.arrow', [420])]:
+        with pa.memory_map(str(tmp_path / name)) as source:
+            table = pa.ipc.open_file(source).read_all()
+        assert table['co2'].to_pylist() == expected
@@ -29,12 +29,26 @@ def user_config(tmp_path, monkeypatch):
 def test_default_vars():
     # all config vars should be included in one of the 3 lists below and tested
     unchanged_vars = [
-        'humans', 'volume', 'sensors', 'sensor_read_delay',
-        'display', 'display_refresh',
+        'humans', 'volume', 'sensors', 'sensor_read_delay', 'sensor_aggregation',
+        'mcp2221_disk_cache',
+        'display', 'display_refresh', 'display_min_interval',
+        'display_layout', 'display_page_interval', 'display_scroll_speed',
+        'framebuffer_display', 'framebuffer_png', 'framebuffer_scale',
         'mqtt_host', 'mqtt_port', 'mqtt_secure', 'mqtt_reconnect_delay',
+        'mqtt_reconnect_max_delay', 'mqtt_metrics_interval',
+        'publish_deadbands', 'publish_max_silence',
+        'mqtt_buffer_enabled', 'mqtt_buffer_max_size',
+        'mqtt_buffer_segment_size', 'mqtt_buffer_drain_rate',
         'sio_host', 'sio_port', 'data_source', 'mqtt_topic_sub',
+        'api_max_readings', 'replay_speed', 'replay_start', 'replay_end',
         'verbose_sensor', 'verbose_mqtt', 'enable_jsonl_logging',
+        'log_index_interval',
+        'data_format', 'columnar_flush_rows',
+        'csvwriter_max_open_files', 'csvwriter_flush_interval',
+        'csvwriter_queue_size', 'sqlite_batch_size', 'sqlite_commit_interval',
         'bno085_default_err_value', 'bno085_enabled_features',
+        'bno085_streaming', 'bno085_report_interval', 'bno085_buffer_size',
+        'bno085_stream_output',
     ]
     changed_vars = ['location', 'display_format']
     path_vars = config._path_vars
@@ -114,3 +128,19 @@ def test_config_warning_logs_without_jsonl(user_config, capsys):
     importlib.reload(config)
     captured = capsys.readouterr()
     assert 'Warning: JSONL logging is disabled' in captured.out
+
+def test_config_replay_data_source(user_config, capsys):
+    """Test that 'replay' is accepted as data_source."""
+    user_config.write_text('data_source = "replay"\n')
+    importlib.reload(config)
+    captured = capsys.readouterr()
+    assert 'invalid data_source' not in captured.out
+    assert config.data_source == 'replay'
+
+def test_config_warning_replay_without_jsonl(user_config, capsys):
+    """Test that config warns if data_source is 'replay' but logging is disabled."""
+    user_config.write_text('enable_jsonl_logging = False\n'
+                           'data_source = "replay"\n')
+    importlib.reload(config)
+    captured = capsys.readouterr()
+    assert "JSONL logging is disabled but data_source is 'replay'" in captured.out
@@ -1,3 +1,4 @@
+import csv
 import json
 
 from pathlib import Path
@@ -6,8 +7,25 @@ from unittest import mock
 import pytest
 
 from simoc_sam import csvwriter
+from simoc_sam.sensors import aggregation
 
 
+@pytest.fixture(autouse=True)
+def csv_files(monkeypatch):
+    """Use a new cache of open CSV files for each test."""
+    csv_files = csvwriter.CSVFileCache(max_open=2, flush_interval=60)
+    monkeypatch.setattr(csvwriter, 'CSV_FILES', csv_files)
+    yield csv_files
+    csv_files.close()
+
+@pytest.fixture(autouse=True)
+def writer(monkeypatch):
+    """Use a new message writer (that doesn't write metrics) for each test."""
+    writer = csvwriter.MessageWriter(2, metrics_interval=0)
+    monkeypatch.setattr(csvwriter, 'WRITER', writer)
+    yield writer
+    writer.stop()
+
 @pytest.fixture
 def mock_mqtt_client(monkeypatch):
     client = mock.MagicMock()
@@ -49,10 +67,10 @@ def test_subscribe_on_connect(mock_mqtt_client, mock_config):
     csvwriter.on_connect(mock_mqtt_client, None, None, 0)
     mock_mqtt_client.subscribe.assert_called_once_with('sam/#')
 
-def test_on_message(mock_open, mock_msg, mock_data_dir):
+def test_write_message(mock_open, mock_msg, mock_data_dir):
     # mock tell to return 0 (empty file)
     mock_open.return_value.tell.return_value = 0
-    csvwriter.on_message(client=None, userdata=None, msg=mock_msg)
+    csvwriter.write_message(mock_msg.topic, mock_msg.payload)
     csv_path = mock_data_dir / 'sam_test_scd30.csv'
     mock_open.assert_called_with(csv_path, 'a', newline='')
     handle = mock_open()
@@ -62,12 +80,93 @@ def test_on_message(mock_open, mock_msg, mock_data_dir):
         mock.call('0,2024-03-06 12:00:00,123,,\r\n'),  # and the readings
     ]
     handle.write.assert_has_calls(calls)
-    # now mock tell to return > 0 (file has content)
-    mock_open.return_value.tell.return_value = 100
-    csvwriter.on_message(client=None, userdata=None, msg=mock_msg)
+    # the file is kept open and only the readings are added
+    csvwriter.write_message(mock_msg.topic, mock_msg.payload)
     calls.append(mock.call('0,2024-03-06 12:00:00,123,,\r\n'))  # readings only
     assert handle.write.call_count == 3
     handle.write.assert_has_calls(calls)
+    assert mock_open.call_count == 2  # including the handle = mock_open() call
+
+def test_on_message(writer, mock_msg, tmp_path, monkeypatch):
+    monkeypatch.setattr('simoc_sam.config.data_dir', tmp_path)
+    # the messages are queued, and dropped if the queue is full
+    for n in range(3):
+        csvwriter.on_message(client=None, userdata=None, msg=mock_msg)
+    metrics = writer.metrics.to_dict()
+    assert metrics['csvwriter_queue_depth'] == 2
+    assert metrics['csvwriter_dropped_total'] == 1
+    assert not (tmp_path / 'sam_test_scd30.csv').exists()
+    # the writer thread writes the queued messages
+    writer.start()
+    writer.stop()
+    metrics = writer.metrics.to_dict()
+    assert metrics['csvwriter_queue_depth'] == 0
+    assert metrics['csvwriter_messages_total'] == 2
+    csvwriter.CSV_FILES.close()
+    lines = (tmp_path / 'sam_test_scd30.csv').read_text().splitlines()
+    assert lines == ['n,timestamp,co2,temperature,humidity',
+                     '0,2024-03-06 12:00:00,123,,',
+                     '0,2024-03-06 12:00:00,123,,']
+
+def test_write_aggregated_message(tmp_path, monkeypatch):
+    monkeypatch.setattr('simoc_sam.config.data_dir', tmp_path)
+    reading = aggregation.aggregate_readings(
+        [dict(co2=400, humidity=50), dict(co2=600, humidity=50)],
+        stats=['min', 'max'],
+    )
+    payload = json.dumps(dict(n=0, timestamp='2024-03-06 12:00:00', **reading))
+    csvwriter.write_message('sam/test/scd30', payload.encode('utf-8'))
+    csvwriter.CSV_FILES.close()
+    # the aggregated readings have their own file, with the stats columns
+    assert not (tmp_path / 'sam_test_scd30.csv').exists()
+    path = tmp_path / 'sam_test_scd30_aggregated.csv'
+    with open(path, newline='') as csv_file:
+        [row] = csv.DictReader(csv_file)
+    assert row['co2'] == '500.0'
+    assert (row['co2_min'], row['co2_max'], row['co2_rms']) == ('400', '600', '')
+    assert row['humidity_max'] == '50'
+    assert row['temperature'] == row['temperature_min'] == ''
+    assert row['samples'] == '2'
+
+def test_writer_metrics(writer, tmp_path, monkeypatch):
+    writer.metrics_path = tmp_path / 'metrics' / 'csvwriter.prom'
+    writer.metrics_interval = 60
+    writer.put('invalid/topic', b'{}')
+    writer.start()
+    writer.stop()  # writes the metrics
+    text = writer.metrics_path.read_text()
+    # the invalid message is counted as skipped, not as written
+    assert 'csvwriter_messages_total 0' in text
+    assert 'csvwriter_skipped_total 1' in text
+    assert 'csvwriter_dropped_total 0' in text
+
+def test_csv_file_cache(csv_files, tmp_path):
+    header = ['n', 'co2']
+    paths = [tmp_path / f'{name}.csv' for name in 'abc']
+    csv_files.get_writer(paths[0], header).writerow([0, 400])
+    csv_files.get_writer(paths[1], header).writerow([0, 500])
+    csv_files.get_writer(paths[0], header).writerow([1, 410])
+    assert list(csv_files.files) == [paths[1], paths[0]]  # a.csv was used last
+    # opening a third file closes the least recently used one (b.csv)
+    csv_files.get_writer(paths[2], header).writerow([0, 600])
+    assert list(csv_files.files) == [paths[0], paths[2]]
+    assert paths[1].read_text().splitlines() == ['n,co2', '0,500']
+    # the header is not added again when the file is reopened
+    csv_files.get_writer(paths[1], header).writerow([1, 510])
+    csv_files.flush()
+    assert paths[1].read_text().splitlines() == ['n,co2', '0,500', '1,510']
+    csv_files.close()
+    assert not csv_files.files
+    assert paths[0].read_text().splitlines() == ['n,co2', '0,400', '1,410']
+
+def test_csv_file_cache_periodic_flush(csv_files, tmp_path):
+    path = tmp_path / 'a.csv'
+    csv_files.get_writer(path, ['n']).writerow([0])
+    csv_files.maybe_flush()
+    assert path.read_text() == ''  # still buffered
+    csv_files.flush_interval = 0
+    csv_files.maybe_flush()
+    assert path.read_text().splitlines() == ['n', '0']
 
 @pytest.mark.parametrize(
     "payload, topic",
@@ -78,7 +177,7 @@ def test_on_message(mock_open, mock_msg, mock_data_dir):
 )
 def test_invalid_message(mock_open, payload, topic):
     msg = mock.Mock(payload=payload, topic=topic)
-    csvwriter.on_message(client=None, userdata=None, msg=msg)
+    assert csvwriter.write_message(msg.topic, msg.payload) is False
     mock_open.assert_not_called()
 
 
@@ -107,3 +206,24 @@ def test_main_data_dir_creation(mock_mqtt_client, mock_config, mock_data_dir):
     mock_data_dir.exists.return_value = False
     csvwriter.main()
     mock_data_dir.mkdir.assert_called_once()
+
+def test_main_invalid_data_format(mock_mqtt_client, mock_config,
+                                  mock_data_dir, monkeypatch):
+    monkeypatch.setattr('simoc_sam.config.data_format', 'xlsx')
+    with pytest.raises(SystemExit, match='Unknown data_format'):
+        csvwriter.main()
+    mock_mqtt_client.connect.assert_not_called()
+
+def test_write_message_parquet(mock_msg, tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    import pyarrow.parquet as pq
+    monkeypatch.setattr('simoc_sam.config.data_dir', tmp_path)
+    monkeypatch.setattr('simoc_sam.config.data_format', 'parquet')
+    csvwriter.write_message(mock_msg.topic, mock_msg.payload)
+    csvwriter.write_message(mock_msg.topic, mock_msg.payload)
+    csvwriter.close_columnar_writers()
+    table = pq.read_table(tmp_path / 'sam_test_scd30_2024-03-06_12.parquet')
+    assert table.column_names == ['n', 'timestamp', 'co2',
+                                  'temperature', 'humidity']
+    assert table['co2'].to_pylist() == [123.0, 123.0]
+    assert table['temperature'].to_pylist() == [None, None]
@@ -0,0 +1,91 @@
+import pytest
+
+from simoc_sam.diskqueue import DiskQueue
+
+
+@pytest.fixture
+def queue_dir(tmp_path):
+    return tmp_path / 'queue'
+
+@pytest.fixture
+def queue(queue_dir):
+    queue = DiskQueue(queue_dir, max_size=1000, segment_size=100)
+    yield queue
+    queue.close()
+
+
+def test_empty_queue(queue, queue_dir):
+    assert len(queue) == 0
+    assert queue.peek() is None
+    assert queue.pop() is None
+    assert not queue_dir.exists()  # the dir is created lazily
+
+def test_put_pop(queue):
+    for n in range(5):
+        queue.put(f'item{n}')
+    assert len(queue) == 5
+    assert queue.peek() == 'item0'
+    assert queue.peek() == 'item0'  # peek doesn't remove items
+    assert [queue.pop() for n in range(5)] == [f'item{n}' for n in range(5)]
+    assert len(queue) == 0
+    assert queue.pop() is None
+
+def test_segments(queue, queue_dir):
+    item = 'x' * 39  # 40 bytes with the newline
+    for n in range(7):
+        queue.put(item)
+    # 3 items per segment, since new segments start after >= 100 bytes
+    assert len(list(queue_dir.glob('*.seg'))) == 3
+    assert queue.size == 280
+    for n in range(4):
+        assert queue.pop() == item
+    # the first segment is deleted once it's fully read
+    assert len(list(queue_dir.glob('*.seg'))) == 2
+    for n in range(3):
+        assert queue.pop() == item
+    # all segments are removed when the queue is empty
+    assert list(queue_dir.glob('*.seg')) == []
+    queue.put('new')
+    assert queue.pop() == 'new'
+
+def test_max_size(queue):
+    for n in range(30):
+        queue.put(f'{n:039}')  # 40 bytes with the newline
+    # the oldest segments (3 items each) are dropped
+    assert queue.size <= 1000
+    assert queue.dropped == 6
+    assert len(queue) == 24
+    assert int(queue.pop()) == 6
+
+def test_persistence(queue_dir):
+    queue = DiskQueue(queue_dir, max_size=1000, segment_size=100)
+    for n in range(10):
+        queue.put(f'{n:019}')
+    assert int(queue.pop()) == 0
+    assert int(queue.pop()) == 1
+    queue.close()
+    # a new queue continues from where the old one stopped
+    queue = DiskQueue(queue_dir, max_size=1000, segment_size=100)
+    assert len(queue) == 8
+    queue.put('last')
+    assert [queue.pop() for n in range(9)] == [f'{n:019}' for n in range(2, 10)] + ['last']
+    queue.close()
+
+def test_incomplete_item(queue_dir):
+    queue = DiskQueue(queue_dir)
+    queue.put('complete')
+    queue.close()
+    # simulate a crash while writing an item
+    with open(queue.segment_path(0), 'a') as f:
+        f.write('{"incompl')
+    queue = DiskQueue(queue_dir)
+    assert len(queue) == 1
+    queue.put('new')
+    assert queue.pop() == 'complete'
+    assert queue.pop() == 'new'
+    assert queue.pop() is None
+    queue.close()
+
+def test_invalid_sizes(queue_dir):
+    with pytest.raises(ValueError):
+        DiskQueue(queue_dir, max_size=10, segment_size=100)
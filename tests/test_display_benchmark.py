@@ -0,0 +1,50 @@
+import sys
+
+from unittest.mock import patch
+
+import pytest
+
+from simoc_sam.displays import benchmark
+
+
+@pytest.fixture(autouse=True)
+def restore_modules():
+    """Check that the fake modules are removed after each test."""
+    modules = set(sys.modules)
+    yield
+    assert 'adafruit_ssd1306' not in set(sys.modules) - modules
+
+
+def test_fake_ssd1306_image():
+    """Test that the fake OLED packs the pixels in vertical bytes."""
+    from PIL import Image
+    oled = benchmark.FakeSSD1306(4, 16)
+    image = Image.new("1", (4, 16), 0)
+    image.putpixel((0, 0), 1)
+    image.putpixel((1, 9), 1)
+    oled.image(image)
+    assert oled.buffer == bytes([0x40, 1, 0, 0, 0, 0, 2, 0, 0])
+
+@pytest.mark.parametrize("display", benchmark.DISPLAYS)
+def test_run_benchmark(display):
+    """Test that the pipeline only sends the frames that changed."""
+    with patch('simoc_sam.utils.uptime', return_value='00:00:01'):
+        result = benchmark.run_benchmark(display, 8, 0, 5)
+    assert set(result['times']) == set(benchmark.STAGES)
+    assert result['frames'] == 5
+    assert result['drawn'] == 1  # nothing changed after the first frame
+    sent = result['transferred']
+    assert sent > 0
+    result = benchmark.run_benchmark(display, 8, 1, 5)
+    assert result['drawn'] == 5
+    assert result['transferred'] > sent
+    assert result['fps'] > 0
+
+def test_main(capsys):
+    benchmark.main(['--display', 'ssd1306', '--rows', '5',
+                    '--change-rate', '0.5', '--frames', '2'])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].split() == ['display', 'rows', 'change', 'format',
+                                'layout', 'transfer', 'frames/s', 'drawn',
+                                'sent/frame']
+    assert lines[2].split()[:3] == ['ssd1306', '5', '0.50']
@@ -6,7 +6,7 @@ from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
-from PIL import Image
+from PIL import Image, ImageDraw
 
 from simoc_sam import config
 from simoc_sam.displays import utils
@@ -46,10 +46,10 @@ def mock_mqtt_client(mock_mqtt_message):
 
 
 @asynccontextmanager
-async def mqtt_monitor_task(sensor_readings):
+async def mqtt_monitor_task(sensor_readings, notifier=None):
     """Context manager for running and cleaning up mqtt_monitor task."""
     async def monitor():
-        await utils.mqtt_monitor(sensor_readings)
+        await utils.mqtt_monitor(sensor_readings, notifier)
     task = asyncio.create_task(monitor())
     try:
         yield task
@@ -214,6 +214,54 @@ def test_format_values_max_rows(max_rows, expected_count):
         assert result[2] == "L3: 3"
 
 
+class CountedValue:
+    """A value that counts how many times it's formatted."""
+    count = 0
+    def __init__(self, value):
+        self.value = value
+    def __eq__(self, other):
+        return isinstance(other, CountedValue) and self.value == other.value
+    def __format__(self, spec):
+        CountedValue.count += 1
+        return format(self.value, spec)
+
+def test_display_template_only_formats_changed_lines():
+    """Test that lines are only formatted again when their values change."""
+    template = utils.DisplayTemplate(
+        "CO2: {scd30_co2:.0f}\nT: {bme_688_temperature:.1f}C\nTitle"
+    )
+    assert template.lines == [("CO2: {scd30_co2:.0f}", ("scd30_co2",)),
+                              ("T: {bme_688_temperature:.1f}C",
+                               ("bme_688_temperature",)),
+                              ("Title", ())]
+    readings = {'scd30': {'co2': CountedValue(450)},
+                'bme_688': {'temperature': CountedValue(25.0)}}
+    CountedValue.count = 0
+    assert template.format(readings) == ["CO2: 450", "T: 25.0C", "Title"]
+    assert CountedValue.count == 2
+    assert template.format(readings) == ["CO2: 450", "T: 25.0C", "Title"]
+    assert CountedValue.count == 2  # nothing changed
+    readings['scd30'] = {'co2': CountedValue(460)}
+    assert template.format(readings) == ["CO2: 460", "T: 25.0C", "Title"]
+    assert CountedValue.count == 3  # only the CO2 line changed
+    assert template.splits == {'scd30_co2': ('scd30', 'co2'),
+                               'bme_688_temperature': ('bme_688', 'temperature')}
+    assert template.format(readings, max_rows=1) == ["CO2: 460"]
+
+def test_display_template_invalid_line(capsys):
+    """Test that lines that can't be parsed are skipped."""
+    template = utils.DisplayTemplate("CO2: {scd30_co2\nOK")
+    assert template.format({'scd30': {'co2': 450}}) == ["OK"]
+    assert "Error parsing line 'CO2: {scd30_co2'" in capsys.readouterr().out
+
+def test_format_values_compiles_once():
+    """Test that format_values reuses the compiled template."""
+    with patch.object(config, 'display_format', "CO2: {scd30_co2}"):
+        utils.format_values({})
+        template = utils.compile_template(config.display_format)
+        assert utils.compile_template(config.display_format) is template
+
+
 @pytest.mark.asyncio
 async def test_mqtt_monitor_basic(mock_mqtt_client):
     """Test basic MQTT monitoring functionality."""
@@ -239,6 +287,41 @@ async def test_mqtt_monitor_override(mock_mqtt_client):
             await wait_until(lambda: 'bme688' in sensor_readings)
             assert sensor_readings['scd30'] == {'co2': 500, 'temp': 26.0}
 
+@pytest.mark.asyncio
+async def test_mqtt_monitor_notifies_changes(mock_mqtt_client):
+    """Test that MQTT monitor notifies the sensors that changed."""
+    sensor_readings = {}
+    notifier = utils.ChangeNotifier()
+    client = mock_mqtt_client([
+        ('location/testhost1/scd30', '{"co2": 450}'),
+        ('location/testhost1/bme688', '{"temp": 24.0}'),
+    ])
+    with patch('simoc_sam.displays.utils.aiomqtt.Client', return_value=client):
+        async with mqtt_monitor_task(sensor_readings, notifier):
+            await wait_until(lambda: 'bme688' in sensor_readings)
+            assert await notifier.wait(1) == {'scd30', 'bme688'}
+            assert await notifier.wait(0.01) == set()  # nothing new
+
+@pytest.mark.asyncio
+async def test_iter_frames():
+    """Test that frames are drawn on changes or after the idle interval."""
+    notifier = utils.ChangeNotifier()
+    frames = utils.iter_frames(notifier, min_interval=0.05, idle_interval=0.2)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    notifier.notify('scd30')
+    assert await frames.__anext__() == {'scd30'}
+    assert loop.time() - start < 0.05  # drawn immediately
+    notifier.notify('scd30')
+    notifier.notify('bme688')
+    # the changes are coalesced until min_interval elapsed
+    assert await frames.__anext__() == {'scd30', 'bme688'}
+    assert loop.time() - start >= 0.05
+    start = loop.time()
+    assert await frames.__anext__() == set()  # idle frame to update the uptime
+    assert loop.time() - start >= 0.2
+    await frames.aclose()
+
 @pytest.mark.asyncio
 async def test_mqtt_monitor_handles_json_error(mock_mqtt_message, mock_mqtt_client):
     """Test that MQTT monitor handles JSON decoding errors gracefully."""
@@ -342,3 +425,158 @@ def test_draw_image_respects_dimensions():
         assert image.size == (width, height)
         image = utils.draw_image(width, height, many_rows)
         assert image.size == (width, height)
+
+
+def test_get_dirty_bands():
+    """Test that get_dirty_bands finds the changed rows/bytes."""
+    prev = bytes(4 * 5)  # 5 rows of 4 bytes
+    assert utils.get_dirty_bands(None, prev, 4) == [(0, 5, 0, 4)]
+    assert utils.get_dirty_bands(prev, prev, 4) == []
+    cur = bytearray(prev)
+    cur[1*4 + 2] = 1  # row 1, byte 2
+    cur[2*4 + 0] = 1  # row 2, byte 0
+    cur[4*4 + 3] = 1  # row 4, byte 3
+    assert utils.get_dirty_bands(prev, bytes(cur), 4) == [
+        (1, 3, 0, 3), (4, 5, 3, 4),
+    ]
+
+def test_get_dirty_bands_images():
+    """Test that copying the dirty bands reproduces the new image."""
+    width, height = 128, 64
+    stride = width // 8
+    prev_image = utils.draw_image(width, height, ["Up 00:00:01", "CO2: 450"])
+    cur_image = utils.draw_image(width, height, ["Up 00:00:02", "CO2: 450"])
+    prev, cur = prev_image.tobytes(), cur_image.tobytes()
+    bands = utils.get_dirty_bands(prev, cur, stride)
+    assert bands
+    for row0, row1, col0, col1 in bands:
+        assert row1 <= height // 2  # only the first row changed
+        assert col1 - col0 < stride // 2  # only the last digit changed
+    result = bytearray(prev)
+    for row0, row1, col0, col1 in bands:
+        for row in range(row0, row1):
+            start = row * stride
+            result[start+col0:start+col1] = cur[start+col0:start+col1]
+    assert bytes(result) == cur
+
+def test_dirty_tracker():
+    """Test that DirtyTracker compares frames with the last update."""
+    tracker = utils.DirtyTracker(2)
+    frame1, frame2 = bytes([0, 0, 0, 0]), bytes([0, 0, 0, 1])
+    assert tracker.get_bands(frame1) == [(0, 2, 0, 2)]  # full frame
+    tracker.update(frame1)
+    assert tracker.get_bands(frame1) == []
+    assert tracker.get_bands(frame2) == [(1, 2, 1, 2)]
+    assert tracker.get_bands(frame2) == [(1, 2, 1, 2)]  # not updated yet
+    tracker.update(bytearray(frame2))
+    assert tracker.get_bands(frame2) == []
+    tracker.reset()
+    assert tracker.get_bands(frame2) == [(0, 2, 0, 2)]
+
+def draw_image_reference(width, height, rows):
+    """Draw the rows directly, without using the row cache."""
+    image = Image.new("1", (width, height), 0)
+    draw = ImageDraw.Draw(image)
+    spacing = max(8, height // len(rows))
+    y = 0
+    for row in rows:
+        if not row.strip():
+            y += 6
+        else:
+            draw.text((0, y), row, font=utils.FONT, fill=255)
+            y += spacing
+    return image
+
+@pytest.mark.parametrize("width, height, rows", [
+    (128, 64, ["SIMOC LIVE", "Up 00:01:02", "", "CO2: 450", "T: 25.50C"]),
+    (64, 128, ["Very long row that doesn't fit", "gjpqy", "A-x: -0.12"]),
+    (128, 32, ["Row"] * 10),  # overlapping rows
+])
+def test_draw_image_matches_reference(width, height, rows):
+    """Test that composing cached rows produces the same image."""
+    expected = draw_image_reference(width, height, rows)
+    for x in range(2):  # the second time the cached rows are used
+        image = utils.draw_image(width, height, rows)
+        assert image.tobytes() == expected.tobytes()
+        rotated = utils.draw_image(width, height, rows, rotate=True)
+        assert rotated.size == (height, width)
+        expected_rotated = expected.rotate(90, expand=True)
+        assert rotated.tobytes() == expected_rotated.tobytes()
+
+def test_row_cache_lru():
+    """Test that RowCache reuses bitmaps and evicts the oldest ones."""
+    cache = utils.RowCache(maxsize=2)
+    row_a = cache.get("A", utils.FONT, 64)
+    assert cache.get("A", utils.FONT, 64) is row_a
+    rotated_a = cache.get("A", utils.FONT, 64, rotate=True)
+    assert rotated_a.size == row_a.size[::-1]
+    cache.get("A", utils.FONT, 64)  # A is now the most recently used
+    cache.get("B", utils.FONT, 64)  # evicts the rotated A
+    assert [key[0] for key in cache.bitmaps] == ["A", "B"]
+    assert cache.get("A", utils.FONT, 64) is row_a
+    assert cache.get("A", utils.FONT, 128) is not row_a  # different width
+
+ROWS = [f"Row {x}" for x in range(7)]
+
+def test_paged_layout_pages():
+    """Test that the rows are split in pages cycled every page_interval."""
+    layout = utils.PagedLayout(128, 64, 3, mode='page', page_interval=5)
+    assert layout.get_pages(ROWS) == [ROWS[0:3], ROWS[3:6], ROWS[6:7]]
+    assert layout.get_pages([]) == [[]]
+    assert layout.get_rows(ROWS, now=4.9) == ROWS[0:3]
+    assert layout.get_rows(ROWS, now=5) == ROWS[3:6]
+    assert layout.get_rows(ROWS, now=14) == ROWS[6:7]
+    assert layout.get_rows(ROWS, now=15) == ROWS[0:3]
+    truncated = utils.PagedLayout(128, 64, 3, mode='')
+    assert truncated.get_rows(ROWS, now=5) == ROWS[0:3]
+    with pytest.raises(ValueError, match='Unknown layout mode'):
+        utils.PagedLayout(128, 64, 3, mode='marquee')
+
+def test_paged_layout_reuses_page_images():
+    """Test that only the pages that changed are rendered again."""
+    layout = utils.PagedLayout(128, 64, 3, mode='page', page_interval=5)
+    first = layout.render(ROWS, now=0)
+    assert first.tobytes() == utils.draw_image(128, 64, ROWS[0:3]).tobytes()
+    second = layout.render(ROWS, now=5)
+    assert second.tobytes() == utils.draw_image(128, 64, ROWS[3:6]).tobytes()
+    assert len(layout.images) == 3  # all the pages are pre-rendered
+    changed = [*ROWS[:6], "Row 6 changed"]
+    assert layout.render(changed, now=0) is first
+    assert layout.render(changed, now=5) is second
+    assert layout.render([], now=0) is None
+
+def test_paged_layout_scroll():
+    """Test that the rows scroll by scroll_speed pixels/second."""
+    layout = utils.PagedLayout(64, 32, 4, mode='scroll', scroll_speed=8)
+    assert layout.idle_interval >= 1 / 8
+    strip = utils.draw_image(64, 8 * len(ROWS), ROWS)  # 8px per row
+    for rotate in [False, True]:
+        layout = utils.PagedLayout(64, 32, 4, rotate=rotate,
+                                   mode='scroll', scroll_speed=8)
+        image = layout.render(ROWS, now=0)
+        assert layout.render(ROWS, now=0.1) is image  # didn't move yet
+        for now, offset in [(0, 0), (2, 16), (7, 0), (6.5, 52)]:
+            image = layout.render(ROWS, now=now)
+            if offset + 32 <= strip.height:
+                expected = strip.crop((0, offset, 64, offset + 32))
+            else:  # wrap around
+                expected = Image.new("1", (64, 32), 0)
+                expected.paste(strip.crop((0, offset, 64, strip.height)))
+                expected.paste(strip.crop((0, 0, 64, offset + 32 - strip.height)),
+                               (0, strip.height - offset))
+            if rotate:
+                expected = expected.rotate(90, expand=True)
+            assert image.tobytes() == expected.tobytes()
+    # the rows that fit are not scrolled
+    assert layout.render(ROWS[:3], now=2) is layout.render(ROWS[:3], now=3)
+
+def test_frame_drawer():
+    """Test that only the images that changed are shown."""
+    shown = []
+    layout = utils.PagedLayout(128, 64, 3, mode='page', page_interval=5)
+    drawer = utils.FrameDrawer(layout, shown.append)
+    assert drawer.draw(ROWS, now=0)
+    assert not drawer.draw(ROWS, now=1)  # same page
+    assert drawer.draw(ROWS, now=5)  # next page
+    assert not drawer.draw([], now=5)  # nothing to show
+    assert len(shown) == 2 and shown[0] is not shown[1]
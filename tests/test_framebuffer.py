@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from PIL import Image
+
+from simoc_sam.displays import framebuffer as fb
+from simoc_sam.displays import utils as display_utils
+
+from conftest import terminate_task, wait_until
+
+
+ROWS = ["SIMOC LIVE", "Up 00:00:01", "", "CO2: 450"]
+
+
+def test_memory_layouts():
+    """Test the conversion of the frames to the memory of the displays."""
+    image = Image.new("1", (4, 16), 0)
+    image.putpixel((0, 0), 1)
+    image.putpixel((1, 9), 1)
+    # 2 pages of 4 columns, with the top pixel in the LSB
+    pages = fb.to_pages(image)
+    assert pages == bytes([1, 0, 0, 0, 0, 2, 0, 0])
+    assert fb.from_pages(pages, image.size).tobytes() == image.tobytes()
+    # 16 rows of 2 bytes, with the left pixel in the high nibble
+    gray4 = fb.to_gray4(image)
+    assert len(gray4) == 16 * 2
+    assert gray4[:2] == bytes([0xF0, 0]) and gray4[18:20] == bytes([0x0F, 0])
+    assert fb.from_gray4(gray4, image.size).tobytes() == image.tobytes()
+
+@pytest.mark.parametrize('memory, size', [('pages', 128 * 64 // 8),
+                                          ('gray4', 128 * 64 // 2)])
+def test_framebuffer_update(memory, size):
+    """Test that the buffer only receives the changed bands."""
+    framebuffer = fb.FrameBuffer(128, 64, memory=memory)
+    image = display_utils.draw_image(128, 64, ROWS)
+    assert framebuffer.update(image) == 1  # the whole frame
+    assert framebuffer.bytes_transferred == size
+    assert framebuffer.get_image().tobytes() == image.tobytes()
+    assert framebuffer.update(image) == 0
+    assert framebuffer.frames == 1
+    changed = display_utils.draw_image(128, 64, [*ROWS[:3], "CO2: 451"])
+    assert framebuffer.update(changed) == 1
+    assert framebuffer.bytes_transferred < size * 1.25
+    assert framebuffer.get_image().tobytes() == changed.tobytes()
+    with pytest.raises(ValueError, match='Expected a'):
+        framebuffer.update(Image.new("1", (64, 128)))
+    with pytest.raises(ValueError, match='Unknown memory layout'):
+        fb.FrameBuffer(128, 64, memory='rgb565')
+
+def test_framebuffer_rotated(tmp_path):
+    """Test that rotated frames are saved upright."""
+    framebuffer = fb.FrameBuffer(128, 64, rotate=True)
+    image = display_utils.draw_image(64, 128, ROWS, rotate=True)
+    framebuffer.update(image)
+    upright = display_utils.draw_image(64, 128, ROWS)
+    assert framebuffer.get_image().tobytes() == upright.tobytes()
+    path = tmp_path / 'frames' / 'display.png'
+    framebuffer.save_png(path, scale=2)
+    with Image.open(path) as saved:
+        assert saved.format == 'PNG'
+        assert saved.size == (128, 256)
+    assert [p.name for p in path.parent.iterdir()] == ['display.png']
+
+def test_create_framebuffer():
+    framebuffer, layout = fb.create_framebuffer('ssd1327')
+    assert framebuffer.size == (128, 128)
+    assert framebuffer.memory == 'gray4'
+    assert len(framebuffer.buffer) == 128 * 128 // 2
+    assert layout.max_rows == 15
+    framebuffer, layout = fb.create_framebuffer('ssd1306')
+    assert framebuffer.size == (128, 64)
+    assert framebuffer.memory == 'pages'
+    assert len(framebuffer.buffer) == 128 * 64 // 8
+    assert (layout.width, layout.height) == (64, 128)
+    assert layout.rotate
+    with pytest.raises(ValueError, match='Unsupported display'):
+        fb.create_framebuffer('mockdisplay')
+
+@pytest.mark.asyncio
+async def test_update_display(tmp_path, monkeypatch):
+    """Test that the frames are saved when new readings arrive."""
+    monkeypatch.setattr('simoc_sam.config.display_format', 'CO2: {scd30_co2}')
+    monkeypatch.setitem(fb.SENSOR_READINGS, 'scd30', {'co2': 450})
+    framebuffer, layout = fb.create_framebuffer('ssd1327')
+    notifier = display_utils.ChangeNotifier()
+    path = tmp_path / 'display.png'
+    task = asyncio.create_task(
+        fb.update_display(framebuffer, layout, notifier, path))
+    try:
+        await wait_until(path.exists)
+        mtime = path.stat().st_mtime_ns
+        fb.SENSOR_READINGS['scd30'] = {'co2': 451}
+        notifier.notify('scd30')
+        await wait_until(lambda: framebuffer.frames == 2)
+        assert path.stat().st_mtime_ns >= mtime
+    finally:
+        await terminate_task(task)
@@ -0,0 +1,49 @@
+import pytest
+
+from simoc_sam import importbench
+
+
+IMPORTTIME_OUTPUT = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 | _io
+import time:       300 |        300 | simoc_sam
+import time:        50 |         50 |     simoc_sam.config
+import time:      1000 |       1500 |   simoc_sam.utils
+import time:       200 |       2000 | simoc_sam.siobridge
+"""
+
+def test_parse_importtime():
+    times = importbench.parse_importtime(IMPORTTIME_OUTPUT)
+    assert times == {
+        '_io': (120, 120, 0),
+        'simoc_sam': (300, 300, 0),
+        'simoc_sam.config': (50, 50, 2),
+        'simoc_sam.utils': (1000, 1500, 1),
+        'simoc_sam.siobridge': (200, 2000, 0),
+    }
+    # the interpreter startup imports are not included
+    assert importbench.get_import_time('simoc_sam.siobridge', times) == 2300
+
+@pytest.mark.parametrize('module, lazy_modules', [
+    ('simoc_sam.siobridge', ['pyarrow', 'PIL']),
+    ('simoc_sam.csvwriter', ['pyarrow']),
+    ('simoc_sam.sensors.utils', ['tomli', 'board']),
+    ('simoc_sam.sensors.scd30', ['board', 'busio']),
+])
+def test_lazy_imports(module, lazy_modules):
+    """Test that the heavy dependencies are not imported at import time."""
+    us, times, error = importbench.measure(module)
+    assert error is None
+    assert us > 0
+    for lazy_module in lazy_modules:
+        assert lazy_module not in times
+
+def test_measure_error():
+    us, times, error = importbench.measure('simoc_sam.nonexistent')
+    assert error == "ModuleNotFoundError: No module named 'simoc_sam.nonexistent'"
+
+def test_main(capsys):
+    importbench.main(['--repeat', '1', '--top', '2', 'json'])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith('json: ')
+    assert len(lines) == 3
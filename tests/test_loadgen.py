@@ -0,0 +1,71 @@
+import json
+import asyncio
+
+from unittest.mock import AsyncMock
+
+import pytest
+
+from simoc_sam import loadgen
+from simoc_sam.loadgen import VirtualSensors, LatencyStats
+
+
+@pytest.fixture(params=[False, True], ids=['python', 'numpy'])
+def use_numpy(request):
+    if request.param:
+        pytest.importorskip('numpy')
+    return request.param
+
+
+def test_virtual_sensors(use_numpy):
+    sensors = VirtualSensors(50, ['co2', 'humidity'], extra_fields=2,
+                             use_numpy=use_numpy)
+    assert sensors.use_numpy == use_numpy
+    for step in range(20):
+        readings = sensors.step()
+        assert len(readings) == 50
+        for reading in readings:
+            assert list(reading) == ['co2', 'humidity', 'extra_0', 'extra_1']
+            assert all(isinstance(value, float) for value in reading.values())
+            assert 0 <= reading['humidity'] <= 100
+            assert -100 <= reading['extra_0'] <= 100
+    # the values are random walks starting from the base values
+    co2 = [reading['co2'] for reading in readings]
+    assert 800 < sum(co2) / len(co2) < 1200
+    assert len(set(co2)) > 1
+
+def test_latency_stats():
+    stats = LatencyStats()
+    batch = [{'readings': {f'host{x}.mock': {'sent': 100 - x / 100}
+                           for x in range(100)}},
+             {'readings': {'host.mock': {'co2': 1000}}}]
+    stats.add_batch(batch, now=100)
+    summary = stats.pop_summary()
+    assert summary.startswith('received 101 readings; latency p50 0.49')
+    assert summary.endswith('max 0.990s')
+    assert stats.pop_summary() == 'received 0 readings'
+
+@pytest.mark.asyncio
+async def test_publish_readings():
+    # stop the generator after 3 ticks by failing the 10th publish
+    payloads = []
+    async def publish(topic, payload):
+        if len(payloads) == 9:
+            raise asyncio.CancelledError
+        payloads.append((topic, json.loads(payload)))
+    client = AsyncMock()
+    client.publish.side_effect = publish
+    sensors = VirtualSensors(3, ['co2'], use_numpy=False)
+    counter = dict(published=0, late=0)
+    with pytest.raises(asyncio.CancelledError):
+        await loadgen.publish_readings(sensors, client, 1000, counter)
+    assert counter['published'] == 9  # 3 readings for each tick
+    assert [reading['n'] for topic, reading in payloads] == [0]*3 + [1]*3 + [2]*3
+    topic, reading = payloads[-1]
+    assert topic.endswith('/loadgen00002/mock')
+    assert set(reading) == {'co2', 'n', 'timestamp', 'sent'}
+
+def test_parse_args():
+    args = loadgen.parse_args(['--sensors', '10', '--fields', 'co2'])
+    assert args.sensors == 10
+    assert args.fields == 'co2'
+    assert args.clients == 0
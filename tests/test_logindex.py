@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from simoc_sam import logindex
+
+
+def make_log(path, n, interval=None):
+    """Write a log with a reading every minute (and its index)."""
+    index = logindex.LogIndexWriter(path, interval) if interval else None
+    with open(path, 'w') as f:
+        for i in range(n):
+            timestamp = f'2024-03-06 {12 + i // 60:02}:{i % 60:02}:00.000000'
+            offset = f.tell()
+            f.write(json.dumps(dict(n=i, timestamp=timestamp)) + '\n')
+            if index:
+                index.add(timestamp, offset)
+
+@pytest.fixture
+def log_path(tmp_path):
+    return tmp_path / 'sam_host1_scd30.jsonl'
+
+
+def test_index_writer(log_path):
+    make_log(log_path, 25, interval=10)
+    index_path = logindex.get_index_path(log_path)
+    assert index_path.name == 'sam_host1_scd30.jsonl.idx'
+    entries = logindex.load_index(log_path)
+    assert [ts for ts, offset in entries] == [
+        '2024-03-06 12:00:00.000000', '2024-03-06 12:10:00.000000',
+        '2024-03-06 12:20:00.000000',
+    ]
+    with open(log_path, 'rb') as f:
+        for timestamp, offset in entries:
+            f.seek(offset)
+            assert json.loads(f.readline())['timestamp'] == timestamp
+
+def test_build_index(log_path):
+    make_log(log_path, 25, interval=10)
+    expected = logindex.load_index(log_path)
+    logindex.get_index_path(log_path).unlink()
+    assert logindex.load_index(log_path) == []
+    # invalid lines are skipped
+    with open(log_path, 'a') as f:
+        f.write('{"n": 25, "timest\n')
+    logindex.build_index(log_path, 10)
+    assert logindex.load_index(log_path) == expected
+
+def test_find_offset():
+    entries = [('2024-03-06 12:00', 0), ('2024-03-06 12:10', 100),
+               ('2024-03-06 12:20', 200)]
+    assert logindex.find_offset(entries, '2024-03-06 11:00') == 0
+    assert logindex.find_offset(entries, '2024-03-06 12:00') == 0
+    assert logindex.find_offset(entries, '2024-03-06 12:10') == 0
+    assert logindex.find_offset(entries, '2024-03-06 12:10:01') == 100
+    assert logindex.find_offset(entries, '2024-03-06 13:00') == 200
+    assert logindex.find_offset([], '2024-03-06 13:00') == 0
+
+@pytest.mark.parametrize('interval', [None, 1, 7, 100])
+def test_read_log_range(log_path, interval):
+    make_log(log_path, 120, interval=interval)
+    readings = logindex.read_log_range(log_path, '2024-03-06 12:55',
+                                       '2024-03-06 13:05')
+    assert [r['n'] for r in readings] == list(range(55, 65))
+    readings = logindex.read_log_range(log_path, end='2024-03-06 12:03')
+    assert [r['n'] for r in readings] == [0, 1, 2]
+    readings = logindex.read_log_range(log_path, '2024-03-06 13:58')
+    assert [r['n'] for r in readings] == [118, 119]
@@ -0,0 +1,62 @@
+import pytest
+
+from simoc_sam import metrics
+
+
+@pytest.fixture
+def registry():
+    return metrics.Metrics(labels={'sensor': 'scd30'})
+
+
+def test_counter(registry):
+    counter = registry.counter('test_total', 'A test counter.')
+    counter.inc()
+    counter.inc(2)
+    assert counter.value == 3
+    assert registry['test_total'] is counter
+
+def test_gauge(registry):
+    gauge = registry.gauge('test_value', 'A test gauge.')
+    gauge.set(5)
+    assert gauge.get() == 5
+    func_gauge = registry.gauge('test_func', 'A gauge with func.', lambda: 42)
+    assert func_gauge.get() == 42
+
+def test_histogram(registry):
+    histogram = registry.histogram('test_seconds', 'A histogram.', [0.1, 1])
+    for value in [0.05, 0.1, 0.5, 2]:
+        histogram.observe(value)
+    assert histogram.count == 4
+    assert histogram.sum == pytest.approx(2.65)
+    samples = dict(histogram.samples())
+    assert samples['test_seconds_bucket{le="0.1"}'] == 2
+    assert samples['test_seconds_bucket{le="1"}'] == 3
+    assert samples['test_seconds_bucket{le="+Inf"}'] == 4
+
+def test_to_prometheus(registry):
+    registry.counter('test_total', 'A test counter.').inc()
+    registry.histogram('test_seconds', 'A histogram.', [1]).observe(0.5)
+    assert registry.to_prometheus() == (
+        '# HELP test_total A test counter.\n'
+        '# TYPE test_total counter\n'
+        'test_total{sensor="scd30"} 1\n'
+        '# HELP test_seconds A histogram.\n'
+        '# TYPE test_seconds histogram\n'
+        'test_seconds_bucket{le="1",sensor="scd30"} 1\n'
+        'test_seconds_bucket{le="+Inf",sensor="scd30"} 1\n'
+        'test_seconds_sum{sensor="scd30"} 0.5\n'
+        'test_seconds_count{sensor="scd30"} 1\n'
+    )
+
+def test_to_dict():
+    registry = metrics.Metrics()
+    registry.counter('test_total', 'A test counter.').inc()
+    registry.gauge('test_value', 'A test gauge.').set(3)
+    assert registry.to_dict() == {'test_total': 1, 'test_value': 3}
+
+def test_write(registry, tmp_path):
+    registry.counter('test_total', 'A test counter.').inc()
+    path = tmp_path / 'metrics' / 'test.prom'
+    registry.write(path)
+    assert path.read_text() == registry.to_prometheus()
+    assert not path.with_suffix('.tmp').exists()
@@ -0,0 +1,30 @@
+import pytest
+
+from simoc_sam.msgwriter import BaseMessageWriter
+
+
+class ListWriter(BaseMessageWriter):
+    def __init__(self, **kwargs):
+        super().__init__('listwriter', metrics_interval=0, **kwargs)
+        self.messages = []
+
+    def write_batch(self, batch):
+        valid = [msg for msg in batch if msg[1] is not None]
+        self.messages.extend(valid)
+        return len(valid)
+
+
+def test_write_batch_is_abstract():
+    class NoWriteBatch(BaseMessageWriter):
+        pass
+    with pytest.raises(TypeError, match='write_batch'):
+        NoWriteBatch('nowritebatch')
+
+def test_message_writer():
+    writer = ListWriter(batch_size=10, batch_interval=0.01)
+    writer.start()
+    writer.put('topic1', b'1')
+    writer.put('topic2', None)  # skipped
+    writer.stop()
+    assert writer.messages == [('topic1', b'1')]
+    assert (writer.written, writer.skipped, writer.dropped) == (1, 1, 0)
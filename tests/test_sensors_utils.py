@@ -1,3 +1,7 @@
+import json
+
+import pytest
+
 from simoc_sam.sensors import utils
 from simoc_sam import config
 
@@ -67,3 +71,59 @@ def test_parse_args_mqtt_topic_sub():
     assert args.mqtt_topic_sub == config.mqtt_topic_sub
     args = utils.parse_args(['--mqtt-topic-sub', 'test/#'])
     assert args.mqtt_topic_sub == 'test/#'
+
+
+@pytest.fixture
+def fake_sysfs(tmp_path, monkeypatch):
+    """Create a fake sysfs tree with a couple of USB devices."""
+    devices = tmp_path / 'devices'
+    for name, vendor_id, product_id in [('usb1', '1d6b', '0002'),
+                                        ('1-1', '046D', 'C52B')]:
+        (devices / name).mkdir(parents=True)
+        (devices / name / 'idVendor').write_text(f'{vendor_id}\n')
+        (devices / name / 'idProduct').write_text(f'{product_id}\n')
+    (devices / '1-1:1.0').mkdir()  # interfaces don't have IDs
+    boot_id = tmp_path / 'boot_id'
+    boot_id.write_text('boot-1\n')
+    monkeypatch.setattr(utils, 'SYSFS_USB_DEVICES', devices)
+    monkeypatch.setattr(utils, 'BOOT_ID_PATH', boot_id)
+    monkeypatch.setattr(utils, '_mcp2221_cache', {})
+    monkeypatch.setattr(config, 'data_dir', tmp_path / 'data')
+    return devices
+
+def add_mcp2221(devices):
+    (devices / '1-2').mkdir()
+    (devices / '1-2' / 'idVendor').write_text('04d8\n')
+    (devices / '1-2' / 'idProduct').write_text('00dd\n')
+
+
+def test_get_usb_ids(fake_sysfs):
+    assert utils.get_usb_ids() == {('1d6b', '0002'), ('046d', 'c52b')}
+
+def test_has_mcp2221(fake_sysfs):
+    assert not utils.detect_mcp2221()
+    add_mcp2221(fake_sysfs)
+    assert utils.detect_mcp2221()
+    assert utils.has_mcp2221()
+    (fake_sysfs / '1-2' / 'idVendor').unlink()
+    assert utils.has_mcp2221()  # cached for the whole process
+    assert not (config.data_dir / 'mcp2221.json').exists()  # disabled
+
+def test_has_mcp2221_no_sysfs(fake_sysfs, monkeypatch):
+    monkeypatch.setattr(utils, 'SYSFS_USB_DEVICES', fake_sysfs / 'missing')
+    assert not utils.has_mcp2221()
+
+def test_mcp2221_disk_cache(fake_sysfs, monkeypatch):
+    monkeypatch.setattr(config, 'mcp2221_disk_cache', True)
+    add_mcp2221(fake_sysfs)
+    assert utils.detect_mcp2221()
+    cache_path = config.data_dir / 'mcp2221.json'
+    assert json.loads(cache_path.read_text()) == dict(boot_id='boot-1',
+                                                      has_mcp2221=True)
+    (fake_sysfs / '1-2' / 'idVendor').unlink()
+    assert utils.detect_mcp2221()  # the cache is used during the same boot
+    utils.BOOT_ID_PATH.write_text('boot-2\n')
+    assert not utils.detect_mcp2221()  # the cache is stale after a reboot
+    assert json.loads(cache_path.read_text())['boot_id'] == 'boot-2'
+    cache_path.write_text('invalid')
+    assert not utils.detect_mcp2221()
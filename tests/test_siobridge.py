@@ -2,13 +2,18 @@ import json
 import asyncio
 
 from copy import deepcopy
+from collections import defaultdict
 from contextlib import ExitStack
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
 from simoc_sam import siobridge
-from simoc_sam.sensors.basesensor import get_sensor_id
+from simoc_sam.sqlitewriter import SQLiteStore
+from simoc_sam.sensors.basesensor import get_log_path, get_sensor_id
 from conftest import wait_until, terminate_task
 
 
@@ -290,3 +295,171 @@ async def test_log_handler_missing_directory():
         mock_config.log_dir = '/nonexistent/directory'
         with pytest.raises(FileNotFoundError, match='Log directory does not exist'):
             await siobridge.log_handler()
+
+
+# tests for the replay data source
+
+@pytest.fixture
+def replay_logs(temp_log_dir, monkeypatch, mock_emit_to_subscribers):
+    """Create logs for two sensors and collect the replayed readings."""
+    monkeypatch.setattr('simoc_sam.config.log_dir', temp_log_dir)
+    monkeypatch.setattr('simoc_sam.config.sensors', ['scd30', 'sgp30', 'bme688'])
+    monkeypatch.setattr('simoc_sam.config.replay_speed', 0)
+    monkeypatch.setattr('simoc_sam.siobridge.SENSOR_READINGS',
+                        defaultdict(list))
+    for sensor, seconds in [('scd30', [0, 2, 4]), ('sgp30', [1, 3, 4])]:
+        with open(get_log_path(sensor), 'w') as f:
+            for n, sec in enumerate(seconds):
+                reading = dict(n=n, timestamp=f'2024-03-06 12:00:0{sec}.000000')
+                f.write(json.dumps(reading) + '\n')
+
+def get_replayed():
+    """Return the replayed readings as (sensor_id, n) tuples in order."""
+    readings = [(reading['timestamp'], sensor_id, reading['n'])
+                for sensor_id, sensor_readings in
+                siobridge.SENSOR_READINGS.items()
+                for reading in sensor_readings]
+    return [(sensor_id, n) for timestamp, sensor_id, n in sorted(readings)]
+
+@pytest.mark.asyncio
+async def test_replay_handler(replay_logs, mock_emit_to_subscribers):
+    await siobridge.replay_handler()
+    assert set(siobridge.SENSOR_INFO) == {'testhost1.scd30', 'testhost1.sgp30'}
+    assert get_replayed() == [
+        ('testhost1.scd30', 0), ('testhost1.sgp30', 0), ('testhost1.scd30', 1),
+        ('testhost1.sgp30', 1), ('testhost1.scd30', 2), ('testhost1.sgp30', 2),
+    ]
+    # the readings are merged in timestamp order
+    order = []
+    with patch.object(siobridge, 'SENSOR_READINGS',
+                      defaultdict(lambda: MagicMock(append=order.append))):
+        await siobridge.replay_handler()
+    assert [r['timestamp'][-9:-7] for r in order] == [
+        '00', '01', '02', '03', '04', '04'
+    ]
+
+@pytest.mark.asyncio
+async def test_replay_handler_bundles(replay_logs, mock_emit_to_subscribers,
+                                      monkeypatch):
+    monkeypatch.setattr('simoc_sam.config.sensor_read_delay', 2)
+    with open(get_log_path('sgp30'), 'a') as f:
+        f.write(json.dumps(dict(n=3)) + '\n')  # no timestamp, skipped
+    await siobridge.replay_handler()
+    # with speed 0 a bundle is still emitted every 2s of log time
+    bundles = [call.args[1][0] for call in
+               mock_emit_to_subscribers.call_args_list
+               if call.args[0] == 'step-batch']
+    assert [(bundle['n'], bundle['timestamp'],
+             {sid: r['n'] for sid, r in bundle['readings'].items()})
+            for bundle in bundles] == [
+        (0, '2024-03-06 12:00:02', {'testhost1.scd30': 0, 'testhost1.sgp30': 0}),
+        (1, '2024-03-06 12:00:04', {'testhost1.scd30': 1, 'testhost1.sgp30': 1}),
+        (2, '2024-03-06 12:00:06', {'testhost1.scd30': 2, 'testhost1.sgp30': 2}),
+    ]
+
+@pytest.mark.asyncio
+async def test_replay_handler_range_and_speed(replay_logs, monkeypatch):
+    monkeypatch.setattr('simoc_sam.config.replay_start', '2024-03-06 12:00:01')
+    monkeypatch.setattr('simoc_sam.config.replay_end', '2024-03-06 12:00:04')
+    monkeypatch.setattr('simoc_sam.config.replay_speed', 50)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    await siobridge.replay_handler()
+    # 2 seconds of data at 50x speed
+    assert loop.time() - start >= 0.04
+    assert get_replayed() == [
+        ('testhost1.sgp30', 0), ('testhost1.scd30', 1), ('testhost1.sgp30', 1),
+    ]
+
+@pytest.mark.asyncio
+async def test_replay_handler_no_logs(temp_log_dir, monkeypatch):
+    monkeypatch.setattr('simoc_sam.config.log_dir', temp_log_dir)
+    with pytest.raises(FileNotFoundError, match='No log files'):
+        await siobridge.replay_handler()
+
+
+# historical data API
+
+@pytest.fixture
+def recorded_data(tmp_path, monkeypatch):
+    """Create a recorder database with some scd30 readings."""
+    monkeypatch.setattr('simoc_sam.config.data_dir', tmp_path)
+    monkeypatch.setattr('simoc_sam.config.location', 'sam')
+    store = SQLiteStore(tmp_path / 'readings.db')
+    for n in range(6):
+        for host, co2 in [('host1', 400), ('host2', 500)]:
+            store.add('scd30', f'sam.{host}.scd30',
+                      dict(n=n, timestamp=f'2024-03-06 12:00:{n*10:02}.5',
+                           co2=co2 + n, temperature=20))
+    store.close()
+
+async def request_readings(query):
+    request = make_mocked_request('GET', f'/api/readings?{query}')
+    response = await siobridge.get_readings(request)
+    return json.loads(response.text)
+
+def test_create_app_routes():
+    app = siobridge.create_app()
+    routes = [route.resource.canonical for route in app.router.routes()]
+    assert '/api/readings' in routes
+    assert '/api/display.png' in routes
+
+@pytest.mark.asyncio
+async def test_get_readings(recorded_data):
+    data = await request_readings('sensor=host1.scd30&fields=co2'
+                                  '&from=2024-03-06 12:00:10'
+                                  '&to=2024-03-06 12:00:30')
+    assert data['sensor_id'] == 'sam.host1.scd30'
+    assert not data['truncated']
+    assert data['readings'] == [
+        dict(sensor_id='sam.host1.scd30', n=1,
+             timestamp='2024-03-06 12:00:10.5', co2=401.0),
+        dict(sensor_id='sam.host1.scd30', n=2,
+             timestamp='2024-03-06 12:00:20.5', co2=402.0),
+    ]
+
+@pytest.mark.asyncio
+async def test_get_readings_downsampled(recorded_data, monkeypatch):
+    query = ('sensor=sam.host2.scd30&resolution=30&fields=co2'
+             '&from=2024-03-06 12:00&to=2024-03-06 12:01')
+    data = await request_readings(query)
+    assert data['readings'] == [
+        dict(timestamp='2024-03-06 12:00:00', samples=3,
+             sensor_id='sam.host2.scd30', co2=501.0),
+        dict(timestamp='2024-03-06 12:00:30', samples=3,
+             sensor_id='sam.host2.scd30', co2=504.0),
+    ]
+    monkeypatch.setattr('simoc_sam.config.api_max_readings', 1)
+    data = await request_readings(query)
+    assert data['truncated']
+    assert len(data['readings']) == 1
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('query, error', [
+    ('', web.HTTPBadRequest),
+    ('sensor=scd30', web.HTTPBadRequest),
+    ('sensor=host1.scd30&resolution=x', web.HTTPBadRequest),
+    ('sensor=host1.scd30&resolution=-1', web.HTTPBadRequest),
+    ('sensor=host1.scd30&fields=tvoc', web.HTTPBadRequest),
+    ('sensor=host1.unknown', web.HTTPNotFound),
+])
+async def test_get_readings_errors(recorded_data, query, error):
+    with pytest.raises(error):
+        await request_readings(query)
+
+@pytest.mark.asyncio
+async def test_get_readings_no_database(tmp_path, monkeypatch):
+    monkeypatch.setattr('simoc_sam.config.data_dir', tmp_path)
+    with pytest.raises(web.HTTPServiceUnavailable):
+        await request_readings('sensor=host1.scd30')
+
+@pytest.mark.asyncio
+async def test_get_display_frame(tmp_path, monkeypatch):
+    monkeypatch.setattr('simoc_sam.config.data_dir', tmp_path)
+    request = make_mocked_request('GET', '/api/display.png')
+    with pytest.raises(web.HTTPNotFound):
+        await siobridge.get_display_frame(request)
+    (tmp_path / 'display.png').write_bytes(b'\x89PNG...')
+    response = await siobridge.get_display_frame(request)
+    assert response.content_type == 'image/png'
+    assert response.body == b'\x89PNG...'
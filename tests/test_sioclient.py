@@ -0,0 +1,112 @@
+import csv
+
+from unittest.mock import patch
+
+import pytest
+
+from simoc_sam import sioclient
+from simoc_sam.sensors.aggregation import aggregate_readings
+
+
+SENSOR_INFO = {
+    'host1.scd30': {'sensor_id': 'host1.scd30',
+                    'reading_info': {'co2': {}, 'temperature': {},
+                                     'humidity': {}}},
+}
+
+@pytest.fixture(autouse=True)
+def reset_globals():
+    with patch.object(sioclient, 'csv_writer', None), \
+         patch.object(sioclient, 'FIELDNAMES', ['timestamp']), \
+         patch.object(sioclient, 'FIELDSET', {'timestamp'}), \
+         patch.dict(sioclient.COLUMNS, clear=True), \
+         patch.dict(sioclient.SENSOR_INFO, SENSOR_INFO, clear=True):
+        yield
+        if sioclient.csv_writer is not None:
+            sioclient.csv_writer.close()
+
+def read_csv(path):
+    with open(path, newline='') as f:
+        return list(csv.reader(f))
+
+def make_bundle(timestamp, **readings):
+    return {'timestamp': timestamp, 'readings': readings}
+
+
+def test_csv_log_writer(tmp_path):
+    writer = sioclient.CSVLogWriter(tmp_path / 'log.csv')
+    writer.write_rows([{'a': 1, 'b': 2}], ['a', 'b'])
+    writer.write_rows([{'a': 3}], ['a', 'b'])
+    assert writer.path == tmp_path / 'log.csv'
+    # new fields start a new segment, the old file is left untouched
+    writer.write_rows([{'a': 4, 'c': 5}], ['a', 'b', 'c'])
+    assert writer.path == tmp_path / 'log_2.csv'
+    writer.close()
+    assert read_csv(tmp_path / 'log.csv') == [['a', 'b'], ['1', '2'], ['3', '']]
+    assert read_csv(tmp_path / 'log_2.csv') == [['a', 'b', 'c'], ['4', '', '5']]
+
+def test_to_csv(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sioclient.to_csv([
+        make_bundle('t0', **{'host1.scd30': dict(n=0, timestamp='x', co2=400)}),
+        make_bundle('t1', **{'host1.scd30': dict(n=1, timestamp='x', co2=410,
+                                                 temperature=20)}),
+    ])
+    path = sioclient.csv_writer.path
+    assert path.name.startswith('simoc_log_')
+    # fields not in reading_info are added too
+    sioclient.to_csv([
+        make_bundle('t2', **{'host1.scd30': dict(n=2, timestamp='x', co2=420,
+                                                 extra=1)}),
+    ])
+    new_path = sioclient.csv_writer.path
+    assert new_path != path
+    sioclient.csv_writer.close()
+    # humidity is never sent, so it has no column
+    assert read_csv(path) == [
+        ['timestamp', 'host1.scd30_co2', 'host1.scd30_temperature'],
+        ['t0', '400', ''], ['t1', '410', '20'],
+    ]
+    assert read_csv(new_path) == [
+        ['timestamp', 'host1.scd30_co2', 'host1.scd30_temperature',
+         'host1.scd30_extra'],
+        ['t2', '420', '', '1'],
+    ]
+
+@pytest.mark.asyncio
+async def test_sensor_info_updates_columns(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    info = {'host2.bme688': {'sensor_id': 'host2.bme688',
+                             'reading_info': {'temperature': {}}}}
+    await sioclient.sensor_info(info)
+    assert sioclient.COLUMNS == {
+        'host2.bme688': {'timestamp': None, 'n': None,
+                         'temperature': 'host2.bme688_temperature'},
+    }
+    # the columns are only added once the fields are received
+    assert sioclient.FIELDNAMES == ['timestamp']
+    sioclient.to_csv([make_bundle('t0', **{'host2.bme688': dict(temperature=20)})])
+    assert sioclient.FIELDNAMES == ['timestamp', 'host2.bme688_temperature']
+    assert sioclient.csv_writer.segment == 1
+
+@pytest.mark.asyncio
+async def test_step_batch_aggregated(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    reading_info = {'co2': dict(label='CO2', unit='ppm'),
+                    'temperature': dict(label='Temperature', unit='°C')}
+    sioclient.SENSOR_INFO['host1.scd30'] = dict(sensor_id='host1.scd30',
+                                                reading_info=reading_info)
+    reading = aggregate_readings([dict(co2=400, temperature=20),
+                                  dict(co2=410, temperature=21)])
+    reading.update(n=0, timestamp='2024-03-06 14:00:00.000000')
+    await sioclient.step_batch([make_bundle('t0', **{'host1.scd30': reading})])
+    out = capsys.readouterr().out
+    assert 'CO2: 405.00 ppm' in out
+    assert 'CO2 (max): 410 ppm' in out
+    assert 'Samples: 2' in out
+
+def test_to_csv_missing_sensor_id(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sioclient.SENSOR_INFO['host1.scd30'] = {'sensor_id': None}
+    with pytest.raises(ValueError, match='sensor_id must be defined'):
+        sioclient.to_csv([make_bundle('t0', **{'host1.scd30': dict(co2=400)})])
@@ -0,0 +1,147 @@
+import json
+import sqlite3
+
+from unittest import mock
+
+import pytest
+
+from simoc_sam import sqlitewriter
+from simoc_sam.sqlitewriter import SQLiteStore, SQLiteWriter
+from simoc_sam.sensors.aggregation import aggregate_readings
+
+
+def make_payload(n, timestamp, **fields):
+    return json.dumps(dict(n=n, timestamp=timestamp, **fields)).encode()
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteStore(tmp_path / 'readings.db')
+    yield store
+    store.close()
+
+
+def test_tables_and_indexes(store):
+    conn = store.conn
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    columns = {row[1]: row[2] for row in
+               conn.execute('PRAGMA table_info("sgp30")')}
+    assert columns == {'sensor_id': 'TEXT', 'n': 'INTEGER',
+                       'timestamp': 'TEXT', 'eco2': 'INTEGER',
+                       'tvoc': 'INTEGER', 'h2': 'INTEGER',
+                       'ethanol': 'INTEGER'}
+    indexes = [row[1] for row in conn.execute('PRAGMA index_list("scd30")')]
+    assert indexes == ['scd30_sensor_id_timestamp']
+
+def test_new_columns_are_added(tmp_path):
+    db_path = tmp_path / 'readings.db'
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE scd30 (sensor_id TEXT, n INTEGER, '
+                 'timestamp TEXT, co2 REAL)')
+    conn.close()
+    store = SQLiteStore(db_path)
+    store.add('scd30', 'sam.host1.scd30',
+              dict(n=0, timestamp='2024-03-06 12:00:00', co2=400, humidity=50))
+    store.commit()
+    columns, rows = store.query('scd30')
+    assert columns == ['sensor_id', 'n', 'timestamp',
+                       'co2', 'temperature', 'humidity']
+    assert list(rows) == [('sam.host1.scd30', 0, '2024-03-06 12:00:00',
+                           400.0, None, 50.0)]
+    store.close()
+
+def test_aggregated_columns(store):
+    columns = store.columns['scd30']
+    assert 'co2_max' not in columns  # only added for aggregated readings
+    store.add('scd30', 'sam.host1.scd30',
+              dict(n=0, timestamp='2024-03-06 12:00:00', co2=400))
+    reading = aggregate_readings([dict(co2=400), dict(co2=601)],
+                                 stats=['min', 'max'])
+    store.add('scd30', 'sam.host1.scd30',
+              dict(n=1, timestamp='2024-03-06 12:01:00', **reading))
+    store.commit()
+    columns, rows = store.query('scd30',
+                                fields=['co2', 'co2_min', 'co2_max', 'samples'])
+    assert list(rows) == [
+        ('sam.host1.scd30', 0, '2024-03-06 12:00:00', 400.0, None, None, None),
+        ('sam.host1.scd30', 1, '2024-03-06 12:01:00', 500.5, 400.0, 601.0, 2),
+    ]
+
+def test_query(store):
+    for n in range(4):
+        for host in ['host1', 'host2']:
+            store.add('scd30', f'sam.{host}.scd30',
+                      dict(n=n, timestamp=f'2024-03-06 1{n}:30:00.123456',
+                           co2=400 + n))
+    assert not list(store.query('scd30')[1])  # not committed yet
+    store.commit()
+    columns, rows = store.query('scd30', 'sam.host2.scd30',
+                                '2024-03-06 11:00', '2024-03-06 13:00',
+                                fields=['co2'])
+    assert columns == ['sensor_id', 'n', 'timestamp', 'co2']
+    assert list(rows) == [
+        ('sam.host2.scd30', 1, '2024-03-06 11:30:00.123456', 401.0),
+        ('sam.host2.scd30', 2, '2024-03-06 12:30:00.123456', 402.0),
+    ]
+    with pytest.raises(ValueError, match='Unknown fields'):
+        store.query('scd30', fields=['tvoc'])
+    with pytest.raises(KeyError):
+        store.query('unknown')
+
+def test_writer(store):
+    writer = SQLiteWriter(store, batch_size=2, commit_interval=0.01,
+                          metrics_interval=0)
+    writer.put('sam/host1/scd30', make_payload(0, '2024-03-06 12:00:00',
+                                               co2=400))
+    writer.put('sam/host1/unknown', make_payload(0, '2024-03-06 12:00:00'))
+    writer.put('sam/host1/scd30', b'invalid json')
+    writer.put('sam/host1/sgp30', make_payload(0, '2024-03-06 12:00:01',
+                                               tvoc=10))
+    writer.start()
+    writer.stop()
+    assert writer.written == 2
+    assert writer.skipped == 2  # the unknown sensor and the invalid json
+    assert list(store.query('scd30', fields=['co2'])[1]) == [
+        ('sam.host1.scd30', 0, '2024-03-06 12:00:00', 400.0),
+    ]
+    assert list(store.query('sgp30', fields=['tvoc'])[1]) == [
+        ('sam.host1.sgp30', 0, '2024-03-06 12:00:01', 10),
+    ]
+
+def test_writer_queue_full(store):
+    writer = SQLiteWriter(store, max_queue_size=1, metrics_interval=0)
+    writer.put('sam/host1/scd30', make_payload(0, '2024-03-06 12:00:00'))
+    writer.put('sam/host1/scd30', make_payload(1, '2024-03-06 12:00:01'))
+    assert writer.dropped == 1
+
+def test_on_message(store, monkeypatch):
+    monkeypatch.setattr('simoc_sam.config.mqtt_topic_sub', 'sam/#')
+    client = mock.Mock()
+    sqlitewriter.on_connect(client, None, None, 0)
+    client.subscribe.assert_called_once_with('sam/#')
+    writer = SQLiteWriter(store, metrics_interval=0)
+    msg = mock.Mock(topic='sam/host1/scd30', payload=b'{}')
+    sqlitewriter.on_message(client, writer, msg)
+    assert writer.queue.get_nowait() == ('sam/host1/scd30', b'{}')
+
+def test_query_cli(store, capsys, monkeypatch):
+    monkeypatch.setattr('simoc_sam.config.location', 'sam')
+    store.add('scd30', 'sam.host1.scd30',
+              dict(n=0, timestamp='2024-03-06 12:00:00', co2=400))
+    store.add('scd30', 'sam.host2.scd30',
+              dict(n=0, timestamp='2024-03-06 12:00:00', co2=500))
+    store.commit()
+    sqlitewriter.main(['--db', str(store.path), 'query', 'scd30',
+                       '--host', 'host1', '--fields', 'co2'])
+    assert capsys.readouterr().out.splitlines() == [
+        'sensor_id,n,timestamp,co2',
+        'sam.host1.scd30,0,2024-03-06 12:00:00,400.0',
+    ]
+    with pytest.raises(SystemExit, match='Unknown fields'):
+        sqlitewriter.main(['--db', str(store.path), 'query', 'scd30',
+                           '--fields', 'tvoc'])
+
+def test_query_cli_missing_db(tmp_path):
+    db_path = tmp_path / 'missing.db'
+    with pytest.raises(SystemExit, match='unable to open'):
+        sqlitewriter.main(['--db', str(db_path), 'query', 'scd30'])
+    assert not db_path.exists()  # the db is opened read-only